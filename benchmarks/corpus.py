@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+import csv
+import getopt
+import os
+import sys
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from constants import IMPORTANT_COURTS, MOST_IMPORTANT_COURTS  # noqa: E402
+
+DEFAULT_DOCS = 1000
+DEFAULT_SEED = 3245
+# mean words of content per doc, judgments run long
+DEFAULT_DOC_WORDS = 800
+# words past the legal vocabulary, made up from syllables for a long tail
+TAIL_WORDS = 20000
+ZIPF_EXPONENT = 1.1
+
+LEGAL_WORDS = (
+    "appeal appellant respondent plaintiff defendant court judge justice "
+    "contract breach damages negligence duty care liability tort claim "
+    "evidence witness testimony trial jury verdict sentence conviction "
+    "criminal murder theft fraud assault offence prosecution accused "
+    "property land lease landlord tenant trust trustee estate probate will "
+    "company director shareholder insolvency bankruptcy creditor debt "
+    "injunction order application motion hearing costs interest statute "
+    "section act regulation constitution jurisdiction precedent authority "
+    "reasonable foreseeable causation loss remedy compensation restitution "
+    "equity estoppel misrepresentation consideration offer acceptance "
+    "agreement clause term condition warranty indemnity insurance policy "
+    "employment employer employee dismissal discrimination copyright patent "
+    "trademark infringement licence arbitration award tribunal review"
+).split()
+STOP_WORDS = "the of and to in a that is was for on by with as be it".split()
+PARTIES = (
+    "tan lim wong lee smith jones brown chen ng koh ong goh teo chua "
+    "holdings bank council minister commissioner crown state pty ltd"
+).split()
+SYLLABLES = "ka ri to mel san dor vi nu pe la gor tis ben ar ux fen qua lo".split()
+OTHER_COURTS = (
+    "NSW District Court",
+    "NSW Local Court",
+    "NSW Land and Environment Court",
+    "SG District Court",
+    "SG Family Court",
+    "UK Court of Protection",
+    "HK District Court",
+    "Industrial Relations Court of Australia",
+)
+# a typical dataset has more judgments from lower courts
+COURT_SHARES = (
+    (MOST_IMPORTANT_COURTS, 0.2),
+    (IMPORTANT_COURTS, 0.4),
+    (OTHER_COURTS, 0.4),
+)
+FIRST_YEAR = 1950
+LAST_YEAR = 2021
+
+
+def usage():
+    print(
+        "usage: "
+        + sys.argv[0]
+        + " -o dataset-file [-n docs] [-s seed] [-w mean-words-per-doc]"
+        + "\n       writes a synthetic dataset in the index.py input schema"
+    )
+
+
+def get_vocabulary(rng) -> list[str]:
+    tail = {
+        "".join(rng.choice(SYLLABLES, size=rng.integers(2, 5)))
+        for _ in range(TAIL_WORDS)
+    }
+    tail -= set(LEGAL_WORDS)
+    # stopwords and legal words take the most frequent ranks
+    return STOP_WORDS + LEGAL_WORDS + sorted(tail)
+
+
+def get_courts() -> tuple[list[str], np.ndarray]:
+    courts = []
+    shares = []
+    for group, share in COURT_SHARES:
+        courts.extend(group)
+        shares.extend([share / len(group)] * len(group))
+    return courts, np.array(shares)
+
+
+def generate_docs(
+    num_docs: int, seed: int = DEFAULT_SEED, doc_words: int = DEFAULT_DOC_WORDS
+):
+    """
+    Yields:
+        (int, str, str, str, str): document_id, title, content, date_posted
+                                   and court of each synthetic judgment, with
+                                   Zipf distributed words, deterministic for
+                                   a seed
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(get_vocabulary(rng))
+    ranks = np.arange(1, len(vocabulary) + 1)
+    word_shares = 1 / ranks**ZIPF_EXPONENT
+    word_shares /= word_shares.sum()
+    courts, court_shares = get_courts()
+
+    doc_id = 0
+    for _ in range(num_docs):
+        doc_id += int(rng.integers(1, 20))
+        parties = rng.choice(PARTIES, size=2, replace=False)
+        subject = " ".join(rng.choice(LEGAL_WORDS, size=rng.integers(1, 4)))
+        title = f"{parties[0].title()} v {parties[1].title()} {subject}"
+
+        length = max(10, int(rng.normal(doc_words, doc_words / 4)))
+        content = " ".join(rng.choice(vocabulary, size=length, p=word_shares))
+
+        year = int(rng.integers(FIRST_YEAR, LAST_YEAR + 1))
+        date = f"{year}-{rng.integers(1, 13):02d}-{rng.integers(1, 29):02d} 00:00:00"
+        court = courts[rng.choice(len(courts), p=court_shares)]
+        yield doc_id, title, content, date, court
+
+
+def write_corpus(
+    path, num_docs: int, seed: int = DEFAULT_SEED, doc_words: int = DEFAULT_DOC_WORDS
+):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(["document_id", "title", "content", "date_posted", "court"])
+        writer.writerows(generate_docs(num_docs, seed, doc_words))
+
+
+def main():
+    output_file = None
+    num_docs = DEFAULT_DOCS
+    seed = DEFAULT_SEED
+    doc_words = DEFAULT_DOC_WORDS
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "o:n:s:w:")
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == "-o":
+            output_file = a
+        elif o == "-n":
+            num_docs = int(a)
+        elif o == "-s":
+            seed = int(a)
+        elif o == "-w":
+            doc_words = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if output_file == None:
+        usage()
+        sys.exit(2)
+
+    write_corpus(output_file, num_docs, seed, doc_words)
+
+
+if __name__ == "__main__":
+    main()
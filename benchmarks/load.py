@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+import asyncio
+import getopt
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from client import open_connection  # noqa: E402
+from suite import PERCENTILES, get_commit  # noqa: E402
+
+DEFAULT_CONNECTIONS = 8
+DEFAULT_REQUESTS = 1000
+# how long a server started here may take to load its index
+STARTUP_SECONDS = 120
+
+
+def usage():
+    print(
+        "usage: "
+        + sys.argv[0]
+        + " -q queries-file (-s socket-path|host:port | -d dictionary-file"
+        + " -p postings-file [-w server-workers]) [-c connections]"
+        + " [-n requests] [-o output.json]"
+        + "\n       replays the queries, one per line, round robin over -c"
+        + "\n       connections to server.py, each waiting for its response"
+        + "\n       before sending the next, and writes throughput and latency"
+        + "\n       as JSON; given -d -p instead of -s it starts its own server"
+    )
+
+
+async def run_connection(address, queries, offset, num_requests, samples):
+    reader, writer = await open_connection(address)
+    for i in range(num_requests):
+        query = queries[(offset + i) % len(queries)]
+        start = time.perf_counter()
+        writer.write((query.strip() + "\n").encode("utf-8"))
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        latency = (time.perf_counter() - start) * 1000
+        samples.append((latency, response.get("batch", 1), "error" in response))
+    writer.close()
+    await writer.wait_closed()
+
+
+async def generate_load(address, queries, connections, num_requests) -> dict:
+    samples = []
+    per_connection = [
+        num_requests // connections + (i < num_requests % connections)
+        for i in range(connections)
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            run_connection(
+                address, queries, i * len(queries) // connections, n, samples
+            )
+            for i, n in enumerate(per_connection)
+        )
+    )
+    seconds = time.perf_counter() - start
+
+    latencies = [latency for latency, _, _ in samples]
+    report = {
+        "connections": connections,
+        "requests": len(samples),
+        "errors": sum(error for _, _, error in samples),
+        "seconds": seconds,
+        "queries_per_s": len(samples) / seconds if seconds > 0 else None,
+        "mean_ms": float(np.mean(latencies)) if latencies else None,
+        "mean_batch": float(np.mean([batch for _, batch, _ in samples]))
+        if samples
+        else None,
+    }
+    for percentile in PERCENTILES:
+        value = np.percentile(latencies, percentile) if latencies else None
+        report[f"p{percentile}_ms"] = None if value is None else float(value)
+    return report
+
+
+def start_server(dictionary_file, postings_file, address, workers):
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(REPO_DIR, "server.py"),
+            "-d",
+            dictionary_file,
+            "-p",
+            postings_file,
+            "-s",
+            address,
+            "-w",
+            str(workers),
+        ],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    # the server announces itself once its workers are warm
+    deadline = time.monotonic() + STARTUP_SECONDS
+    for line in server.stderr:
+        if line.startswith("serving queries"):
+            return server
+        if time.monotonic() > deadline:
+            break
+    server.kill()
+    raise RuntimeError("server did not start")
+
+
+def main():
+    address = queries_file = output_file = None
+    dictionary_file = postings_file = None
+    connections = DEFAULT_CONNECTIONS
+    num_requests = DEFAULT_REQUESTS
+    workers = 1
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "s:q:d:p:w:c:n:o:")
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == "-s":
+            address = a
+        elif o == "-q":
+            queries_file = a
+        elif o == "-d":
+            dictionary_file = a
+        elif o == "-p":
+            postings_file = a
+        elif o == "-w":
+            workers = int(a)
+        elif o == "-c":
+            connections = int(a)
+        elif o == "-n":
+            num_requests = int(a)
+        elif o == "-o":
+            output_file = a
+        else:
+            assert False, "unhandled option"
+
+    own_server = dictionary_file != None and postings_file != None
+    if queries_file == None or (address == None and not own_server):
+        usage()
+        sys.exit(2)
+    if address != None and own_server:
+        usage()
+        sys.exit(2)
+
+    with open(queries_file, "r") as f:
+        queries = [line for line in f if line.strip()]
+
+    with tempfile.TemporaryDirectory() as socket_dir:
+        server = None
+        if own_server:
+            address = os.path.join(socket_dir, "server.sock")
+            server = start_server(dictionary_file, postings_file, address, workers)
+        try:
+            report = asyncio.run(
+                generate_load(address, queries, connections, num_requests)
+            )
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    report = {"commit": get_commit(), "queries": len(queries), **report}
+    if own_server:
+        report["server_workers"] = workers
+    if output_file != None:
+        with open(output_file, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
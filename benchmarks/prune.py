@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+import contextlib
+import getopt
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import retrieve  # noqa: E402
+import search  # noqa: E402
+from corpus import DEFAULT_DOC_WORDS, DEFAULT_DOCS, DEFAULT_SEED, write_corpus  # noqa: E402
+from index import build_index  # noqa: E402
+from pruning import Pruning  # noqa: E402
+from suite import (  # noqa: E402
+    DEFAULT_QUERIES,
+    PERCENTILES,
+    get_commit,
+    read_workload,
+    sample_workload,
+)
+
+DEFAULT_K = 10
+
+
+def usage():
+    print(
+        "usage: "
+        + sys.argv[0]
+        + " [-n docs] [-w mean-words-per-doc] [-s seed] [-i dataset-file]"
+        + " [-j workers] [-e engine] [-k max-results] [-q queries-file]"
+        + " [-Q queries] [-t threshold] [--prune-biwords min-df]"
+        + " [--prune-epsilon e] [--prune-cap max-postings] [-o output.json]"
+        + "\n       builds the dataset (synthetic unless -i) with and without"
+        + "\n       static pruning, runs the same queries on both and writes"
+        + "\n       the size saved and how far the pruned top k drift as JSON"
+    )
+
+
+def build(dataset_file, index_dir, workers, pruning=None) -> dict:
+    os.makedirs(index_dir)
+    out_dict = os.path.join(index_dir, "dictionary")
+    out_postings = os.path.join(index_dir, "postings")
+    # keep stdout for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        build_index(dataset_file, out_dict, out_postings, workers, pruning=pruning)
+    return {
+        "dictionary": out_dict,
+        "postings": out_postings,
+        "dictionary_bytes": os.path.getsize(out_dict),
+        "postings_bytes": os.path.getsize(out_postings),
+        "index_bytes": sum(
+            os.path.getsize(os.path.join(index_dir, name))
+            for name in os.listdir(index_dir)
+        ),
+    }
+
+
+def rank_workload(index, workload, engine, k):
+    """
+    Returns:
+        (list(list(int)), list(float)): The results of each query and its
+                                        latency in ms
+    """
+    retrieve.set_dictionary(index["dictionary"])
+    retrieve.set_posting_file(index["postings"])
+    results = []
+    latencies = []
+    for terms in workload:
+        start = time.perf_counter()
+        results.append(search.run_query(terms, engine, k))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, latencies
+
+
+def get_drift(full_results, pruned_results) -> dict:
+    # only queries with results on the full index can drift
+    pairs = [(a, b) for a, b in zip(full_results, pruned_results) if a]
+    if not pairs:
+        return {"queries_with_results": 0}
+    return {
+        "queries_with_results": len(pairs),
+        "identical": float(np.mean([a == b for a, b in pairs])),
+        "same_first": float(np.mean([bool(b) and a[0] == b[0] for a, b in pairs])),
+        "overlap": float(np.mean([len(set(a) & set(b)) / len(a) for a, b in pairs])),
+        "lost_all": float(np.mean([not b for a, b in pairs])),
+    }
+
+
+def get_latency_report(latencies) -> dict:
+    report = {"mean_ms": float(np.mean(latencies)) if latencies else None}
+    for percentile in PERCENTILES:
+        value = np.percentile(latencies, percentile) if latencies else None
+        report[f"p{percentile}_ms"] = None if value is None else float(value)
+    return report
+
+
+def run_comparison(
+    pruning,
+    num_docs=DEFAULT_DOCS,
+    doc_words=DEFAULT_DOC_WORDS,
+    seed=DEFAULT_SEED,
+    dataset_file=None,
+    workers=None,
+    engine="maxscore",
+    k=DEFAULT_K,
+    queries_file=None,
+    num_queries=DEFAULT_QUERIES,
+    threshold=None,
+) -> dict:
+    """
+    Returns:
+        dict: The commit, pruning, sizes of both indexes and ranking drift
+    """
+    work_dir = tempfile.mkdtemp()
+    try:
+        if dataset_file == None:
+            dataset_file = os.path.join(work_dir, "dataset.csv")
+            write_corpus(dataset_file, num_docs, seed, doc_words)
+            dataset = {"synthetic": True, "docs": num_docs, "doc_words": doc_words}
+        else:
+            dataset = {"synthetic": False, "path": os.path.abspath(dataset_file)}
+
+        full = build(dataset_file, os.path.join(work_dir, "full"), workers)
+        pruned = build(dataset_file, os.path.join(work_dir, "pruned"), workers, pruning)
+
+        # the workload is drawn from the full vocabulary, pruned terms included
+        retrieve.set_dictionary(full["dictionary"])
+        retrieve.set_posting_file(full["postings"])
+        if queries_file == None:
+            workload = sample_workload(num_queries, seed)
+        else:
+            workload = read_workload(queries_file)
+        if threshold != None:
+            search.RELEVANCE_THRESHOLD = threshold
+        full_results, full_latencies = rank_workload(full, workload, engine, k)
+        pruned_results, pruned_latencies = rank_workload(pruned, workload, engine, k)
+    finally:
+        shutil.rmtree(work_dir)
+
+    sizes = {}
+    for name in ("dictionary_bytes", "postings_bytes", "index_bytes"):
+        saved = 1 - pruned[name] / full[name] if full[name] else 0.0
+        sizes[name] = {"full": full[name], "pruned": pruned[name], "saved": saved}
+    return {
+        "commit": get_commit(),
+        "dataset": dataset,
+        "pruning": {
+            "min_biword_df": pruning.min_biword_df,
+            "epsilon": pruning.epsilon,
+            "max_postings": pruning.max_postings,
+            "postings": pruning.postings,
+            "postings_kept": pruning.postings_kept,
+            "lists_dropped": pruning.lists_dropped,
+        },
+        "sizes": sizes,
+        "query": {
+            "engine": engine,
+            "k": k,
+            "threshold": search.RELEVANCE_THRESHOLD,
+            "queries": len(workload),
+            "full": get_latency_report(full_latencies),
+            "pruned": get_latency_report(pruned_latencies),
+        },
+        "drift": get_drift(full_results, pruned_results),
+    }
+
+
+def main():
+    num_docs = DEFAULT_DOCS
+    doc_words = DEFAULT_DOC_WORDS
+    seed = DEFAULT_SEED
+    num_queries = DEFAULT_QUERIES
+    k = DEFAULT_K
+    dataset_file = queries_file = output_file = None
+    workers = threshold = max_postings = None
+    engine = "maxscore"
+    min_biword_df = 0
+    epsilon = 0.0
+
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:],
+            "n:w:s:i:j:e:k:q:Q:t:o:",
+            ["prune-biwords=", "prune-epsilon=", "prune-cap="],
+        )
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == "-n":
+            num_docs = int(a)
+        elif o == "-w":
+            doc_words = int(a)
+        elif o == "-s":
+            seed = int(a)
+        elif o == "-i":
+            dataset_file = a
+        elif o == "-j":
+            workers = int(a)
+        elif o == "-e":
+            engine = a
+        elif o == "-k":
+            k = int(a)
+        elif o == "-q":
+            queries_file = a
+        elif o == "-Q":
+            num_queries = int(a)
+        elif o == "-t":
+            threshold = float(a)
+        elif o == "-o":
+            output_file = a
+        elif o == "--prune-biwords":
+            min_biword_df = int(a)
+        elif o == "--prune-epsilon":
+            epsilon = float(a)
+        elif o == "--prune-cap":
+            max_postings = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if engine not in search.ENGINES or (max_postings != None and max_postings < 1):
+        usage()
+        sys.exit(2)
+    if not 0 <= epsilon <= 1:
+        usage()
+        sys.exit(2)
+
+    report = run_comparison(
+        Pruning(min_biword_df, epsilon, max_postings),
+        num_docs,
+        doc_words,
+        seed,
+        dataset_file,
+        workers,
+        engine,
+        k,
+        queries_file,
+        num_queries,
+        threshold,
+    )
+    if output_file != None:
+        with open(output_file, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
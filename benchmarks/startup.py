@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+import getopt
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RUNS = 5
+
+
+def usage():
+    print(
+        "usage: "
+        + sys.argv[0]
+        + " [-r runs] [-o output.json] [-t max-import-ms]"
+        + " [-d dictionary-file -p postings-file -q query-file]"
+        + "\n       times `import search` with python -X importtime and, given an"
+        + "\n       index and a query, a whole search.py run; -t fails if the"
+        + "\n       median import takes longer"
+    )
+
+
+def parse_importtime(stderr: str) -> dict[str, tuple[int, int]]:
+    """
+    Args:
+        stderr (str): Output of python -X importtime
+    Returns:
+        dict(str, (int, int)): (self, cumulative) microseconds of each module
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue  # the header line
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def time_import(module="search"):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def time_search(dictionary_file, postings_file, query_file) -> float:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        command = [
+            sys.executable,
+            os.path.join(REPO_DIR, "search.py"),
+            "-d",
+            dictionary_file,
+            "-p",
+            postings_file,
+            "-q",
+            query_file,
+            "-o",
+            os.path.join(tmp_dir, "results.txt"),
+        ]
+        start = time.perf_counter()
+        subprocess.run(command, check=True, capture_output=True)
+        return (time.perf_counter() - start) * 1000
+
+
+def run_benchmark(runs, dictionary_file=None, postings_file=None, query_file=None):
+    """
+    Returns:
+        dict: Median import and search times in ms, the modules taking the
+              most time of their own, and whether nltk was imported
+    """
+    imports = [time_import() for _ in range(runs)]
+    import_ms = [modules["search"][1] / 1000 for modules in imports]
+    slowest = sorted(imports[-1].items(), key=lambda x: -x[1][0])[:10]
+    report = {
+        "runs": runs,
+        "import_ms": statistics.median(import_ms),
+        "import_ms_runs": import_ms,
+        "nltk_imported": "nltk" in imports[-1],
+        "slowest_modules_ms": {name: us / 1000 for name, (us, _) in slowest},
+    }
+
+    if query_file != None:
+        search_ms = [
+            time_search(dictionary_file, postings_file, query_file) for _ in range(runs)
+        ]
+        report["search_ms"] = statistics.median(search_ms)
+        report["search_ms_runs"] = search_ms
+    return report
+
+
+def main():
+    runs = DEFAULT_RUNS
+    output_file = dictionary_file = postings_file = query_file = None
+    max_import_ms = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "r:o:t:d:p:q:")
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == "-r":
+            runs = int(a)
+        elif o == "-o":
+            output_file = a
+        elif o == "-t":
+            max_import_ms = float(a)
+        elif o == "-d":
+            dictionary_file = a
+        elif o == "-p":
+            postings_file = a
+        elif o == "-q":
+            query_file = a
+        else:
+            assert False, "unhandled option"
+
+    if query_file != None and (dictionary_file == None or postings_file == None):
+        usage()
+        sys.exit(2)
+
+    report = run_benchmark(runs, dictionary_file, postings_file, query_file)
+    if output_file != None:
+        with open(output_file, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+    if max_import_ms != None and report["import_ms"] > max_import_ms:
+        print(
+            f"import search took {report['import_ms']:.1f} ms, "
+            f"over the {max_import_ms:.1f} ms budget",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/python3
+import contextlib
+import getopt
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import retrieve  # noqa: E402
+import search  # noqa: E402
+from corpus import DEFAULT_DOC_WORDS, DEFAULT_DOCS, DEFAULT_SEED, write_corpus  # noqa: E402
+from index import build_index  # noqa: E402
+from postings import get_read_counters, reset_read_counters  # noqa: E402
+from query import get_words_from_clauses, split_query  # noqa: E402
+
+DEFAULT_QUERIES = 200
+MAX_QUERY_WORDS = 6
+PERCENTILES = (50, 95, 99)
+
+
+def usage():
+    print(
+        "usage: "
+        + sys.argv[0]
+        + " [-n docs] [-w mean-words-per-doc] [-s seed] [-i dataset-file]"
+        + " [-j workers] [-e engine] [-k max-results] [-q queries-file]"
+        + " [-Q queries] [-t threshold] [-c] [-o output.json]"
+        + "\n       generates a synthetic dataset (or indexes -i), times build_index"
+        + "\n       and a query workload through search.run_query, and writes JSON;"
+        + "\n       -q takes raw queries one per line instead of sampling the"
+        + "\n       index vocabulary, -t overrides the relevance threshold (long"
+        + "\n       synthetic docs rarely clear the default), -c clears the posting"
+        + "\n       cache before each query"
+    )
+
+
+def get_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+# ru_maxrss is in KB on Linux. For RUSAGE_CHILDREN it is the peak of the
+# largest single exited child, not of the workers together, so the two are
+# reported apart rather than summed
+def get_peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def bench_index(dataset_file, out_dict, out_postings, workers=None) -> dict:
+    start = time.perf_counter()
+    # keep stdout for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        doc_ids = build_index(dataset_file, out_dict, out_postings, workers)
+    seconds = time.perf_counter() - start
+    index_dir = os.path.dirname(os.path.abspath(out_dict))
+    return {
+        "docs": len(doc_ids),
+        "seconds": seconds,
+        "docs_per_s": len(doc_ids) / seconds if seconds > 0 else None,
+        "peak_rss_mb": get_peak_rss_mb(),
+        "max_worker_rss_mb": get_peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "index_bytes": sum(
+            os.path.getsize(os.path.join(index_dir, name))
+            for name in os.listdir(index_dir)
+        ),
+    }
+
+
+def sample_workload(num_queries: int, seed: int = DEFAULT_SEED) -> list[list[str]]:
+    """
+    Returns:
+        list(list(str)): Stemmed queries of 1 to MAX_QUERY_WORDS words of the
+                         open index, words picked by the square root of
+                         their df so common and rare words both show up
+    """
+    words = sorted(
+        {
+            term
+            for segment in retrieve.get_segments()
+            for term, _ in segment.get_keys()
+            if term.isalpha()
+        }
+    )
+    shares = np.sqrt([retrieve.get_term_doc_count(word) for word in words])
+    rng = random.Random(seed)
+    return [
+        rng.choices(words, weights=shares, k=rng.randint(1, MAX_QUERY_WORDS))
+        for _ in range(num_queries)
+    ]
+
+
+def read_workload(queries_file) -> list[list[str]]:
+    with open(queries_file, "r") as f:
+        queries = [line for line in f if line.strip()]
+    return [
+        get_words_from_clauses(
+            [[clause for clause, _ in and_clause] for and_clause in split_query(query)]
+        )
+        for query in queries
+    ]
+
+
+def bench_queries(workload, engine="maxscore", k=None, cold=False) -> dict:
+    latencies = []
+    bytes_read = []
+    lists_read = []
+    num_results = 0
+    for terms in workload:
+        if cold:
+            retrieve.get_posting_cache().clear()
+        reset_read_counters()
+        start = time.perf_counter()
+        results = search.run_query(terms, engine, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        counters = get_read_counters()
+        bytes_read.append(counters["bytes"])
+        lists_read.append(counters["lists"])
+        num_results += len(results)
+
+    report = {
+        "engine": engine,
+        "k": k,
+        "threshold": search.RELEVANCE_THRESHOLD,
+        "cold": cold,
+        "queries": len(workload),
+        "results": num_results,
+        "mean_ms": float(np.mean(latencies)) if latencies else None,
+        "postings_bytes_read": int(sum(bytes_read)),
+        "postings_lists_read": int(sum(lists_read)),
+    }
+    for percentile in PERCENTILES:
+        value = np.percentile(latencies, percentile) if latencies else None
+        report[f"p{percentile}_ms"] = None if value is None else float(value)
+    if bytes_read:
+        report["p50_bytes_read"] = float(np.percentile(bytes_read, 50))
+    return report
+
+
+def run_suite(
+    num_docs=DEFAULT_DOCS,
+    doc_words=DEFAULT_DOC_WORDS,
+    seed=DEFAULT_SEED,
+    dataset_file=None,
+    workers=None,
+    engine="maxscore",
+    k=None,
+    queries_file=None,
+    num_queries=DEFAULT_QUERIES,
+    cold=False,
+    threshold=None,
+) -> dict:
+    """
+    Returns:
+        dict: The commit, dataset, indexing and query reports
+    """
+    work_dir = tempfile.mkdtemp()
+    try:
+        if dataset_file == None:
+            dataset_file = os.path.join(work_dir, "dataset.csv")
+            write_corpus(dataset_file, num_docs, seed, doc_words)
+            dataset = {"synthetic": True, "docs": num_docs, "doc_words": doc_words}
+        else:
+            dataset = {"synthetic": False, "path": os.path.abspath(dataset_file)}
+        dataset["bytes"] = os.path.getsize(dataset_file)
+
+        index_dir = os.path.join(work_dir, "index")
+        os.makedirs(index_dir)
+        out_dict = os.path.join(index_dir, "dictionary")
+        out_postings = os.path.join(index_dir, "postings")
+        index_report = bench_index(dataset_file, out_dict, out_postings, workers)
+
+        retrieve.set_dictionary(out_dict)
+        retrieve.set_posting_file(out_postings)
+        if queries_file == None:
+            workload = sample_workload(num_queries, seed)
+        else:
+            workload = read_workload(queries_file)
+        if threshold != None:
+            search.RELEVANCE_THRESHOLD = threshold
+        query_report = bench_queries(workload, engine, k, cold)
+    finally:
+        shutil.rmtree(work_dir)
+
+    return {
+        "commit": get_commit(),
+        "seed": seed,
+        "dataset": dataset,
+        "index": index_report,
+        "query": query_report,
+    }
+
+
+def main():
+    num_docs = DEFAULT_DOCS
+    doc_words = DEFAULT_DOC_WORDS
+    seed = DEFAULT_SEED
+    num_queries = DEFAULT_QUERIES
+    dataset_file = queries_file = output_file = None
+    workers = k = threshold = None
+    engine = "maxscore"
+    cold = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:w:s:i:j:e:k:q:Q:t:co:")
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == "-n":
+            num_docs = int(a)
+        elif o == "-w":
+            doc_words = int(a)
+        elif o == "-s":
+            seed = int(a)
+        elif o == "-i":
+            dataset_file = a
+        elif o == "-j":
+            workers = int(a)
+        elif o == "-e":
+            engine = a
+        elif o == "-k":
+            k = int(a)
+        elif o == "-q":
+            queries_file = a
+        elif o == "-Q":
+            num_queries = int(a)
+        elif o == "-t":
+            threshold = float(a)
+        elif o == "-c":
+            cold = True
+        elif o == "-o":
+            output_file = a
+        else:
+            assert False, "unhandled option"
+
+    if engine not in search.ENGINES:
+        usage()
+        sys.exit(2)
+
+    report = run_suite(
+        num_docs,
+        doc_words,
+        seed,
+        dataset_file,
+        workers,
+        engine,
+        k,
+        queries_file,
+        num_queries,
+        cold,
+        threshold,
+    )
+    if output_file != None:
+        with open(output_file, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import numpy as np
+
+from postings import EMPTY_DOCS
+from retrieve import ZONES, get_posting_list, get_segments, get_term_doc_count
+
+
+def get_term_docs(term: str, candidates: np.ndarray = None) -> np.ndarray:
+    """
+    Args:
+        term (str): A stemmed word
+        candidates (np.ndarray): Sorted docIDs to look for, None for all docs
+    Returns:
+        np.ndarray: Sorted docIDs with term in any zone, only the candidates
+                    if given, decoding just the blocks that can hold them
+    """
+    docs = [get_posting_list(term, zone, candidates)[0] for zone in ZONES]
+    return np.unique(np.concatenate(docs))
+
+
+def get_required_words(words: list[str]) -> set[str]:
+    """
+    Returns:
+        set(str): The words a doc must hold: every term of the dictionary,
+                  dates included, and every alphabetic word, which matches
+                  nothing if it is not there. Other tokens, such as numbers
+                  and punctuation, are never indexed and are left out.
+    """
+    return {
+        word
+        for word in words
+        if word.isalpha()
+        or any((word, "*") in segment.dictionary for segment in get_segments())
+    }
+
+
+def get_conjunctive_docs(words: list[str], candidates: np.ndarray = None) -> np.ndarray:
+    """
+    Intersect the docs of every word, rarest word first. The result can only
+    shrink, so each longer list is probed through its skip pointers for the
+    docs still left rather than decoded whole.
+    Args:
+        words (list(str)): The stemmed words that must all occur
+        candidates (np.ndarray): Sorted docIDs to start from, None for all docs
+    Returns:
+        np.ndarray: Sorted docIDs containing every word, None if no word can
+                    be in the index
+    """
+    words = get_required_words(words)
+    if not words:
+        return None
+
+    for word in sorted(words, key=get_term_doc_count):
+        candidates = get_term_docs(word, candidates)
+        if len(candidates) == 0:
+            return EMPTY_DOCS
+    return candidates
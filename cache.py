@@ -0,0 +1,61 @@
+from collections import OrderedDict
+from typing import NamedTuple
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+
+
+class LRUCache:
+    """
+    Least recently used cache bounded by the total size of its values, as
+    measured by sizeof (1 per value by default).
+    """
+
+    def __init__(self, max_size: int, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        """
+        Returns:
+            The cached value, None on a miss
+        """
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return  # would evict everything else for one value
+        if key in self.entries:
+            self.size -= self.sizeof(self.entries.pop(key))
+        while self.entries and self.size + size > self.max_size:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= self.sizeof(evicted)
+            self.evictions += 1
+        self.entries[key] = value
+        self.size += size
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def cache_info(self) -> CacheInfo:
+        # hits and misses first, like functools.lru_cache
+        return CacheInfo(self.hits, self.misses, self.evictions, self.size)
+
+
+def get_arrays_size(arrays) -> int:
+    return sum(array.nbytes for array in arrays)
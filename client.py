@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+import asyncio
+import getopt
+import json
+import sys
+
+
+def usage():
+    print(
+        "usage: "
+        + sys.argv[0]
+        + " -s socket-path|host:port -q file-of-queries [-o results.jsonl]"
+        + "\n       sends one query per line of the file to server.py (or"
+        + "\n       search.py --serve) and writes one JSON response per line"
+    )
+
+
+# a Unix socket path, or host:port for TCP
+# return (host, port), or (path, None)
+def parse_address(address):
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return host or "localhost", int(port)
+    return address, None
+
+
+async def open_connection(address):
+    host, port = parse_address(address)
+    if port is None:
+        return await asyncio.open_unix_connection(host)
+    return await asyncio.open_connection(host, port)
+
+
+async def send_queries(address, queries: list[str]) -> list[dict]:
+    """
+    Pipeline queries over one connection, sending them all before reading
+    the responses, which come back in order.
+    Returns:
+        list(dict): The response to each query
+    """
+    reader, writer = await open_connection(address)
+
+    async def send():
+        for query in queries:
+            writer.write((query.strip() + "\n").encode("utf-8"))
+            await writer.drain()
+
+    sender = asyncio.create_task(send())
+    responses = [json.loads(await reader.readline()) for _ in queries]
+    await sender
+    writer.close()
+    await writer.wait_closed()
+    return responses
+
+
+def main():
+    address = file_of_queries = output_file = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "s:q:o:")
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == "-s":
+            address = a
+        elif o == "-q":
+            file_of_queries = a
+        elif o == "-o":
+            output_file = a
+        else:
+            assert False, "unhandled option"
+
+    if address == None or file_of_queries == None:
+        usage()
+        sys.exit(2)
+
+    with open(file_of_queries, "r") as f:
+        queries = [line for line in f if line.strip()]
+    responses = asyncio.run(send_queries(address, queries))
+    out = sys.stdout if output_file == None else open(output_file, "w")
+    for response in responses:
+        out.write(json.dumps(response) + "\n")
+    if out is not sys.stdout:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
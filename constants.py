@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 
 class Keywords(str, Enum):
@@ -13,3 +13,33 @@ class Zone(str, Enum):
     CONTENT = "content"
     COURT = "court"
     DATE = "date"
+
+
+class CourtTier(IntEnum):
+    OTHER = 0
+    IMPORTANT = 1
+    MOST_IMPORTANT = 2
+
+
+# from "Notes about Court Hierarchy.txt", every other court is CourtTier.OTHER
+MOST_IMPORTANT_COURTS = (
+    "SG Court of Appeal",
+    "SG Privy Council",
+    "UK House of Lords",
+    "UK Supreme Court",
+    "High Court of Australia",
+    "CA Supreme Court",
+)
+IMPORTANT_COURTS = (
+    "SG High Court",
+    "Singapore International Commercial Court",
+    "HK High Court",
+    "HK Court of First Instance",
+    "UK Crown Court",
+    "UK Court of Appeal",
+    "UK High Court",
+    "Federal Court of Australia",
+    "NSW Court of Appeal",
+    "NSW Court of Criminal Appeal",
+    "NSW Supreme Court",
+)
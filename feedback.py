@@ -0,0 +1,64 @@
+import math
+
+from retrieve import ZONES, get_doc_words
+
+# Rocchio weights of the original query and of the feedback docs' centroid;
+# there are no known non-relevant docs, so no negative term
+ALPHA = 1.0
+BETA = 0.75
+# top first-pass results treated as relevant (pseudo-relevance feedback)
+FEEDBACK_DOCS = 10
+# new words the refined query may add, keeping the second pass cheap
+MAX_EXPANSION_TERMS = 10
+
+
+def get_doc_vector(doc_id: int) -> dict[str, float]:
+    """
+    Returns:
+        dict(str, float): Zone weighted weight of each top word of the doc,
+                          in the same space as the query weights
+    """
+    vector = {}
+    for term, zone, weight in get_doc_words(doc_id):
+        vector[term] = vector.get(term, 0) + ZONES[zone] * weight
+    return vector
+
+
+def get_feedback_weights(
+    query_weights: dict[str, float],
+    feedback_docs: list[int],
+    max_terms: int = MAX_EXPANSION_TERMS,
+    doc_vector=get_doc_vector,
+) -> dict[str, float]:
+    """
+    Rocchio: move the query towards the centroid of the feedback docs, built
+    from the forward index in one pass over their top words.
+    Args:
+        query_weights (dict(str, float)): Normalized tf-idf of each query term
+        feedback_docs (list(int)): Given relevant docs and top results
+        max_terms (int): Max number of words added to the query
+        doc_vector (callable): Gives the vector of a doc, see get_doc_vector
+    Returns:
+        dict(str, float): The refined query, cosine normalized
+    """
+    feedback_docs = list(dict.fromkeys(feedback_docs))
+    centroid = {}
+    for doc_id in feedback_docs:
+        for term, weight in doc_vector(doc_id).items():
+            centroid[term] = centroid.get(term, 0) + weight / len(feedback_docs)
+
+    # keep every query term, add only the heaviest new words
+    new_terms = sorted(
+        (term for term in centroid if term not in query_weights),
+        key=lambda term: (-centroid[term], term),
+    )[:max_terms]
+    refined = {}
+    for term in list(query_weights) + new_terms:
+        weight = ALPHA * query_weights.get(term, 0) + BETA * centroid.get(term, 0)
+        if weight > 0:
+            refined[term] = weight
+
+    length = math.sqrt(sum(weight**2 for weight in refined.values()))
+    if length == 0:
+        return query_weights
+    return {term: weight / length for term, weight in refined.items()}
@@ -0,0 +1,200 @@
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from termdict import ZONE_COLUMNS, ZONES
+
+# Forward index of a segment, next to its dictionary: the top weighted words
+# of each zone of each doc, so feedback can rebuild document vectors without
+# reading postings. Layout (all integers little-endian):
+#   header: MAGIC, u16 version, u16 words per zone, u32 doc count,
+#           u32 entry count
+#   i64[docs]        sorted docIDs
+#   u32[docs + 1]    first entry of each doc, its entries are consecutive
+#   u32[entries]     row of the word in the segment's dictionary
+#   f32[entries]     weight of the word in the zone
+#   u8[entries]      zone, an index into termdict.ZONES
+# Sections are padded to 8 bytes so every column can be viewed in place.
+FORWARD_SUFFIX = ".forward"
+MAGIC = b"HW4F"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHII")
+
+WORDS_PER_ZONE = 20
+# postings buffered before pruning down to the top words of each doc zone
+BUFFER_SIZE = 1 << 20
+
+
+def get_forward_path(dictionary_file):
+    return dictionary_file + FORWARD_SUFFIX
+
+
+def pad(size: int) -> int:
+    return -size % 8
+
+
+class ForwardIndexBuilder:
+    """
+    Collects the top words of each doc zone from posting lists streamed in
+    any order, in memory bounded by the docs rather than the postings.
+    """
+
+    def __init__(self, words_per_zone: int = WORDS_PER_ZONE):
+        self.words_per_zone = words_per_zone
+        self.kept = None
+        self.buffer = []
+        self.buffered = 0
+
+    def add(self, row: int, zone: str, doc_ids, weights):
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        self.buffer.append(
+            (
+                doc_ids,
+                np.full(len(doc_ids), ZONE_COLUMNS[zone], dtype=np.uint8),
+                np.full(len(doc_ids), row, dtype=np.uint32),
+                np.asarray(weights, dtype=np.float32),
+            )
+        )
+        self.buffered += len(doc_ids)
+        if self.buffered >= BUFFER_SIZE:
+            self.prune()
+
+    def add_index(self, forward, live: np.ndarray, rows: np.ndarray):
+        """
+        Carry over the entries of another forward index, e.g. of a segment
+        being merged.
+        Args:
+            forward (ForwardIndex): The forward index
+            live (np.ndarray): bool mask over its docs, False to leave out
+            rows (np.ndarray): Row in the new dictionary of each of its rows,
+                               -1 to leave the word out
+        """
+        docs = np.repeat(np.asarray(forward.doc_ids), np.diff(forward.starts))
+        new_rows = rows[forward.rows]
+        keep = np.repeat(live, np.diff(forward.starts)) & (new_rows >= 0)
+        self.buffer.append(
+            (
+                docs[keep],
+                forward.zones[keep],
+                new_rows[keep].astype(np.uint32),
+                forward.weights[keep],
+            )
+        )
+        self.buffered += int(np.count_nonzero(keep))
+        if self.buffered >= BUFFER_SIZE:
+            self.prune()
+
+    def prune(self):
+        parts = self.buffer if self.kept is None else [self.kept] + self.buffer
+        self.buffer = []
+        self.buffered = 0
+        if not parts:
+            return
+        docs, zones, rows, weights = (np.concatenate(x) for x in zip(*parts))
+
+        # heaviest first within each (doc, zone), ties by row
+        order = np.lexsort((rows, -weights, zones, docs))
+        docs, zones, rows, weights = (
+            docs[order],
+            zones[order],
+            rows[order],
+            weights[order],
+        )
+        new_group = np.ones(len(docs), dtype=bool)
+        new_group[1:] = (docs[1:] != docs[:-1]) | (zones[1:] != zones[:-1])
+        group_starts = np.flatnonzero(new_group)
+        ranks = np.arange(len(docs)) - np.repeat(
+            group_starts, np.diff(np.append(group_starts, len(docs)))
+        )
+        keep = ranks < self.words_per_zone
+        self.kept = (docs[keep], zones[keep], rows[keep], weights[keep])
+
+    def write(self, forward_file, doc_ids):
+        """
+        Args:
+            forward_file (str): Path of the forward index
+            doc_ids (iterable(int)): Every doc in the segment
+        """
+        self.prune()
+        if self.kept is None:
+            self.kept = (
+                np.empty(0, np.int64),
+                np.empty(0, np.uint8),
+                np.empty(0, np.uint32),
+                np.empty(0, np.float32),
+            )
+        entry_docs, zones, rows, weights = self.kept
+        doc_ids = np.sort(np.asarray(list(doc_ids), dtype="<i8"))
+        starts = np.searchsorted(entry_docs, doc_ids).tolist() + [len(entry_docs)]
+
+        sections = [
+            doc_ids.tobytes(),
+            np.asarray(starts, dtype="<u4").tobytes(),
+            rows.astype("<u4").tobytes(),
+            weights.astype("<f4").tobytes(),
+            zones.tobytes(),
+        ]
+        header = HEADER.pack(
+            MAGIC, VERSION, self.words_per_zone, len(doc_ids), len(entry_docs)
+        )
+        with open(forward_file + ".tmp", "wb") as f:
+            f.write(header + b"\0" * pad(len(header)))
+            for section in sections:
+                f.write(section + b"\0" * pad(len(section)))
+        os.replace(forward_file + ".tmp", forward_file)
+
+
+class ForwardIndex:
+    """
+    A forward index file mapped in place.
+    """
+
+    def __init__(self, forward_file):
+        with open(forward_file, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.words_per_zone, num_docs, num_entries = HEADER.unpack_from(
+            self.buf, 0
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("unsupported forward index, rebuild the index")
+
+        pos = HEADER.size + pad(HEADER.size)
+        self.doc_ids = np.frombuffer(self.buf, "<i8", num_docs, pos)
+        pos += 8 * num_docs
+        self.starts = np.frombuffer(self.buf, "<u4", num_docs + 1, pos)
+        pos += 4 * (num_docs + 1) + pad(4 * (num_docs + 1))
+        self.rows = np.frombuffer(self.buf, "<u4", num_entries, pos)
+        pos += 4 * num_entries + pad(4 * num_entries)
+        self.weights = np.frombuffer(self.buf, "<f4", num_entries, pos)
+        pos += 4 * num_entries + pad(4 * num_entries)
+        self.zones = np.frombuffer(self.buf, np.uint8, num_entries, pos)
+
+    def get_doc_words(self, doc_id: int) -> list[tuple[int, str, float]]:
+        """
+        Returns:
+            list((int, str, float)): (dictionary row, zone, weight) of the top
+                                     words of each zone of the doc
+        """
+        i = int(np.searchsorted(self.doc_ids, doc_id))
+        if i == len(self.doc_ids) or self.doc_ids[i] != doc_id:
+            return []
+        start, end = int(self.starts[i]), int(self.starts[i + 1])
+        return [
+            (row, ZONES[zone], weight)
+            for row, zone, weight in zip(
+                self.rows[start:end].tolist(),
+                self.zones[start:end].tolist(),
+                self.weights[start:end].tolist(),
+            )
+        ]
+
+
+def open_forward_index(dictionary_file):
+    # indexes built before the forward index existed simply have no feedback
+    forward_file = get_forward_path(dictionary_file)
+    if not os.path.exists(forward_file):
+        return None
+    return ForwardIndex(forward_file)
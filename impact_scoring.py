@@ -0,0 +1,149 @@
+import heapq
+
+import numpy as np
+
+import maxscore
+from instrument import count, span
+from maxscore import EPSILON
+from postings import in_sorted
+from retrieve import ZONES, get_doc_ids, get_max_prior, get_posting_readers
+
+# the k-th best partial score is recomputed once the bound on what is left
+# to add has shrunk by this factor since the last time
+KTH_RECHECK = 0.9
+# with k, reading goes on past the point where unseen docs are ruled out
+# until at most this many seen docs per result are left to score exactly
+SURVIVORS_PER_RESULT = 8
+
+
+def get_top_docs(
+    query_weights: dict[str, float],
+    threshold: float,
+    k: int = None,
+    candidates: np.ndarray = None,
+    with_prior: bool = False,
+) -> list[tuple[int, float]]:
+    """
+    Score-at-a-time over the impact-ordered postings (index.py -I).
+
+    The impact segments of every (term, zone) list are read in decreasing
+    order of their bound (query weight x zone weight x max weight in the
+    segment), adding each posting to a dense accumulator of partial scores.
+    What any doc can still gain is at most the sum over lists of the bound of
+    their next segment, so reading stops once that, plus the highest prior,
+    cannot lift an unseen doc above the threshold or the k-th best partial
+    score, and, with k, few enough seen docs could still get there. Those
+    are then scored exactly by MaxScore, so results match the other engines.
+
+    Falls back to MaxScore if a segment of the index has no impacts.
+
+    Args:
+        query_weights (dict(str, float)): Normalized tf-idf of each query term
+        threshold (float): Docs must score strictly above this to be kept
+        k (int): Max number of docs to return, None for all relevant docs
+        candidates (np.ndarray): Sorted docIDs to restrict the results to
+        with_prior (bool): Add the static prior of each matching doc
+    Returns:
+        list((int, float)): (docID, score) from most to least relevant
+    """
+    lists = []
+    for term, weight in query_weights.items():
+        if weight <= 0:
+            continue
+        for zone, zone_weight in ZONES.items():
+            coef = weight * zone_weight
+            for reader in get_posting_readers(term, zone):
+                impacts = reader.segment.impacts
+                if impacts is None:
+                    return maxscore.get_top_docs(
+                        query_weights, threshold, k, candidates, with_prior
+                    )
+                segments = impacts.get_segments(reader.entry.offset)
+                lists.append((coef, reader.segment, segments))
+    if not lists:
+        return []
+
+    # next segment of each list, heaviest bound first; a list's segments
+    # are in decreasing order, so they come off the heap in turn
+    remaining = np.zeros(len(lists))
+    heap = []
+    for i, (coef, segment, segments) in enumerate(lists):
+        if segments:
+            remaining[i] = coef * float(segment.impacts.max_weights[segments[0]])
+            heap.append((-remaining[i], i, 0))
+    heapq.heapify(heap)
+
+    doc_ids = get_doc_ids()
+    scores = np.zeros(len(doc_ids))
+    seen = np.zeros(len(doc_ids), dtype=bool)
+    max_prior = get_max_prior() if with_prior else 0.0
+    max_survivors = len(doc_ids) if k is None else SURVIVORS_PER_RESULT * k
+    min_score = threshold
+    kth_checked = np.inf
+    num_postings = 0
+    while heap:
+        left = float(remaining.sum()) + max_prior
+        if left <= kth_checked * KTH_RECHECK:
+            min_score = get_kth_best(scores, k, min_score)
+            kth_checked = left
+            if (
+                left < min_score - EPSILON
+                and count_survivors(scores, seen, left, min_score) <= max_survivors
+            ):
+                break
+
+        _, i, j = heapq.heappop(heap)
+        coef, segment, segments = lists[i]
+        with span("postings"):
+            ordinals, weights = segment.impacts.get_postings(segments[j])
+            docs = segment.doc_ids[ordinals]
+            keep = np.ones(len(docs), dtype=bool)
+            if segment.num_deleted:
+                keep &= ~segment.deleted[ordinals]
+            if candidates is not None:
+                keep &= in_sorted(docs, candidates)
+        num_postings += len(docs)
+        # each doc appears once per list, so fancy-index adds are safe
+        rows = np.searchsorted(doc_ids, docs[keep])
+        scores[rows] += coef * weights[keep].astype(np.float64)
+        seen[rows] = True
+
+        if j + 1 < len(segments):
+            remaining[i] = coef * float(segment.impacts.max_weights[segments[j + 1]])
+            heapq.heappush(heap, (-remaining[i], i, j + 1))
+        else:
+            remaining[i] = 0.0
+    count("impact_postings", num_postings)
+
+    left = float(remaining.sum()) + max_prior
+    min_score = get_kth_best(scores, k, min_score)
+    survivors = np.flatnonzero(get_survivors(scores, seen, left, min_score))
+    if len(survivors) == 0:
+        return []
+    return maxscore.get_top_docs(
+        query_weights, threshold, k, doc_ids[survivors], with_prior
+    )
+
+
+def get_kth_best(scores, k, min_score):
+    """
+    Partial scores are lower bounds, the k-th best of them must be beaten.
+    Returns:
+        float: The k-th best partial score if above min_score, else min_score
+    """
+    if k is None or k <= 0:
+        return min_score
+    # only the docs already above the bar can raise it
+    above = scores[scores > min_score]
+    if len(above) < k:
+        return min_score
+    return float(np.partition(above, -k)[-k])
+
+
+# return bool arr[ordinal], the seen docs that may still reach min_score
+def get_survivors(scores, seen, left, min_score):
+    return seen & (scores + left >= min_score - EPSILON)
+
+
+def count_survivors(scores, seen, left, min_score):
+    return int(np.count_nonzero(get_survivors(scores, seen, left, min_score)))
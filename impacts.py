@@ -0,0 +1,166 @@
+import mmap
+import os
+import shutil
+import struct
+
+import numpy as np
+
+# Impact-ordered copy of a segment's postings, next to its dictionary (built
+# with index.py -I): each posting list sorted by descending weight and cut
+# into impact segments, one per quantized weight level, so score-at-a-time
+# evaluation (impact_scoring.py) can read the heaviest postings of every
+# list first. Levels are half octaves: a weight w lands in level
+# floor(-2 log2 w), capped at LEVELS - 1.
+# Layout (all integers little-endian):
+#   header: MAGIC, u16 version, u16 levels, u32 list count,
+#           u32 impact segment count
+#   u64[lists]         offset of each list in the postings file, sorted
+#   u32[lists + 1]     first impact segment of each list, consecutive
+#   f32[segments]      highest weight in each impact segment
+#   u64[segments + 1]  first posting of each impact segment
+#   postings           per impact segment: u32 ordinals of its docs in the
+#                      segment's sorted docIDs, ascending, then their f32
+#                      weights
+# Sections are padded to 8 bytes so every column can be viewed in place.
+IMPACTS_SUFFIX = ".impacts"
+MAGIC = b"HW4I"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHII")
+
+LEVELS = 32
+
+
+def get_impacts_path(dictionary_file):
+    return dictionary_file + IMPACTS_SUFFIX
+
+
+def pad(size: int) -> int:
+    return -size % 8
+
+
+def get_levels(weights: np.ndarray) -> np.ndarray:
+    levels = np.floor(-2 * np.log2(np.maximum(weights, 2.0 ** (-LEVELS))))
+    return np.clip(levels, 0, LEVELS - 1).astype(np.int64)
+
+
+class ImpactWriter:
+    """
+    Streams impact segments to a spill file as posting lists are written,
+    keeping only the per-list and per-segment tables in memory.
+    """
+
+    def __init__(self, impacts_file, doc_ids):
+        """
+        Args:
+            impacts_file (str): Path of the impacts file
+            doc_ids (iterable(int)): Every doc in the segment
+        """
+        self.impacts_file = impacts_file
+        self.doc_ids = np.sort(np.asarray(list(doc_ids), dtype=np.int64))
+        self.spill = open(impacts_file + ".postings", "wb")
+        self.list_offsets = []
+        self.list_starts = [0]
+        self.max_weights = []
+        self.posting_starts = [0]
+
+    def add(self, offset: int, doc_list, weights):
+        """
+        Args:
+            offset (int): Offset of the list in the postings file
+            doc_list (list(int)): Sorted docIDs of the list
+            weights (list(float)): Their weights
+        """
+        ordinals = np.searchsorted(self.doc_ids, doc_list).astype("<u4")
+        weights = np.asarray(weights, dtype="<f4")
+        levels = get_levels(weights)
+        # heaviest level first, docs in order within a level
+        order = np.lexsort((ordinals, levels))
+        ordinals, weights, levels = ordinals[order], weights[order], levels[order]
+        bounds = np.flatnonzero(np.diff(levels)) + 1
+        for start, end in zip([0, *bounds.tolist()], [*bounds.tolist(), len(levels)]):
+            self.spill.write(ordinals[start:end].tobytes())
+            self.spill.write(weights[start:end].tobytes())
+            self.max_weights.append(float(weights[start:end].max()))
+            self.posting_starts.append(self.posting_starts[-1] + end - start)
+        self.list_offsets.append(offset)
+        self.list_starts.append(len(self.max_weights))
+
+    def write(self):
+        self.spill.close()
+        spill_file = self.impacts_file + ".postings"
+        sections = [
+            np.asarray(self.list_offsets, dtype="<u8").tobytes(),
+            np.asarray(self.list_starts, dtype="<u4").tobytes(),
+            np.asarray(self.max_weights, dtype="<f4").tobytes(),
+            np.asarray(self.posting_starts, dtype="<u8").tobytes(),
+        ]
+        header = HEADER.pack(
+            MAGIC, VERSION, LEVELS, len(self.list_offsets), len(self.max_weights)
+        )
+        with open(self.impacts_file + ".tmp", "wb") as f:
+            f.write(header + b"\0" * pad(len(header)))
+            for section in sections:
+                f.write(section + b"\0" * pad(len(section)))
+            with open(spill_file, "rb") as spill:
+                shutil.copyfileobj(spill, f)
+        os.remove(spill_file)
+        os.replace(self.impacts_file + ".tmp", self.impacts_file)
+
+
+class ImpactIndex:
+    """
+    An impacts file mapped in place.
+    """
+
+    def __init__(self, impacts_file):
+        with open(impacts_file, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.levels, num_lists, num_segments = HEADER.unpack_from(
+            self.buf, 0
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("unsupported impacts file, rebuild the index")
+
+        pos = HEADER.size + pad(HEADER.size)
+        self.list_offsets = np.frombuffer(self.buf, "<u8", num_lists, pos)
+        pos += 8 * num_lists
+        self.list_starts = np.frombuffer(self.buf, "<u4", num_lists + 1, pos)
+        pos += 4 * (num_lists + 1) + pad(4 * (num_lists + 1))
+        self.max_weights = np.frombuffer(self.buf, "<f4", num_segments, pos)
+        pos += 4 * num_segments + pad(4 * num_segments)
+        self.posting_starts = np.frombuffer(self.buf, "<u8", num_segments + 1, pos)
+        self.postings_pos = pos + 8 * (num_segments + 1)
+
+    def get_segments(self, offset: int) -> range:
+        """
+        Returns:
+            range: The impact segments of the list at offset in the postings
+                   file, heaviest first; empty if the list is not here
+        """
+        # a u64 key, so the column is searched as is rather than converted
+        i = int(np.searchsorted(self.list_offsets, np.uint64(offset)))
+        if i == len(self.list_offsets) or self.list_offsets[i] != offset:
+            return range(0)
+        return range(int(self.list_starts[i]), int(self.list_starts[i + 1]))
+
+    def get_postings(self, segment: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            (np.ndarray, np.ndarray): Doc ordinals and weights of an impact
+                                      segment
+        """
+        start = int(self.posting_starts[segment])
+        size = int(self.posting_starts[segment + 1]) - start
+        pos = self.postings_pos + 8 * start
+        ordinals = np.frombuffer(self.buf, "<u4", size, pos)
+        weights = np.frombuffer(self.buf, "<f4", size, pos + 4 * size)
+        return ordinals, weights
+
+
+def open_impact_index(dictionary_file):
+    # only indexes built with -I have impact-ordered postings
+    impacts_file = get_impacts_path(dictionary_file)
+    if not os.path.exists(impacts_file):
+        return None
+    return ImpactIndex(impacts_file)
@@ -5,20 +5,55 @@ import sys
 import getopt
 
 import csv
+import heapq
+import itertools
+import multiprocessing
 import os
-from collections import defaultdict
-
-from nltk.stem import PorterStemmer
-from nltk.stem.wordnet import WordNetLemmatizer
-from nltk.tokenize import RegexpTokenizer, word_tokenize
-from nltk.corpus import stopwords
+import shutil
+import tempfile
+import time
+from collections import defaultdict, deque
 
 import pickle
 import string
 import math
 
+import numpy as np
+
+from normalize import format_cache_stats, get_cache_info, get_stop_words, stem_word
+from query_expand import get_synonyms_path, write_synonym_table
+from postings import (
+    PostingEntry,
+    encode_positions,
+    encode_posting_list,
+    write_file_header,
+)
+from forward import ForwardIndexBuilder, get_forward_path
+from impacts import ImpactWriter, get_impacts_path
+from pruning import Pruning
+from metadata import get_metadata_path, parse_date, write_doc_metadata
+from termdict import ZONES, write_term_dictionary
+from segments import (
+    Segment,
+    get_manifest_path,
+    get_partitions_path,
+    get_segment_entry,
+    get_segment_files,
+    in_doc_range,
+    index_exists,
+    load_manifest,
+    load_partitions,
+    open_segments,
+    save_manifest,
+    save_partitions,
+    select_segments_to_merge,
+)
+
 
 class Doc:
+    # one per row in flight, no per-instance dict
+    __slots__ = ("docID", "title", "content", "date", "court")
+
     def __init__(self, docID, title, content, date, court):
         self.docID = docID
         self.title = title
@@ -27,10 +62,12 @@ class Doc:
         self.court = court
 
 
+PUNCTUATION_CHARS = frozenset(string.punctuation)
+
+
 def process_to_tokens(text, zone):
-    p_stemmer = PorterStemmer()
-    stop_words = set(stopwords.words("english"))
-    punctuation_chars = set(string.punctuation)
+    stop_words = get_stop_words()
+    punctuation_chars = PUNCTUATION_CHARS
 
     text = re.sub(r"^[0-9,]+$", "", text)
     # Tokenize the text into words
@@ -38,15 +75,21 @@ def process_to_tokens(text, zone):
 
     processed_tokens = {}
     processed_biwords = {}
+    # positions count indexed words only, so "court of appeal" is the
+    # adjacent "court appeal" just like in a stopword-free query phrase
+    processed_positions = defaultdict(list)
+    position = 0
 
     cur_biword = []
     for word in words:
         if word in stop_words or not word.isalpha() or word in punctuation_chars:
             cur_biword = []
             continue
-        word = p_stemmer.stem(word, to_lowercase=True)
+        word = stem_word(word)
 
         # process word
+        processed_positions[(word, zone)].append(position)
+        position += 1
         if (word, zone) not in processed_tokens:
             processed_tokens[(word, zone)] = 1
         else:
@@ -65,112 +108,1081 @@ def process_to_tokens(text, zone):
 
             cur_biword[0] = cur_biword.pop()
 
-    return [processed_tokens, processed_biwords]
+    return [processed_tokens, processed_biwords, processed_positions]
+
+
+# rough in-memory cost of one (term, zone, docID, weight) posting in a worker
+BYTES_PER_POSTING = 120
+SHARD_SIZE = 500
+DEFAULT_MEMORY_MB = 256
+
+# a build keeps its runs and checkpoints in {postings}.build until it is done
+BUILD_SUFFIX = ".build"
+CHECKPOINT_DOCS = 10000
+PROGRESS_SECONDS = 5
+
+
+def usage():
+    print(
+        "usage: "
+        + sys.argv[0]
+        + " -i dataset-file -d dictionary-file -p postings-file"
+        + " [-j workers] [-m worker-memory-MB] [-n partitions] [-a] [-P] [-I]"
+        + " [-s] [--resume] [--prune-biwords min-df] [--prune-epsilon e]"
+        + " [--prune-cap max-postings]"
+        + "\n       "
+        + sys.argv[0]
+        + " -d dictionary-file -p postings-file -x file-of-deleted-docIDs"
+        + "\n       "
+        + sys.argv[0]
+        + " -d dictionary-file -p postings-file --merge"
+        + "\n       "
+        + sys.argv[0]
+        + " -d dictionary-file -p postings-file -s"
+        + "\n       -a: index the dataset into a new segment of the existing index"
+        + "\n       -a, -x: the merge policy then compacts segments before exiting"
+        + "\n       -n: split the index by docID range into independent partitions,"
+        + "\n           searched by one process each"
+        + "\n       -P: store word positions for phrase queries"
+        + "\n       -I: also store impact-ordered postings for the impact engine"
+        + "\n       -s: precompute query expansions of the index vocabulary"
+        + "\n       --resume: continue an interrupted build from its last checkpoint"
+        + "\n       --prune-*: leave out biword lists of fewer docs, postings"
+        + "\n           below e (0 < e <= 1) times the 10th best weight of their"
+        + "\n           list, and all but the heaviest postings of longer lists"
+    )
+
+
+# yield Doc for every row of the dataset csv with a docID in doc_range
+# (all rows if None) after the first skip_rows of them, telling progress how
+# far into the file the reader is
+def read_documents(in_dir, skip_rows=0, progress=None, doc_range=None):
+    csv.field_size_limit(100000000)
+    with open(in_dir, "r", encoding="utf-8") as f:
+        corpus = csv.reader(f)
+        next(corpus)
+        row = 0
+        for entry in corpus:
+            if progress is not None:
+                progress.bytes_read = f.buffer.tell()
+            doc_id = int(entry[0])
+            if doc_range is not None and not in_doc_range(doc_id, doc_range):
+                continue
+            # rows are only parsed, not tokenized, on the way to the cursor
+            row += 1
+            if row <= skip_rows:
+                continue
+            yield Doc(doc_id, entry[1], entry[2], entry[3], entry[4])
+
+
+# return [docID, ...] of every row of the dataset csv, parsed only
+def read_doc_ids(in_dir):
+    csv.field_size_limit(100000000)
+    with open(in_dir, "r", encoding="utf-8") as f:
+        corpus = csv.reader(f)
+        next(corpus)
+        return [int(entry[0]) for entry in corpus]
+
+
+class Progress:
+    """
+    Throughput of a build, reported every PROGRESS_SECONDS rather than per
+    shard.
+    """
+
+    def __init__(self, total_bytes: int, docs: int = 0):
+        self.total_bytes = total_bytes
+        self.bytes_read = 0
+        self.docs = docs
+        self.start_docs = docs
+        self.start = self.last_report = time.perf_counter()
+
+    def get_rate(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return (self.docs - self.start_docs) / elapsed if elapsed > 0 else 0
+
+    def update(self, docs: int):
+        self.docs += docs
+        now = time.perf_counter()
+        if now - self.last_report < PROGRESS_SECONDS:
+            return
+        self.last_report = now
+        done = self.bytes_read / self.total_bytes if self.total_bytes else 1
+        print(
+            f"{self.docs} docs indexed, {self.get_rate():.0f} docs/s, "
+            f"{done:.0%} of the dataset read..."
+        )
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.start
+        print(
+            f"{self.docs - self.start_docs} docs indexed in {elapsed:.1f} s "
+            f"({self.get_rate():.0f} docs/s)"
+        )
+
+
+class BuildState:
+    """
+    What an unfinished build has written so far, kept in {postings}.build:
+        *.run       sorted runs of the shards indexed so far
+        docs        (docID, court, date, zone lengths) of those shards, one
+                    pickled list per shard
+        checkpoint  pickled {"dataset", "with_positions", "doc_range", "rows",
+                    "runs", "docs_bytes", "cache_info"} of the last
+                    consistent state
+    Shards finish in dataset order, so the rows of the dataset indexed so
+    far are a prefix and a resumed build skips just those.
+    """
+
+    def __init__(self, out_postings, dataset, with_positions, doc_range=None):
+        self.build_dir = out_postings + BUILD_SUFFIX
+        self.dataset = os.path.abspath(dataset)
+        self.with_positions = with_positions
+        self.doc_range = doc_range
+        self.rows = 0
+        self.runs = []
+        self.cache_info = {name: (0, 0) for name in get_cache_info()}
+        self.docs_file = None
+
+    def get_path(self, name):
+        return os.path.join(self.build_dir, name)
+
+    def start(self, resume=False) -> bool:
+        """
+        Returns:
+            bool: Whether the last checkpoint was resumed, otherwise any
+                  earlier state is discarded
+        """
+        checkpoint = self.load_checkpoint() if resume else None
+        if checkpoint is None:
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+            os.makedirs(self.build_dir)
+            self.docs_file = open(self.get_path("docs"), "wb")
+            return False
+
+        self.rows = checkpoint["rows"]
+        self.runs = checkpoint["runs"]
+        self.cache_info = checkpoint["cache_info"]
+        # drop what shards in flight wrote after the checkpoint
+        for name in os.listdir(self.build_dir):
+            if name.endswith(".run") and name not in self.runs:
+                os.remove(self.get_path(name))
+        self.docs_file = open(self.get_path("docs"), "r+b")
+        self.docs_file.truncate(checkpoint["docs_bytes"])
+        self.docs_file.seek(checkpoint["docs_bytes"])
+        return True
+
+    def load_checkpoint(self):
+        try:
+            with open(self.get_path("checkpoint"), "rb") as f:
+                checkpoint = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        if (
+            checkpoint["dataset"] != self.dataset
+            or checkpoint["with_positions"] != self.with_positions
+            or checkpoint["doc_range"] != self.doc_range
+        ):
+            print("checkpoint is of another build, starting over...")
+            return None
+        return checkpoint
+
+    def add_shard(self, runs, docs, cache_info):
+        self.runs.extend(os.path.basename(run) for run in runs)
+        pickle.dump(docs, self.docs_file)
+        self.rows += len(docs)
+        for name, (hits, misses) in cache_info.items():
+            total_hits, total_misses = self.cache_info.get(name, (0, 0))
+            self.cache_info[name] = (total_hits + hits, total_misses + misses)
+
+    def save_checkpoint(self):
+        self.docs_file.flush()
+        checkpoint = {
+            "dataset": self.dataset,
+            "with_positions": self.with_positions,
+            "doc_range": self.doc_range,
+            "rows": self.rows,
+            "runs": self.runs,
+            "docs_bytes": self.docs_file.tell(),
+            "cache_info": self.cache_info,
+        }
+        path = self.get_path("checkpoint")
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(checkpoint, f)
+        os.replace(path + ".tmp", path)
+
+    def get_run_paths(self):
+        return [self.get_path(name) for name in self.runs]
+
+    # return [(docID, court, date, zone lengths), ...] of every doc indexed
+    def read_docs(self):
+        self.docs_file.flush()
+        docs = []
+        with open(self.get_path("docs"), "rb") as f:
+            while True:
+                try:
+                    docs.extend(pickle.load(f))
+                except EOFError:
+                    return docs
+
+    def remove(self):
+        self.docs_file.close()
+        shutil.rmtree(self.build_dir)
+
+
+# lnc weighting of one doc, in one pass over each zone: log tf, no idf,
+# cosine normalized within the zone, since queries score each zone on its own
+# return (map{ (term, zone): weight },
+#         map{ (term, zone): [position] } if with_positions else {},
+#         map{ zone: length of the zone's log tf vector })
+def get_doc_postings(doc, with_positions=False):
+    weights = {}
+    positions = {}
+    lengths = {}
+    for text, zone in (
+        (doc.title, "title"),
+        (doc.content, "content"),
+        (doc.court, "court"),
+    ):
+        zone_tokens, zone_biwords, zone_positions = process_to_tokens(text, zone)
+        zone_weights = {
+            key: 1 + math.log10(tf)
+            for key, tf in itertools.chain(zone_tokens.items(), zone_biwords.items())
+        }
+        length = math.sqrt(sum(value * value for value in zone_weights.values()))
+        if length > 0:
+            lengths[zone] = length
+            for key, value in zone_weights.items():
+                weights[key] = value / length
+        if with_positions:
+            positions.update(zone_positions)
+    weights[doc.date.split()[0], "date"] = 1.0
+    lengths["date"] = 1.0
+    return weights, positions, lengths
+
+
+def write_run(posting, run_dir):
+    """
+    Flush in-memory postings to a run file sorted by (term, zone), each
+    record holding that key's docIDs (ascending) and weights.
+    Returns:
+        str: The path of the run file
+    """
+    fd, run_path = tempfile.mkstemp(suffix=".run", dir=run_dir)
+    with os.fdopen(fd, "wb") as f:
+        for key in sorted(posting):
+            doc_ids, weights, positions = zip(*sorted(posting[key]))
+            if positions[0] is None:
+                positions = None
+            pickle.dump((key, doc_ids, weights, positions), f)
+    return run_path
+
+
+def index_shard(args):
+    """
+    Worker: tokenize and weigh a shard of docs, flushing a sorted run to disk
+    whenever the in-memory postings exceed the memory budget.
+    Args:
+        args ((list(Doc), str, int, bool)): The docs, run directory, budget in
+                                            bytes and whether to keep positions
+    Returns:
+        (list(str), list((int, str, int, tuple)), dict): The run files
+            written, the (docID, court, date, zone lengths) of each doc
+            indexed and the (hits, misses) of its caches
+    """
+    docs, run_dir, memory_budget, with_positions = args
+    cache_before = get_cache_info()
+    max_postings = max(1, memory_budget // BYTES_PER_POSTING)
+    runs = []
+    doc_metadata = []
+    posting = defaultdict(list)
+    num_postings = 0
+
+    for doc in docs:
+        doc_weights, doc_positions, doc_lengths = get_doc_postings(doc, with_positions)
+        doc_metadata.append(
+            (
+                doc.docID,
+                doc.court.strip(),
+                parse_date(doc.date),
+                tuple(doc_lengths.get(zone, 0.0) for zone in ZONES),
+            )
+        )
+        for key, weight in doc_weights.items():
+            posting[key].append((doc.docID, weight, doc_positions.get(key)))
+        num_postings += len(doc_weights) + len(doc_positions)
+        if num_postings >= max_postings:
+            runs.append(write_run(posting, run_dir))
+            posting = defaultdict(list)
+            num_postings = 0
+
+    if posting:
+        runs.append(write_run(posting, run_dir))
+
+    cache_info = {
+        name: (hits - cache_before[name][0], misses - cache_before[name][1])
+        for name, (hits, misses) in get_cache_info().items()
+    }
+    return runs, doc_metadata, cache_info
+
+
+def read_run(run_path):
+    with open(run_path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def merge_postings(sources):
+    """
+    Streaming k-way merge of sorted runs or segments.
+    Args:
+        sources (list(iterable)): Each yields ((term, zone), docIDs, weights,
+                                  positions or None) in (term, zone) order
+    Yields:
+        ((term, zone), list(int), list(float), list(list(int)) or None):
+            Each key's full posting list, with positions if every source has
+    """
+    merged = heapq.merge(*sources, key=lambda x: x[0])
+    for key, records in itertools.groupby(merged, key=lambda x: x[0]):
+        records = list(records)
+        has_positions = all(positions is not None for *_, positions in records)
+        postings = sorted(
+            (doc_id, weight, list(positions[i]) if has_positions else None)
+            for _, doc_ids, weights, positions in records
+            for i, (doc_id, weight) in enumerate(zip(doc_ids, weights))
+        )
+        yield (
+            key,
+            [x[0] for x in postings],
+            [x[1] for x in postings],
+            [x[2] for x in postings] if has_positions else None,
+        )
+
+
+def get_shards(docs, run_dir, memory_budget, with_positions):
+    shard = []
+    for doc in docs:
+        shard.append(doc)
+        if len(shard) == SHARD_SIZE:
+            yield shard, run_dir, memory_budget, with_positions
+            shard = []
+    if shard:
+        yield shard, run_dir, memory_budget, with_positions
+
+
+def write_index(
+    posting_lists,
+    doc_ids,
+    out_dict,
+    out_postings,
+    with_impacts=False,
+    pruning=None,
+    pruned_segments=None,
+):
+    """
+    Args:
+        posting_lists (iterable): ((term, zone), docIDs, weights, positions or
+                                  None) in key order
+        doc_ids (list(int)): Every doc in the index
+        with_impacts (bool): Also write the impact-ordered postings (see
+                             impacts.py)
+        pruning (pruning.Pruning): Postings to leave out, None to keep all
+        pruned_segments (list(Segment)): The segments merged into this one,
+                                         if any of them is pruned: df and
+                                         the forward index are then carried
+                                         over from them, since their postings
+                                         no longer hold every doc of a term
+    """
+    # Write all postings in the binary block format (see postings.py)
+    # for each (term, zone): varint docID gaps followed by float32 weights,
+    # with the max weight and df kept in the dictionary so search needs no
+    # postings I/O for score bounds and idf
+    terms = []
+    entries = []
+    term_dfs = []
+    # the term being written, its entries so far and its docs in any zone
+    current = None
+    term_entries = {}
+    term_docs = set()
+    has_positions = False
+    forward = ForwardIndexBuilder()
+    impacts_file = get_impacts_path(out_dict)
+    impacts = ImpactWriter(impacts_file, doc_ids) if with_impacts else None
+    # every file is written aside and replaced whole: a rebuild must not
+    # truncate the postings a searcher still has mapped
+    with open(out_postings + ".tmp", "wb") as postingfile:
+        pointerpos = write_file_header(postingfile)
+        for (term, zone), doc_list, weights, positions in posting_lists:
+            # keys arrive sorted, so all zones of a term are consecutive
+            if term != current:
+                if term_entries:
+                    terms.append(current)
+                    entries.append(term_entries)
+                    term_dfs.append(get_df(current, term_docs, pruned_segments))
+                current, term_entries, term_docs = term, {}, set()
+            # df and feedback see every posting, pruned or not
+            term_docs.update(doc_list)
+            all_docs, all_weights = doc_list, weights
+
+            if pruning is not None:
+                doc_list, weights, positions = pruning.prune(
+                    term, doc_list, weights, positions
+                )
+                if not doc_list:
+                    continue
+            # feedback only adds words, not biwords or dates; a term gets the
+            # next row once it has a list in the index
+            if term.isalpha() and pruned_segments is None:
+                forward.add(len(terms), zone, all_docs, all_weights)
+
+            encoded = encode_posting_list(doc_list, weights)
+
+            postingfile.write(encoded)
+            # pointerpos added to track position in postings file
+            entry = PostingEntry(pointerpos, len(encoded), max(weights), len(doc_list))
+            if impacts is not None:
+                impacts.add(pointerpos, doc_list, weights)
+            pointerpos += len(encoded)
+
+            # positions section follows its posting list
+            if positions is not None:
+                encoded = encode_positions(positions)
+                postingfile.write(encoded)
+                entry = entry._replace(pos_offset=pointerpos, pos_length=len(encoded))
+                pointerpos += len(encoded)
+                has_positions = True
+            term_entries[zone] = entry
+
+    os.replace(out_postings + ".tmp", out_postings)
+
+    if term_entries:
+        terms.append(current)
+        entries.append(term_entries)
+        term_dfs.append(get_df(current, term_docs, pruned_segments))
+    if pruning is not None:
+        print(pruning.format_stats())
+    write_term_dictionary(
+        out_dict,
+        terms,
+        entries,
+        term_dfs,
+        doc_ids,
+        has_positions,
+        pruned=pruning is not None or pruned_segments is not None,
+    )
+    if pruned_segments is not None:
+        row_of = {term: row for row, term in enumerate(terms)}
+        for segment in pruned_segments:
+            if segment.forward is not None:
+                forward.add_index(
+                    segment.forward,
+                    segment.is_live(segment.forward.doc_ids),
+                    get_row_map(segment, row_of),
+                )
+    forward.write(get_forward_path(out_dict), doc_ids)
+    if impacts is not None:
+        impacts.write()
+    elif os.path.exists(impacts_file):
+        # left by an earlier build, its offsets no longer match
+        os.remove(impacts_file)
+
+
+# df of a term, over the unpruned postings of the merged segments if pruned
+def get_df(term, term_docs, pruned_segments):
+    if pruned_segments is None:
+        return len(term_docs)
+    return sum(segment.get_doc_count(term, ZONES) for segment in pruned_segments)
+
 
+# return arr[row in the segment's dictionary] = row in the new one, -1 for the
+# words of its forward index that are not in the new dictionary
+def get_row_map(segment, row_of):
+    rows = np.full(segment.dictionary.num_terms, -1, dtype=np.int64)
+    for row in np.unique(segment.forward.rows).tolist():
+        term = segment.dictionary.get_term(row).decode("utf-8")
+        rows[row] = row_of.get(term, -1)
+    return rows
 
-def build_index(in_dir, out_dict, out_postings):
+
+def build_index(
+    in_dir,
+    out_dict,
+    out_postings,
+    workers=None,
+    memory_mb=DEFAULT_MEMORY_MB,
+    with_positions=False,
+    resume=False,
+    doc_range=None,
+    with_impacts=False,
+    pruning=None,
+):
     """
     build index from documents stored in the input directory,
     then output the dictionary file and postings file
+
+    Shards of docs are tokenized in parallel, each worker spilling sorted
+    runs to disk within memory_mb, and the runs are then k-way merged into
+    the final postings without holding the whole index in memory.
+    with_positions also stores word positions of every unigram posting,
+    with_impacts an impact-ordered copy of the postings (see impacts.py),
+    and pruning leaves postings out of it (see pruning.py).
+    Every CHECKPOINT_DOCS docs the runs written so far are checkpointed (see
+    BuildState); resume continues an interrupted build from there.
+    doc_range restricts the index to the docs of one partition.
+    Returns:
+        list(int): The docIDs indexed
     """
     print("indexing...")
 
-    csv.field_size_limit(100000000)
-    corpus = csv.reader(open(in_dir, "r", encoding="utf-8"))
-    next(corpus)
-
-    raw_tf = {}
-    norm_tf = {}
-    posting = {}
-    collection_size = 0
-
-    for entry in corpus:
-        doc = Doc(entry[0], entry[1], entry[2], entry[3], entry[4])
-        tokens = {}
-        for entries in process_to_tokens(doc.title, "title"):
-            tokens.update(entries)
-        for entries in process_to_tokens(doc.content, "content"):
-            tokens.update(entries)
-        for entries in process_to_tokens(doc.court, "court"):
-            tokens.update(entries)
-        tokens[doc.date.split()[0], "date"] = 1
-
-        for key in tokens:
-            term, zone = key
-            if term not in raw_tf:
-                raw_tf[term] = 1
-            else:
-                raw_tf[term] += 1
-
-        # log and normalize (log-frequency weighting, w t,d)
-        for term in raw_tf:
-            norm_tf[key] = 1 + math.log10(raw_tf[term])
-
-        # Calculating Euclidean norm for cosine normalization
-        square_sum = 0
-        for value in norm_tf.values():
-            square_sum += value**2
-        lengthN = math.sqrt(square_sum)
-
-        for key, value in norm_tf.items():
-            # Cosine normalization
-            normalized_val = value / lengthN
-            norm_tf[key] = normalized_val
-            for key in tokens:
-                if key not in posting:
-                    posting[key] = {}
-                posting[key][doc.docID] = normalized_val
-
-        collection_size += 1
-        print(f"FileID: {doc.docID} indexed.")
-
-    print("postings generated...")
-
-    # Write all postings as a string
-    # for each term: "$ docID  docNormalizedTF nextdocID  nextdocTF..."
-    pointerpos = 0
-    final_dict = {}
-    postingfile = open(out_postings, "w")
-    for key, doc_dict in posting.items():
-        postingstring = "$"  # mark start of posting
-        term, zone = key
-        for docID, normtf in sorted(doc_dict.items(), key=lambda item: int(item[0])):
-            postingstring += " " + str(docID) + " " + str(normtf)
-
-        postingfile.write(postingstring)
-        # pointerpos added to track position in postings file
-        final_dict[(term, zone)] = pointerpos
-        pointerpos += len(postingstring)
-    postingfile.close()
-    final_dict[("*", "*")] = collection_size  # add collection size to dict
-    pickle.dump(final_dict, open(out_dict, "wb"))
+    workers = workers or os.cpu_count()
+    state = BuildState(out_postings, in_dir, with_positions, doc_range)
+    if state.start(resume):
+        print(f"resuming after {state.rows} docs...")
+    progress = Progress(os.path.getsize(in_dir), state.rows)
+    shards = get_shards(
+        read_documents(in_dir, state.rows, progress, doc_range),
+        state.build_dir,
+        memory_mb * 1024 * 1024,
+        with_positions,
+    )
+
+    with multiprocessing.Pool(workers) as pool:
+        # keep only a few shards in flight so the reader never runs ahead
+        pending = deque()
+        checkpointed = state.rows
+        for shard in itertools.chain(shards, [None]):
+            if shard is not None:
+                pending.append(pool.apply_async(index_shard, (shard,)))
+            while pending and (shard is None or len(pending) > 2 * workers):
+                shard_runs, shard_docs, shard_cache = pending.popleft().get()
+                state.add_shard(shard_runs, shard_docs, shard_cache)
+                progress.update(len(shard_docs))
+                if state.rows - checkpointed >= CHECKPOINT_DOCS:
+                    state.save_checkpoint()
+                    checkpointed = state.rows
+    state.save_checkpoint()
+    progress.finish()
+    print(format_cache_stats(state.cache_info))
+
+    runs = state.get_run_paths()
+    print(f"postings generated in {len(runs)} runs, merging...")
+    doc_metadata = state.read_docs()
+    doc_ids = [doc_id for doc_id, *_ in doc_metadata]
+    sources = [read_run(run) for run in runs]
+    write_index(
+        merge_postings(sources),
+        doc_ids,
+        out_dict,
+        out_postings,
+        with_impacts,
+        pruning,
+    )
+    write_doc_metadata(get_metadata_path(out_dict), doc_metadata)
+    # only a finished build drops its state, a failed one can be resumed
+    state.remove()
+
     print("postings written to disk...")
+    return doc_ids
 
 
-input_directory = output_file_dictionary = output_file_postings = None
+def delete_from_segments(manifest, out_dict, doc_ids):
+    """
+    Tombstone doc_ids in every segment of the manifest that holds them.
+    Returns:
+        int: The number of docs deleted
+    """
+    num_deleted = 0
+    for entry in manifest["segments"]:
+        segment = Segment(*get_segment_files(out_dict, entry), entry["deleted"])
+        deleted = segment.delete(doc_ids)
+        if deleted:
+            entry["deleted"] = segment.packed_deleted()
+            num_deleted += deleted
+    return num_deleted
 
-try:
-    opts, args = getopt.getopt(sys.argv[1:], "i:d:p:")
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
 
-for o, a in opts:
-    if o == "-i":  # input directory
-        input_directory = a
-    elif o == "-d":  # dictionary file
-        output_file_dictionary = a
-    elif o == "-p":  # postings file
-        output_file_postings = a
-    else:
-        assert False, "unhandled option"
+def delete_documents(doc_ids, out_dict, out_postings):
+    manifest = load_manifest(out_dict, out_postings)
+    num_deleted = delete_from_segments(manifest, out_dict, doc_ids)
+    save_manifest(out_dict, manifest)
+    print(f"{num_deleted} docs deleted...")
+    merge_segments(out_dict, out_postings)
+
 
-if (
-    input_directory == None
-    or output_file_postings == None
-    or output_file_dictionary == None
+def append_segment(
+    in_dir,
+    out_dict,
+    out_postings,
+    workers,
+    memory_mb,
+    with_positions=False,
+    resume=False,
+    doc_range=None,
+    with_impacts=False,
+    pruning=None,
 ):
-    usage()
-    sys.exit(2)
+    """
+    Index the docs of in_dir into a new segment of an existing index.
+    A doc that is already in the index is replaced by its new version.
+    The manifest only changes once the segment is built, so an interrupted
+    append resumes into the same segment files.
+    doc_range restricts the segment to the docs of one partition.
+    Once any segment has impact-ordered postings, new ones get them too.
+    The merge policy then runs in this process before it returns.
+    """
+    manifest = load_manifest(out_dict, out_postings)
+    with_impacts = with_impacts or any(
+        os.path.exists(get_impacts_path(get_segment_files(out_dict, entry)[0]))
+        for entry in manifest["segments"]
+    )
+    manifest["generation"] += 1
+    generation = manifest["generation"]
+    seg_dict, seg_postings = f"{out_dict}.{generation}", f"{out_postings}.{generation}"
+
+    doc_ids = build_index(
+        in_dir,
+        seg_dict,
+        seg_postings,
+        workers,
+        memory_mb,
+        with_positions,
+        resume,
+        doc_range,
+        with_impacts,
+        pruning,
+    )
+    delete_from_segments(manifest, out_dict, doc_ids)
+    manifest["segments"].append(get_segment_entry(seg_dict, seg_postings))
+    save_manifest(out_dict, manifest)
+    print(f"segment {generation} added, {len(manifest['segments'])} segments...")
+    merge_segments(out_dict, out_postings)
+
+
+# split the docIDs into num_partitions ranges of about as many docs each
+# return [(first docID, end docID), ...], None for the open ends
+def get_partition_ranges(doc_ids, num_partitions):
+    doc_ids = sorted(doc_ids)
+    bounds = sorted(
+        {doc_ids[len(doc_ids) * i // num_partitions] for i in range(1, num_partitions)}
+        if doc_ids
+        else ()
+    )
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def get_partition_files(out_dict, out_postings, partition):
+    return f"{out_dict}.part{partition}", f"{out_postings}.part{partition}"
+
+
+def build_partitioned_index(
+    in_dir,
+    out_dict,
+    out_postings,
+    num_partitions,
+    workers=None,
+    memory_mb=DEFAULT_MEMORY_MB,
+    with_positions=False,
+    resume=False,
+    with_impacts=False,
+    pruning=None,
+):
+    """
+    Build num_partitions independent indexes, each of the docs in one range
+    of docIDs, and list them next to out_dict (see segments.py).
+    Partitions are built one after the other, each by the whole worker pool.
+    resume skips the partitions finished before the interruption and resumes
+    the one in progress; it must be given the same num_partitions.
+    """
+    if not resume:
+        remove_partitions(out_dict, out_postings)
+    ranges = get_partition_ranges(read_doc_ids(in_dir), num_partitions)
+
+    partitions = []
+    for i, doc_range in enumerate(ranges):
+        part_dict, part_postings = get_partition_files(out_dict, out_postings, i)
+        entry = get_segment_entry(part_dict, part_postings)
+        # tombstones live in the segment manifest of each partition
+        del entry["deleted"]
+        entry["doc_range"] = doc_range
+        partitions.append(entry)
+        # a fresh build starts without partition files, so one without
+        # build state left is finished
+        if (
+            resume
+            and os.path.exists(part_postings)
+            and not os.path.exists(part_postings + BUILD_SUFFIX)
+        ):
+            print(f"partition {i} already built...")
+            continue
+
+        print(f"partition {i} of docIDs {doc_range}...")
+        build_index(
+            in_dir,
+            part_dict,
+            part_postings,
+            workers,
+            memory_mb,
+            with_positions,
+            resume,
+            doc_range,
+            with_impacts,
+            pruning,
+        )
+        reset_segments(part_dict, part_postings)
+
+    save_partitions(out_dict, partitions)
+    # the base pair of an earlier unpartitioned build is replaced
+    remove_segments(out_dict, out_postings)
+    remove_segment_files(out_dict, out_postings)
+    print(f"{len(partitions)} partitions written...")
+
+
+def append_partitions(
+    in_dir,
+    out_dict,
+    out_postings,
+    partitions,
+    workers,
+    memory_mb,
+    with_positions=False,
+    resume=False,
+    with_impacts=False,
+    pruning=None,
+):
+    # each doc goes to the partition of its docID, replacing any old version
+    doc_ids = read_doc_ids(in_dir)
+    for entry in partitions:
+        if not any(in_doc_range(doc_id, entry["doc_range"]) for doc_id in doc_ids):
+            continue
+        part_dict, part_postings = get_segment_files(out_dict, entry)
+        append_segment(
+            in_dir,
+            part_dict,
+            part_postings,
+            workers,
+            memory_mb,
+            with_positions,
+            resume,
+            entry["doc_range"],
+            with_impacts,
+            pruning,
+        )
+
+
+# return [(dictionary, postings), ...] of every partition, or of the index
+# itself if it is not partitioned
+def get_index_parts(out_dict, out_postings):
+    partitions = load_partitions(out_dict)
+    if partitions is None:
+        return [(out_dict, out_postings)]
+    return [get_segment_files(out_dict, entry) for entry in partitions]
+
+
+# a rebuild replaces the partitions of an earlier partitioned build
+def remove_partitions(out_dict, out_postings):
+    partitions = load_partitions(out_dict)
+    if partitions is None:
+        return
+
+    for entry in partitions:
+        part_dict, part_postings = get_segment_files(out_dict, entry)
+        remove_segments(part_dict, part_postings)
+        remove_segment_files(part_dict, part_postings)
+    os.remove(get_partitions_path(out_dict))
+
+
+# yield ((term, zone), docIDs, weights, positions) of the live docs of a segment
+def read_segment(segment):
+    for key in segment.get_keys():
+        reader = segment.get_posting_list(key)
+        doc_ids, weights = reader.decode()
+        if len(doc_ids) == 0:
+            continue
+
+        positions = None
+        if reader.has_positions:
+            all_docs, bounds, all_positions = reader.decode_positions()
+            rows = np.searchsorted(all_docs, doc_ids)
+            positions = [
+                all_positions[bounds[i] : bounds[i + 1]].tolist() for i in rows
+            ]
+        yield key, doc_ids.tolist(), weights.tolist(), positions
+
+
+# yield (docID, court, date, zone lengths) of the live docs of a segment
+def read_doc_metadata(segment):
+    live = ~segment.deleted
+    if segment.metadata is not None:
+        yield from segment.metadata.get_records(live)
+        return
+    # segments indexed before the metadata existed: all of it unknown
+    for doc_id in segment.doc_ids[live].tolist():
+        yield doc_id, "", 0, (0.0,) * len(ZONES)
+
+
+def merge_segments(out_dict, out_postings, force=False):
+    """
+    Compact the segments picked by the merge policy (all of them if force)
+    into one new segment, dropping deleted docs. The manifest is swapped in
+    before the old files are removed, so running searchers are unaffected.
+    """
+    manifest = load_manifest(out_dict, out_postings)
+    entries = manifest["segments"]
+    segments = [
+        Segment(*get_segment_files(out_dict, entry), entry["deleted"])
+        for entry in entries
+    ]
+    if force:
+        selected = list(range(len(segments)))
+    else:
+        selected = select_segments_to_merge(segments)
+    if not selected or (len(selected) == 1 and segments[selected[0]].num_deleted == 0):
+        return
+
+    print(f"merging {len(selected)} segments...")
+    manifest["generation"] += 1
+    generation = manifest["generation"]
+    seg_dict, seg_postings = f"{out_dict}.{generation}", f"{out_postings}.{generation}"
+    doc_ids = np.concatenate(
+        [segments[i].doc_ids[~segments[i].deleted] for i in selected]
+    )
+    sources = [read_segment(segments[i]) for i in selected]
+    with_impacts = any(segments[i].impacts is not None for i in selected)
+    # pruned postings stay pruned, their df and feedback words come along
+    pruned_segments = None
+    if any(segments[i].pruned for i in selected):
+        pruned_segments = [segments[i] for i in selected]
+    write_index(
+        merge_postings(sources),
+        doc_ids,
+        seg_dict,
+        seg_postings,
+        with_impacts,
+        pruned_segments=pruned_segments,
+    )
+    write_doc_metadata(
+        get_metadata_path(seg_dict),
+        itertools.chain.from_iterable(read_doc_metadata(segments[i]) for i in selected),
+    )
+
+    manifest["segments"] = [e for i, e in enumerate(entries) if i not in selected]
+    manifest["segments"].append(get_segment_entry(seg_dict, seg_postings))
+    save_manifest(out_dict, manifest)
+    for i in selected:
+        remove_segment_files(segments[i].dictionary_file, segments[i].postings_file)
+    print(f"merged into segment {generation}, {len(manifest['segments'])} segments...")
+
+
+# a full rebuild replaces the base segment: list it alone in a new manifest,
+# which is what makes searchers reopen, then drop the old appended segments
+def reset_segments(out_dict, out_postings):
+    manifest = load_manifest(out_dict, out_postings)
+    base = get_segment_entry(out_dict, out_postings)
+    save_manifest(out_dict, {"generation": manifest["generation"], "segments": [base]})
+    remove_appended_segments(out_dict, out_postings, manifest)
+
+
+# drop the segments and manifest of an index whose base files go as well
+def remove_segments(out_dict, out_postings):
+    manifest_path = get_manifest_path(out_dict)
+    if not os.path.exists(manifest_path):
+        return
+
+    remove_appended_segments(
+        out_dict, out_postings, load_manifest(out_dict, out_postings)
+    )
+    os.remove(manifest_path)
+
+
+def remove_appended_segments(out_dict, out_postings, manifest):
+    base = get_segment_files(out_dict, get_segment_entry(out_dict, out_postings))
+    for entry in manifest["segments"]:
+        seg_dict, seg_postings = get_segment_files(out_dict, entry)
+        if seg_dict not in base:
+            remove_segment_files(seg_dict, seg_postings)
+
+
+def remove_segment_files(seg_dict, seg_postings):
+    for path in (
+        seg_dict,
+        seg_postings,
+        get_forward_path(seg_dict),
+        get_metadata_path(seg_dict),
+        get_impacts_path(seg_dict),
+    ):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def write_synonyms(out_dict, out_postings):
+    """
+    Precompute the query expansion of every word in the index into the
+    synonym table next to the dictionary.
+    """
+    terms = set()
+    for part_dict, part_postings in get_index_parts(out_dict, out_postings):
+        for segment in open_segments(part_dict, part_postings):
+            # biwords and non-alphabetic tokens are never expanded on their own
+            terms.update(term for term, zone in segment.get_keys() if term.isalpha())
+
+    print(f"expanding {len(terms)} words...")
+    write_synonym_table(terms, get_synonyms_path(out_dict))
+    print("synonyms written to disk...")
+
+
+def main():
+    input_directory = output_file_dictionary = output_file_postings = None
+    workers = num_partitions = None
+    memory_mb = DEFAULT_MEMORY_MB
+    append = merge = with_positions = with_impacts = synonyms = resume = False
+    deletions_file = None
+    min_biword_df = 0
+    epsilon = max_postings = None
+
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:],
+            "i:d:p:j:m:n:ax:PIs",
+            [
+                "merge",
+                "resume",
+                "prune-biwords=",
+                "prune-epsilon=",
+                "prune-cap=",
+            ],
+        )
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == "-i":  # input directory
+            input_directory = a
+        elif o == "-d":  # dictionary file
+            output_file_dictionary = a
+        elif o == "-p":  # postings file
+            output_file_postings = a
+        elif o == "-j":  # number of worker processes
+            workers = int(a)
+        elif o == "-m":  # memory budget per worker, in MB
+            memory_mb = int(a)
+        elif o == "-n":  # number of docID range partitions
+            num_partitions = int(a)
+        elif o == "-a":  # append a segment
+            append = True
+        elif o == "-x":  # file of docIDs to delete, one per line
+            deletions_file = a
+        elif o == "--merge":  # compact every segment into one
+            merge = True
+        elif o == "-P":  # positional index
+            with_positions = True
+        elif o == "-I":  # impact-ordered postings
+            with_impacts = True
+        elif o == "-s":  # precompute the synonym table
+            synonyms = True
+        elif o == "--resume":  # continue an interrupted build
+            resume = True
+        elif o == "--prune-biwords":  # min df of a biword list
+            min_biword_df = int(a)
+        elif o == "--prune-epsilon":  # term-centric pruning threshold
+            epsilon = float(a)
+        elif o == "--prune-cap":  # max postings per list
+            max_postings = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if output_file_postings == None or output_file_dictionary == None:
+        usage()
+        sys.exit(2)
+    if max_postings != None and max_postings < 1:
+        usage()
+        sys.exit(2)
+    if epsilon != None and not 0 < epsilon <= 1:
+        usage()
+        sys.exit(2)
+    # appends, deletes and merges need an index to change
+    if (append or deletions_file != None or merge) and not index_exists(
+        output_file_dictionary
+    ):
+        usage()
+        sys.exit(2)
+    pruning = None
+    if min_biword_df > 0 or epsilon != None or max_postings != None:
+        pruning = Pruning(min_biword_df, epsilon or 0.0, max_postings)
+
+    parts = get_index_parts(output_file_dictionary, output_file_postings)
+    if deletions_file != None:
+        with open(deletions_file, "r") as f:
+            doc_ids = [int(line) for line in f if line.strip()]
+        for part_dict, part_postings in parts:
+            delete_documents(doc_ids, part_dict, part_postings)
+    if merge:
+        for part_dict, part_postings in parts:
+            merge_segments(part_dict, part_postings, force=True)
+    partitions = load_partitions(output_file_dictionary)
+    if input_directory == None:
+        if deletions_file == None and not merge and not synonyms:
+            usage()
+            sys.exit(2)
+    elif append and partitions is not None:
+        append_partitions(
+            input_directory,
+            output_file_dictionary,
+            output_file_postings,
+            partitions,
+            workers,
+            memory_mb,
+            with_positions,
+            resume,
+            with_impacts=with_impacts,
+            pruning=pruning,
+        )
+    elif append:
+        append_segment(
+            input_directory,
+            output_file_dictionary,
+            output_file_postings,
+            workers,
+            memory_mb,
+            with_positions,
+            resume,
+            with_impacts=with_impacts,
+            pruning=pruning,
+        )
+    elif num_partitions != None:
+        build_partitioned_index(
+            input_directory,
+            output_file_dictionary,
+            output_file_postings,
+            num_partitions,
+            workers,
+            memory_mb,
+            with_positions,
+            resume,
+            with_impacts=with_impacts,
+            pruning=pruning,
+        )
+    else:
+        build_index(
+            input_directory,
+            output_file_dictionary,
+            output_file_postings,
+            workers,
+            memory_mb,
+            with_positions,
+            resume,
+            with_impacts=with_impacts,
+            pruning=pruning,
+        )
+        reset_segments(output_file_dictionary, output_file_postings)
+        remove_partitions(output_file_dictionary, output_file_postings)
+
+    if synonyms:
+        write_synonyms(output_file_dictionary, output_file_postings)
+
 
-build_index(input_directory, output_file_dictionary, output_file_postings)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import atexit
+import contextlib
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from normalize import get_cache_info
+from postings import get_read_counters
+
+# Per-query instrumentation, off unless configured (search.py --trace and
+# --profile, or these environment variables):
+#   HW4_TRACE=file        one JSON object per query appended to file, "-"
+#                         for stderr: latency, time spent in each pipeline
+#                         stage and counters of the work done
+#   HW4_PROFILE=file      sample the stack of every query and write the
+#                         samples of the slowest ones to file as folded
+#                         stacks ("frame;frame;frame count"), ready for
+#                         flamegraph.pl or speedscope
+#   HW4_PROFILE_TOP=n     how many of the slowest queries to keep
+# While off, span() hands out a shared no-op context and count() returns at
+# once, so the hooks cost a function call.
+TRACE_ENV = "HW4_TRACE"
+PROFILE_ENV = "HW4_PROFILE"
+PROFILE_TOP_ENV = "HW4_PROFILE_TOP"
+PROFILE_TOP = 10
+# the sampler can only run when the query thread gives up the GIL, at most
+# every sys.getswitchinterval() (5 ms by default) in pure Python code
+SAMPLE_INTERVAL = 0.001
+
+NULL_SPAN = contextlib.nullcontext()
+
+trace_out = None
+profiles = None
+# the trace of the query being answered, None outside of one
+current = None
+
+
+def configure(trace_file=None, profile_file=None, profile_top=PROFILE_TOP):
+    """
+    Args:
+        trace_file (str): Where to append per-query JSON, "-" for stderr,
+                          None to leave tracing off
+        profile_file (str): Where to write the folded stacks of the slowest
+                            queries when the process exits, None for no
+                            profiling
+        profile_top (int): Number of slowest queries to keep stacks of
+    """
+    global trace_out, profiles
+    if trace_file == "-":
+        trace_out = sys.stderr
+    elif trace_file:
+        trace_out = open(trace_file, "a")
+        atexit.register(trace_out.close)
+    if profile_file:
+        profiles = SlowestProfiles(profile_file, profile_top)
+        atexit.register(profiles.write)
+
+
+def configure_from_env():
+    configure(
+        os.environ.get(TRACE_ENV),
+        os.environ.get(PROFILE_ENV),
+        int(os.environ.get(PROFILE_TOP_ENV, PROFILE_TOP)),
+    )
+
+
+def is_enabled() -> bool:
+    return trace_out is not None or profiles is not None
+
+
+def tracing() -> bool:
+    return current is not None
+
+
+class Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.trace.add_span(self.name, time.perf_counter() - self.start)
+
+
+def span(name: str):
+    """
+    Time a pipeline stage of the current query. Spans of the same name add
+    up, and nested spans are counted in their parents too.
+    """
+    if current is None:
+        return NULL_SPAN
+    return Span(current, name)
+
+
+def count(name: str, value: int = 1):
+    if current is not None:
+        current.counters[name] += value
+
+
+class QueryTrace:
+    """
+    Collects the spans and counters of one query, then writes them out and
+    hands its stack samples to the slowest query profiles.
+    """
+
+    def __init__(self, query: str):
+        self.query = query
+        self.results = None
+        self.spans = defaultdict(lambda: [0.0, 0])
+        self.counters = Counter()
+        self.sampler = None
+
+    def add_span(self, name, seconds):
+        totals = self.spans[name]
+        totals[0] += seconds
+        totals[1] += 1
+
+    def __enter__(self):
+        global current
+        current = self
+        self.reads_before = get_read_counters()
+        self.caches_before = get_cache_info()
+        if profiles is not None:
+            self.sampler = StackSampler()
+            self.sampler.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        global current
+        latency = (time.perf_counter() - self.start) * 1000
+        current = None
+        stacks = self.sampler.stop() if self.sampler is not None else None
+
+        reads = get_read_counters()
+        self.counters["postings_lists"] += reads["lists"] - self.reads_before["lists"]
+        self.counters["postings_bytes"] += reads["bytes"] - self.reads_before["bytes"]
+        caches = {}
+        for name, (hits, misses) in get_cache_info().items():
+            hits_before, misses_before = self.caches_before.get(name, (0, 0))
+            if hits - hits_before or misses - misses_before:
+                caches[name] = {
+                    "hits": hits - hits_before,
+                    "misses": misses - misses_before,
+                }
+
+        if trace_out is not None:
+            record = {
+                "query": self.query.strip(),
+                "latency_ms": latency,
+                "results": self.results,
+                "spans": {
+                    name: {"ms": seconds * 1000, "calls": calls}
+                    for name, (seconds, calls) in self.spans.items()
+                },
+                "counters": dict(self.counters),
+                "caches": caches,
+            }
+            trace_out.write(json.dumps(record) + "\n")
+            trace_out.flush()
+        if stacks is not None:
+            profiles.add(self.query, latency, stacks)
+
+
+def get_frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def fold_stack(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(get_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """
+    Samples the stack of the thread that started it from a background
+    thread, counting each distinct folded stack.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[fold_stack(frame)] += 1
+
+    def stop(self) -> Counter:
+        self.stopped.set()
+        self.thread.join()
+        return self.stacks
+
+
+class SlowestProfiles:
+    """
+    The stack samples of the slowest queries seen, rooted at a frame naming
+    the query so one flamegraph can hold them all.
+    """
+
+    def __init__(self, profile_file, top: int = PROFILE_TOP):
+        self.profile_file = profile_file
+        self.top = top
+        self.heap = []
+        self.seen = 0
+
+    def add(self, query: str, latency: float, stacks: Counter):
+        self.seen += 1
+        entry = (latency, self.seen, query, stacks)
+        if len(self.heap) < self.top:
+            heapq.heappush(self.heap, entry)
+        elif latency > self.heap[0][0]:
+            heapq.heapreplace(self.heap, entry)
+
+    def write(self):
+        with open(self.profile_file, "w") as f:
+            for latency, seen, query, stacks in sorted(self.heap, reverse=True):
+                # ";" separates frames, keep it out of the root frame
+                root = f"query {seen} ({latency:.1f} ms): {query.strip()}"
+                root = root.replace(";", ",")
+                for stack, samples in sorted(stacks.items()):
+                    f.write(f"{root};{stack} {samples}\n")
+
+
+configure_from_env()
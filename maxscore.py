@@ -0,0 +1,159 @@
+import numpy as np
+
+from instrument import count
+from postings import EMPTY_DOCS, EMPTY_WEIGHTS, in_sorted
+from retrieve import ZONES, get_doc_priors, get_max_prior, get_posting_readers
+
+# slack on upper bounds so float rounding never prunes a relevant doc
+EPSILON = 1e-9
+
+
+def get_top_docs(
+    query_weights: dict[str, float],
+    threshold: float,
+    k: int = None,
+    candidates: np.ndarray = None,
+    with_prior: bool = False,
+) -> list[tuple[int, float]]:
+    """
+    Document-at-a-time MaxScore over every (term, zone) posting list.
+
+    Lists are ordered by their upper bound (query weight x zone weight x max
+    weight in the list). The longest prefix of lists whose bounds sum to at
+    most the threshold is non-essential: a doc found only in those cannot be
+    relevant, so candidates come from the essential lists alone. Each
+    candidate is then probed in the non-essential lists, using the per-block
+    max weights to drop it as soon as it cannot exceed the threshold or the
+    current k-th best score, and only the blocks of surviving candidates are
+    decoded.
+
+    With the static prior, every matching doc may gain up to the highest
+    prior, so lists are only non-essential while their bounds sum to at most
+    the threshold less that much.
+
+    Args:
+        query_weights (dict(str, float)): Normalized tf-idf of each query term
+        threshold (float): Docs must score strictly above this to be kept
+        k (int): Max number of docs to return, None for all relevant docs
+        candidates (np.ndarray): Sorted docIDs to restrict the results to
+        with_prior (bool): Add the static prior of each matching doc
+    Returns:
+        list((int, float)): (docID, score) from most to least relevant, scores
+                            identical to exhaustive term-at-a-time scoring
+    """
+    lists = []
+    for term, weight in query_weights.items():
+        if weight <= 0:
+            continue
+        for zone, zone_weight in ZONES.items():
+            coef = weight * zone_weight
+            # one list per index segment holding term.zone
+            for reader in get_posting_readers(term, zone):
+                bound = coef * reader.entry.max_weight
+                lists.append((bound, coef, term, zone, reader))
+
+    lists.sort(key=lambda x: x[0])
+    num_lists = len(lists)
+    bounds = np.cumsum([x[0] for x in lists])
+    max_prior = get_max_prior() if with_prior else 0.0
+    num_non_essential = int(
+        np.searchsorted(bounds, threshold - max_prior - EPSILON, "right")
+    )
+    if num_non_essential == num_lists:
+        return []
+
+    coefs = np.array([x[1] for x in lists])
+
+    # candidates are every doc in an essential list
+    if candidates is None:
+        decoded = [x[4].decode() for x in lists[num_non_essential:]]
+    else:
+        decoded = [x[4].decode_docs(candidates) for x in lists[num_non_essential:]]
+    candidates = np.unique(np.concatenate([doc_ids for doc_ids, _ in decoded]))
+    count("docs_scored", len(candidates))
+    priors = get_doc_priors(candidates) if with_prior else np.zeros(len(candidates))
+    partial = priors.astype(np.float64)
+    # (candidate rows, weights) found in each list, for the exact scores
+    found = [None] * num_lists
+    for i, (doc_ids, weights) in enumerate(decoded, num_non_essential):
+        rows = np.searchsorted(candidates, doc_ids)
+        found[i] = (rows, weights)
+        # each doc appears once per list, so fancy-index adds are safe
+        partial[rows] += coefs[i] * weights.astype(np.float64)
+
+    # upper bound of what the non-essential lists can still add to each doc,
+    # from their per-block max weights
+    non_essential = range(num_non_essential - 1, -1, -1)
+    remaining = np.zeros(len(candidates))
+    for i in non_essential:
+        remaining += coefs[i] * lists[i][4].block_bounds(candidates)
+
+    alive = can_be_relevant(partial, remaining, threshold, k)
+    for i in non_essential:
+        alive_idx = np.flatnonzero(alive)
+        if len(alive_idx) == 0:
+            return []
+        reader = lists[i][4]
+        alive_docs = candidates[alive_idx]
+        doc_ids, weights = reader.decode_blocks(reader.blocks_of(alive_docs))
+        found[i] = (EMPTY_DOCS, EMPTY_WEIGHTS)
+        if len(doc_ids) > 0:
+            pos = np.minimum(np.searchsorted(doc_ids, alive_docs), len(doc_ids) - 1)
+            hit = doc_ids[pos] == alive_docs
+            found[i] = (alive_idx[hit], weights[pos[hit]])
+            partial[alive_idx[hit]] += coefs[i] * weights[pos[hit]].astype(np.float64)
+
+        remaining[alive_idx] -= coefs[i] * reader.block_bounds(alive_docs)
+        alive &= can_be_relevant(partial, remaining, threshold, k)
+
+    alive_idx = np.flatnonzero(alive)
+    scores = get_exact_scores(query_weights, lists, found, alive_idx)
+    if with_prior:
+        scores += priors[alive_idx]
+    relevant = [
+        (doc, score)
+        for doc, score in zip(candidates[alive_idx].tolist(), scores.tolist())
+        if score > threshold
+    ]
+    relevant.sort(key=lambda x: (-x[1], x[0]))
+    return relevant[:k]
+
+
+def can_be_relevant(partial, remaining, threshold, k):
+    upper = partial + remaining
+    alive = upper >= threshold - EPSILON
+    if k is not None and 0 < k <= len(partial):
+        # partial scores are lower bounds, the k-th best of them must be beaten
+        kth_best = np.partition(partial, -k)[-k]
+        alive &= upper >= kth_best - EPSILON
+    return alive
+
+
+def get_exact_scores(query_weights, lists, found, alive_idx):
+    """
+    Sum the zone weighted scores in the same order as the term-at-a-time
+    scorer in search.py, so the floats match it bit for bit.
+    Args:
+        found (list((np.ndarray, np.ndarray))): The candidate rows and
+                                                weights found in each list
+        alive_idx (np.ndarray): Sorted rows of the candidates to score
+    Returns:
+        np.ndarray: The score of each of those candidates
+    """
+    columns = {}
+    for i, x in enumerate(lists):
+        columns.setdefault((x[2], x[3]), []).append(i)
+
+    scores = np.zeros(len(alive_idx))
+    term_score = np.zeros(len(alive_idx))
+    for term, weight in query_weights.items():
+        term_score[:] = 0
+        for zone, zone_weight in ZONES.items():
+            # a live doc is in a single segment, one list per zone holds it
+            for i in columns.get((term, zone), []):
+                rows, weights = found[i]
+                hit = in_sorted(rows, alive_idx)
+                slots = np.searchsorted(alive_idx, rows[hit])
+                term_score[slots] += weights[hit].astype(np.float64) * zone_weight
+        scores += term_score * weight
+    return scores
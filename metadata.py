@@ -0,0 +1,308 @@
+import calendar
+import datetime
+import mmap
+import os
+import re
+import struct
+from typing import NamedTuple
+
+import numpy as np
+
+from constants import IMPORTANT_COURTS, MOST_IMPORTANT_COURTS, CourtTier
+from termdict import ZONES
+
+# Per-doc metadata of a segment, next to its dictionary: columns that search
+# filters and boosts with, without reading the court and date postings, and
+# the lnc lengths of each zone the postings were normalized by.
+# Layout (all integers little-endian):
+#   header: MAGIC, u16 version, u16 court count, u32 doc count,
+#           u32 court name bytes
+#   u32[courts + 1]  byte offset of each court name in the name bytes
+#   name bytes       utf-8 court names back to back, sorted
+#   i64[docs]        sorted docIDs
+#   i32[docs]        date posted as YYYYMMDD, 0 if unknown
+#   f32[docs]        static prior of the doc, see get_static_prior
+#   u16[docs]        court id, an index into the court names
+#   u8[docs]         CourtTier of the court
+#   f32[docs, zones] length of the log tf vector of each zone of each doc,
+#                    zones in termdict.ZONES order, 0 for an empty zone
+#   i32[docs]        the dates sorted, then
+#   u32[docs]        the position of each of those docs in the columns: a
+#                    date index, so a date range is two binary searches
+# Sections are padded to 8 bytes so every column can be viewed in place.
+METADATA_SUFFIX = ".meta"
+MAGIC = b"HW4M"
+VERSION = 3
+
+HEADER = struct.Struct("<4sHHII")
+
+COURT_TIERS = {
+    **{court: CourtTier.IMPORTANT for court in IMPORTANT_COURTS},
+    **{court: CourtTier.MOST_IMPORTANT for court in MOST_IMPORTANT_COURTS},
+}
+
+# static prior added to the score of every matching doc when boosting: a
+# bonus by court tier plus a small one growing linearly with the year,
+# kept well below the relevance threshold so it only reorders close calls
+TIER_PRIORS = {
+    CourtTier.OTHER: 0.0,
+    CourtTier.IMPORTANT: 0.02,
+    CourtTier.MOST_IMPORTANT: 0.05,
+}
+RECENCY_PRIOR = 0.02
+RECENCY_FROM_YEAR = 1990
+RECENCY_TO_YEAR = 2020
+
+DATE_PATTERN = re.compile(r"(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?")
+
+
+class DocFilter(NamedTuple):
+    """
+    Restricts the results to docs of the given courts (case insensitive),
+    of at least min_tier and posted within [date_from, date_to] (YYYYMMDD,
+    inclusive). None leaves a field unrestricted.
+    """
+
+    courts: tuple = None
+    min_tier: CourtTier = None
+    date_from: int = None
+    date_to: int = None
+
+    def is_empty(self) -> bool:
+        return all(value is None for value in self)
+
+    def narrow(self, other) -> "DocFilter":
+        """
+        Returns:
+            DocFilter: Passing only the docs that pass both filters
+        """
+        if other is None:
+            return self
+        courts = self.courts
+        if courts is None:
+            courts = other.courts
+        elif other.courts is not None:
+            other_courts = {court.casefold() for court in other.courts}
+            courts = tuple(c for c in courts if c.casefold() in other_courts)
+        return DocFilter(
+            courts,
+            max_of(self.min_tier, other.min_tier),
+            max_of(self.date_from, other.date_from),
+            min_of(self.date_to, other.date_to),
+        )
+
+
+def max_of(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+def min_of(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+
+def get_metadata_path(dictionary_file):
+    return dictionary_file + METADATA_SUFFIX
+
+
+def pad(size: int) -> int:
+    return -size % 8
+
+
+def get_court_tier(court: str) -> CourtTier:
+    return COURT_TIERS.get(court.strip(), CourtTier.OTHER)
+
+
+def parse_date(text: str, end: bool = False) -> int:
+    """
+    Args:
+        text (str): A date starting with YYYY, YYYY-MM or YYYY-MM-DD
+        end (bool): Fill a missing month or day with the last rather than
+                    the first one, for the end of a range
+    Returns:
+        int: The date as YYYYMMDD, 0 if text is not a valid date
+    """
+    match = DATE_PATTERN.match(text.strip())
+    if match is None:
+        return 0
+    year, month, day = (int(value) if value else None for value in match.groups())
+    if month is None:
+        month = 12 if end else 1
+    try:
+        if day is None:
+            # a month range ends on its real last day
+            day = calendar.monthrange(year, month)[1] if end else 1
+        date = datetime.date(year, month, day)
+    except ValueError:
+        return 0
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+def get_static_prior(tier: CourtTier, date: int) -> float:
+    prior = TIER_PRIORS[tier]
+    if date:
+        years = RECENCY_TO_YEAR - RECENCY_FROM_YEAR
+        recency = (date // 10000 - RECENCY_FROM_YEAR) / years
+        prior += RECENCY_PRIOR * min(max(recency, 0.0), 1.0)
+    return prior
+
+
+def write_doc_metadata(metadata_file, docs):
+    """
+    Args:
+        metadata_file (str): Path of the metadata file
+        docs (iterable((int, str, int, tuple(float)))): (docID, court,
+            YYYYMMDD date, zone lengths) of every doc in the segment
+    """
+    docs = sorted(docs)
+    courts = sorted({court for _, court, _, _ in docs})
+    court_ids = {court: i for i, court in enumerate(courts)}
+
+    encoded = [court.encode("utf-8") for court in courts]
+    name_offsets = np.zeros(len(courts) + 1, dtype="<u4")
+    np.cumsum([len(name) for name in encoded], out=name_offsets[1:])
+    name_bytes = b"".join(encoded)
+
+    tiers = [get_court_tier(court) for _, court, _, _ in docs]
+    dates = np.asarray([date for _, _, date, _ in docs], dtype="<i4")
+    # docs are in docID order, a stable sort keeps ties that way
+    date_order = np.argsort(dates, kind="stable").astype("<u4")
+    lengths = np.zeros((len(docs), len(ZONES)), dtype="<f4")
+    if docs:
+        lengths[:] = [zone_lengths for *_, zone_lengths in docs]
+    sections = [
+        name_offsets.tobytes(),
+        name_bytes,
+        np.asarray([doc_id for doc_id, *_ in docs], dtype="<i8").tobytes(),
+        dates.tobytes(),
+        np.asarray(
+            [get_static_prior(tier, date) for tier, date in zip(tiers, dates.tolist())],
+            dtype="<f4",
+        ).tobytes(),
+        np.asarray(
+            [court_ids[court] for _, court, _, _ in docs], dtype="<u2"
+        ).tobytes(),
+        np.asarray(tiers, dtype=np.uint8).tobytes(),
+        lengths.tobytes(),
+        dates[date_order].tobytes(),
+        date_order.tobytes(),
+    ]
+    header = HEADER.pack(MAGIC, VERSION, len(courts), len(docs), len(name_bytes))
+    with open(metadata_file + ".tmp", "wb") as f:
+        f.write(header + b"\0" * pad(len(header)))
+        for section in sections:
+            f.write(section + b"\0" * pad(len(section)))
+    os.replace(metadata_file + ".tmp", metadata_file)
+
+
+class DocMetadata:
+    """
+    A metadata file mapped in place, its columns aligned with the sorted
+    docIDs of the segment.
+    """
+
+    def __init__(self, metadata_file):
+        with open(metadata_file, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, num_courts, num_docs, name_bytes = HEADER.unpack_from(
+            self.buf, 0
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("unsupported doc metadata, rebuild the index")
+
+        pos = HEADER.size + pad(HEADER.size)
+        offsets = np.frombuffer(self.buf, "<u4", num_courts + 1, pos).tolist()
+        pos += 4 * (num_courts + 1) + pad(4 * (num_courts + 1))
+        self.courts = [
+            self.buf[pos + start : pos + end].decode("utf-8")
+            for start, end in zip(offsets, offsets[1:])
+        ]
+        self.court_ids = {court.casefold(): i for i, court in enumerate(self.courts)}
+        pos += name_bytes + pad(name_bytes)
+        self.doc_ids = np.frombuffer(self.buf, "<i8", num_docs, pos)
+        pos += 8 * num_docs
+        self.dates = np.frombuffer(self.buf, "<i4", num_docs, pos)
+        pos += 4 * num_docs + pad(4 * num_docs)
+        self.priors = np.frombuffer(self.buf, "<f4", num_docs, pos)
+        pos += 4 * num_docs + pad(4 * num_docs)
+        self.court_column = np.frombuffer(self.buf, "<u2", num_docs, pos)
+        pos += 2 * num_docs + pad(2 * num_docs)
+        self.tiers = np.frombuffer(self.buf, np.uint8, num_docs, pos)
+        pos += num_docs + pad(num_docs)
+        self.zone_lengths = np.frombuffer(
+            self.buf, "<f4", num_docs * len(ZONES), pos
+        ).reshape(num_docs, len(ZONES))
+        pos += 4 * num_docs * len(ZONES) + pad(4 * num_docs * len(ZONES))
+        self.sorted_dates = np.frombuffer(self.buf, "<i4", num_docs, pos)
+        pos += 4 * num_docs + pad(4 * num_docs)
+        self.date_order = np.frombuffer(self.buf, "<u4", num_docs, pos)
+
+    def get_records(self, mask: np.ndarray):
+        """
+        Yields:
+            (int, str, int, tuple(float)): (docID, court, date, zone lengths)
+                                           of the docs selected by mask, as
+                                           write_doc_metadata takes them
+        """
+        for doc_id, court_id, date, zone_lengths in zip(
+            self.doc_ids[mask].tolist(),
+            self.court_column[mask].tolist(),
+            self.dates[mask].tolist(),
+            self.zone_lengths[mask].tolist(),
+        ):
+            yield doc_id, self.courts[court_id], date, tuple(zone_lengths)
+
+    def get_zone_lengths(self, doc_id: int) -> dict[str, float]:
+        """
+        Returns:
+            dict(str, float): Length of each zone of the doc, {} if it is
+                              not in the segment
+        """
+        i = int(np.searchsorted(self.doc_ids, doc_id))
+        if i == len(self.doc_ids) or self.doc_ids[i] != doc_id:
+            return {}
+        return dict(zip(ZONES, self.zone_lengths[i].tolist()))
+
+    def get_filter_mask(self, doc_filter: DocFilter) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: bool mask over the docs, True for those passing doc_filter
+        """
+        mask = np.ones(len(self.doc_ids), dtype=bool)
+        if doc_filter.courts is not None:
+            court_ids = [
+                self.court_ids[court.casefold()]
+                for court in doc_filter.courts
+                if court.casefold() in self.court_ids
+            ]
+            mask &= np.isin(self.court_column, court_ids)
+        if doc_filter.min_tier is not None:
+            mask &= self.tiers >= doc_filter.min_tier
+        if doc_filter.date_from is not None or doc_filter.date_to is not None:
+            mask &= self.get_date_mask(doc_filter.date_from, doc_filter.date_to)
+        return mask
+
+    def get_date_mask(self, date_from: int = None, date_to: int = None) -> np.ndarray:
+        """
+        Args:
+            date_from (int): First YYYYMMDD date of the range, None for any
+            date_to (int): Last YYYYMMDD date of the range, None for any
+        Returns:
+            np.ndarray: bool mask over the docs, True for those of a known
+                        date within the range
+        """
+        # unknown dates are 0 and sort first
+        start = int(np.searchsorted(self.sorted_dates, max(date_from or 1, 1)))
+        end = len(self.sorted_dates)
+        if date_to is not None:
+            end = int(np.searchsorted(self.sorted_dates, date_to, "right"))
+        mask = np.zeros(len(self.doc_ids), dtype=bool)
+        mask[self.date_order[start:end]] = True
+        return mask
+
+
+def open_doc_metadata(dictionary_file):
+    # indexes built before the metadata existed can neither filter nor boost
+    metadata_file = get_metadata_path(dictionary_file)
+    if not os.path.exists(metadata_file):
+        return None
+    return DocMetadata(metadata_file)
@@ -0,0 +1,140 @@
+from functools import lru_cache
+
+# legal text repeats a small vocabulary, so a bounded cache of stems and
+# lemmas answers almost every token without touching nltk
+WORD_CACHE_SIZE = 1 << 17
+TAG_CACHE_SIZE = 1 << 12
+
+# nltk data used by the pipeline, as (nltk.data path, package to download)
+NLTK_DATA = {
+    "wordnet": ("corpora/wordnet", "wordnet"),
+    "tagger": ("taggers/averaged_perceptron_tagger", "averaged_perceptron_tagger"),
+    "stopwords": ("corpora/stopwords", "stopwords"),
+}
+
+# nltk takes longer to import than a query takes to answer, so it and its
+# models are only loaded on first use, and only downloaded if missing
+stemmer = None
+lemmatizer = None
+stop_words = None
+checked_data = set()
+
+
+def require_nltk_data(name):
+    if name in checked_data:
+        return
+    import nltk
+
+    path, package = NLTK_DATA[name]
+    try:
+        nltk.data.find(path)
+    except LookupError:
+        nltk.download(package)
+    checked_data.add(name)
+
+
+def word_tokenize(text: str) -> list[str]:
+    import nltk
+
+    return nltk.word_tokenize(text)
+
+
+def get_wordnet():
+    require_nltk_data("wordnet")
+    from nltk.corpus import wordnet
+
+    return wordnet
+
+
+def get_stop_words() -> frozenset[str]:
+    """
+    Returns:
+        frozenset(str): The english stopwords, loaded once per process
+    """
+    global stop_words
+    if stop_words is None:
+        require_nltk_data("stopwords")
+        from nltk.corpus import stopwords
+
+        stop_words = frozenset(stopwords.words("english"))
+    return stop_words
+
+
+def stem_word(word: str) -> str:
+    # the porter stemmer lowercases first, so lowercasing the key is free
+    return cached_stem(word.lower())
+
+
+@lru_cache(maxsize=WORD_CACHE_SIZE)
+def cached_stem(word: str) -> str:
+    global stemmer
+    if stemmer is None:
+        from nltk.stem import PorterStemmer
+
+        stemmer = PorterStemmer()
+    return stemmer.stem(word)
+
+
+@lru_cache(maxsize=WORD_CACHE_SIZE)
+def lemmatize_word(word: str, pos: str) -> str:
+    global lemmatizer
+    if lemmatizer is None:
+        require_nltk_data("wordnet")
+        from nltk.stem import WordNetLemmatizer
+
+        lemmatizer = WordNetLemmatizer()
+    return lemmatizer.lemmatize(word, pos)
+
+
+@lru_cache(maxsize=TAG_CACHE_SIZE)
+def pos_tag(tokens: tuple[str, ...]) -> tuple[tuple[str, str], ...]:
+    """
+    Args:
+        tokens (tuple(str)): The tokens of one query
+    Returns:
+        tuple((str, str)): (token, tag) pairs, cached per token sequence
+    """
+    require_nltk_data("tagger")
+    import nltk
+
+    return tuple(nltk.pos_tag(list(tokens)))
+
+
+CACHES = {"stem": cached_stem, "lemma": lemmatize_word, "pos_tag": pos_tag}
+
+
+def register_cache(name, cache):
+    # lru caches of other modules, reported along with the ones above
+    CACHES[name] = cache
+
+
+def get_cache_info() -> dict[str, tuple[int, int]]:
+    """
+    Returns:
+        dict(str, (int, int)): (hits, misses) of each cache in this process
+    """
+    return {name: cache.cache_info()[:2] for name, cache in CACHES.items()}
+
+
+def get_cache_stats(info: dict[str, tuple[int, int]] = None) -> dict[str, dict]:
+    """
+    Args:
+        info (dict): (hits, misses) per cache, defaults to this process's caches
+    Returns:
+        dict(str, dict): hits, misses and hit rate of each cache
+    """
+    info = info or get_cache_info()
+    stats = {}
+    for name, (hits, misses) in info.items():
+        total = hits + misses
+        hit_rate = hits / total if total else 0
+        stats[name] = {"hits": hits, "misses": misses, "hit_rate": hit_rate}
+    return stats
+
+
+def format_cache_stats(info: dict[str, tuple[int, int]] = None) -> str:
+    return ", ".join(
+        f"{name} cache {stats['hit_rate']:.1%} hits"
+        for name, stats in get_cache_stats(info).items()
+        if stats["hits"] + stats["misses"] > 0
+    )
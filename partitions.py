@@ -0,0 +1,207 @@
+import heapq
+import itertools
+import multiprocessing
+import signal
+import traceback
+
+import instrument
+from feedback import FEEDBACK_DOCS, get_doc_vector, get_feedback_weights
+from retrieve import (
+    compute_idf,
+    get_collection_size,
+    get_term_doc_count,
+    refresh_index,
+    set_dictionary,
+    set_posting_file,
+)
+from search import Searcher, get_candidates, get_query_weights, score_docs
+from segments import get_segment_files, in_doc_range, load_partitions
+
+# A partitioned index (index.py -n) is searched scatter-gather. Each
+# partition is opened by a worker process of its own, which maps only that
+# partition's files and keeps it in the module globals of retrieve.py as a
+# single index would. The searcher process parses and expands the query,
+# sums the df of its terms over the partitions into global idf, and sends
+# the same query weights to every worker, so each partition scores its docs
+# exactly as the whole index would. Every worker returns its own top k
+# sorted by (-score, docID), and these are heap merged into the global top k.
+
+
+# return (live docs of the partition, [df of each term])
+def get_term_stats(terms):
+    return get_collection_size(), [get_term_doc_count(term) for term in terms]
+
+
+# return [(docID, score), ...] of the partition, most relevant first
+def rank_partition(split_clauses, query_weights, engine, k, doc_filter, prior):
+    candidates = get_candidates(split_clauses, doc_filter)
+    if candidates is not None and len(candidates) == 0:
+        return []
+    return score_docs(query_weights, engine, k, candidates, prior)
+
+
+# return map{ doc: vector } of the feedback docs in the partition
+def get_doc_vectors(docs):
+    return {doc: get_doc_vector(doc) for doc in docs}
+
+
+WORKER_METHODS = {
+    "refresh": refresh_index,
+    "stats": get_term_stats,
+    "rank": rank_partition,
+    "vectors": get_doc_vectors,
+}
+
+
+def serve_partition(conn, dictionary_file, postings_file):
+    """
+    Worker loop: open one partition, then answer (method, args) requests
+    from WORKER_METHODS with (True, result), or (False, traceback) if the
+    method raised, until None arrives or the searcher is gone.
+    """
+    # Ctrl-C reaches the whole process group, leave it to the searcher
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    set_dictionary(dictionary_file)
+    set_posting_file(postings_file)
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        method, args = request
+        try:
+            response = (True, WORKER_METHODS[method](*args))
+        except Exception:
+            response = (False, traceback.format_exc())
+        conn.send(response)
+    conn.close()
+
+
+class Partition:
+    """
+    The worker process of one partition and the pipe to it.
+    """
+
+    def __init__(self, dictionary_file, postings_file, doc_range):
+        self.doc_range = doc_range
+        self.conn, worker_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=serve_partition,
+            args=(worker_conn, dictionary_file, postings_file),
+            daemon=True,
+        )
+        self.process.start()
+        worker_conn.close()
+
+    def send(self, method, *args):
+        self.conn.send((method, args))
+
+    def receive(self):
+        ok, response = self.conn.recv()
+        if not ok:
+            raise RuntimeError(f"partition worker failed:\n{response}")
+        return response
+
+    def close(self):
+        self.conn.send(None)
+        self.conn.close()
+        self.process.join()
+
+
+class PartitionedSearcher(Searcher):
+    """
+    A Searcher of a partitioned index, keeping one worker process per
+    partition.
+    """
+
+    def open_index(self, dictionary_file, postings_file):
+        self.partitions = [
+            Partition(*get_segment_files(dictionary_file, entry), entry["doc_range"])
+            for entry in load_partitions(dictionary_file)
+        ]
+
+    def close(self):
+        for partition in self.partitions:
+            partition.close()
+        self.partitions = []
+
+    def scatter(self, method, *args, partitions=None) -> list:
+        """
+        Returns:
+            list: The result of method from each of partitions (all of them
+                  by default), sent to all before any is awaited so the
+                  workers run in parallel
+        """
+        partitions = self.partitions if partitions is None else partitions
+        for partition in partitions:
+            partition.send(method, *args)
+        return [partition.receive() for partition in partitions]
+
+    def refresh_index(self) -> bool:
+        return any(self.scatter("refresh"))
+
+    # return map{ term: idf } over the whole collection
+    def get_global_idfs(self, terms):
+        collection_size = 0
+        doc_counts = [0] * len(terms)
+        for size, counts in self.scatter("stats", terms):
+            collection_size += size
+            doc_counts = [total + count for total, count in zip(doc_counts, counts)]
+        return {
+            term: compute_idf(collection_size, doc_count)
+            for term, doc_count in zip(terms, doc_counts)
+        }
+
+    def rank_partitions(self, split_clauses, query_weights, doc_filter) -> list[int]:
+        ranked = self.scatter(
+            "rank",
+            split_clauses,
+            query_weights,
+            self.engine,
+            self.k,
+            doc_filter,
+            self.prior,
+        )
+        # each list holds the top k of its partition, so the top k of all
+        # docs are among them
+        merged = heapq.merge(*ranked, key=lambda x: (-x[1], x[0]))
+        return [int(doc) for doc, score in itertools.islice(merged, self.k)]
+
+    # return map{ doc: vector }, asking only the partition of each doc
+    def get_doc_vectors(self, docs):
+        vectors = {}
+        for partition in self.partitions:
+            partition_docs = [
+                doc for doc in docs if in_doc_range(doc, partition.doc_range)
+            ]
+            if partition_docs:
+                vectors.update(
+                    *self.scatter("vectors", partition_docs, partitions=[partition])
+                )
+        return vectors
+
+    def rank_clauses(
+        self, split_clauses, relevant_docs=None, doc_filter=None
+    ) -> list[int]:
+        query_list = self.get_query_terms(split_clauses)
+        with instrument.span("weights"):
+            idfs = self.get_global_idfs(query_list)
+            query_weights = get_query_weights(query_list, idfs.__getitem__)
+        # candidates are found by every worker on its own docs
+        with instrument.span("score"):
+            results = self.rank_partitions(split_clauses, query_weights, doc_filter)
+        if not self.feedback:
+            return results
+
+        feedback_docs = list(relevant_docs or []) + results[:FEEDBACK_DOCS]
+        if not feedback_docs:
+            return results
+        with instrument.span("feedback"):
+            vectors = self.get_doc_vectors(feedback_docs)
+            query_weights = get_feedback_weights(
+                query_weights, feedback_docs, doc_vector=lambda doc: vectors[doc]
+            )
+        with instrument.span("score"):
+            return self.rank_partitions(split_clauses, query_weights, doc_filter)
@@ -0,0 +1,99 @@
+import numpy as np
+
+from boolean import get_required_words
+from postings import EMPTY_DOCS, in_sorted
+from retrieve import get_postings_docs, get_segments
+
+# zones with positions, dates are single tokens
+PHRASE_ZONES = ("title", "content", "court")
+
+
+def intersect_docs(readers) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: docIDs in every posting list, found smallest list first,
+                    decoding only the blocks of longer lists that can match
+    """
+    readers = sorted(readers, key=lambda reader: reader.entry.df)
+    candidates = readers[0].decode()[0]
+    for reader in readers[1:]:
+        if len(candidates) == 0:
+            break
+        doc_ids, _ = reader.decode_blocks(reader.blocks_of(candidates))
+        candidates = candidates[in_sorted(candidates, doc_ids)]
+    return candidates
+
+
+def match_positions(candidates: np.ndarray, readers) -> np.ndarray:
+    """
+    Only the position blocks of the candidates are decoded, and the phrase
+    is checked for all of them at once: each (candidate, position - i) of
+    word i is a possible start of the phrase, which is there if every word
+    has that start.
+    Args:
+        candidates (np.ndarray): docIDs holding every word of the phrase
+        readers (list): Posting lists of the phrase words, in phrase order
+    Returns:
+        np.ndarray: The candidates where the words occur at adjacent positions
+    """
+    rows = np.arange(len(candidates))
+    word_starts = []
+    for i, reader in enumerate(readers):
+        doc_ids, bounds, positions = reader.decode_positions(
+            reader.blocks_of(candidates)
+        )
+        docs = np.searchsorted(doc_ids, candidates)
+        counts = bounds[docs + 1] - bounds[docs]
+        # positions of every candidate back to back
+        offsets = np.repeat(bounds[docs] - np.cumsum(counts) + counts, counts)
+        starts = positions[np.arange(len(offsets)) + offsets] - i
+        word_starts.append((np.repeat(rows, counts), starts))
+
+    # one key per (candidate, start), wide enough for any start
+    width = max(int(starts.max(initial=0)) for _, starts in word_starts) + 1
+    matches = None
+    for doc_rows, starts in word_starts:
+        keys = np.unique(doc_rows[starts >= 0] * width + starts[starts >= 0])
+        if matches is None:
+            matches = keys
+        else:
+            matches = np.intersect1d(matches, keys, assume_unique=True)
+        if len(matches) == 0:
+            break
+    return candidates[np.unique(matches // width)]
+
+
+def get_phrase_docs(words: list[str]) -> np.ndarray:
+    """
+    Args:
+        words (list(str)): The stemmed words of a quoted clause
+    Returns:
+        np.ndarray: Sorted docIDs containing the phrase within one zone, or
+                    None if the index has no positions to check it with
+    """
+    segments = get_segments()
+    if not any(segment.has_positions for segment in segments):
+        return None
+
+    required = get_required_words(words)
+    words = [word for word in words if word in required]
+    if not words:
+        return None
+    if len(words) == 1:
+        return np.array(sorted(get_postings_docs(words[0])), dtype=np.int64)
+
+    matches = []
+    for segment in segments:
+        for zone in PHRASE_ZONES:
+            readers = [segment.get_posting_list((word, zone)) for word in words]
+            if any(reader is None for reader in readers):
+                continue
+            candidates = intersect_docs(readers)
+            # lists merged from an index without positions only match the words
+            if len(candidates) > 0 and all(r.has_positions for r in readers):
+                candidates = match_positions(candidates, readers)
+            matches.append(candidates)
+
+    if not matches:
+        return EMPTY_DOCS
+    return np.unique(np.concatenate(matches))
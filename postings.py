@@ -0,0 +1,348 @@
+import struct
+from typing import NamedTuple
+
+import numpy as np
+
+# Postings file layout (all integers little-endian):
+#   file header: MAGIC, u16 version
+#   per (term, zone) list, starting at PostingEntry.offset:
+#     u32 doc count, u32 block count
+#     u32[blocks]      last docID of each block (skip pointers)
+#     f32[blocks]      max weight in each block (score upper bounds)
+#     u32[blocks + 1]  byte offset of each block in the docID stream
+#     docID stream     varint gaps, each block's first gap taken from the
+#                      previous block's last docID
+#     f32[docs]        cosine normalized weights, in docID order
+#   optional positions of a (term, zone) list, at PostingEntry.pos_offset,
+#   in blocks of the same BLOCK_SIZE docs as the list:
+#     u32[blocks + 1]  byte offset of each block in the count stream
+#     u32[blocks + 1]  byte offset of each block in the gap stream
+#     count stream     varint count of positions of each doc, in docID order
+#     gap stream       varint position gaps, each doc's first gap taken from 0
+#   so the positions of a few docs are decoded from their blocks alone
+MAGIC = b"HW4P"
+VERSION = 3
+BLOCK_SIZE = 128
+
+FILE_HEADER = struct.Struct("<4sH")
+LIST_HEADER = struct.Struct("<II")
+
+EMPTY_DOCS = np.empty(0, dtype=np.int64)
+EMPTY_WEIGHTS = np.empty(0, dtype=np.float32)
+
+# postings read by this process: lists opened and bytes of list headers,
+# skip tables, docID streams, weights and positions decoded
+read_counters = {"lists": 0, "bytes": 0}
+
+
+def get_read_counters() -> dict[str, int]:
+    return dict(read_counters)
+
+
+def reset_read_counters():
+    for name in read_counters:
+        read_counters[name] = 0
+
+
+class PostingEntry(NamedTuple):
+    offset: int
+    length: int
+    max_weight: float
+    df: int
+    pos_offset: int = 0
+    pos_length: int = 0
+
+
+def write_file_header(f):
+    f.write(FILE_HEADER.pack(MAGIC, VERSION))
+    return FILE_HEADER.size
+
+
+def check_file_header(buf):
+    """
+    Args:
+        buf (buffer): The start of a postings file
+    Raises:
+        ValueError: If the file is not a postings file of the current version
+    """
+    if len(buf) < FILE_HEADER.size:
+        raise ValueError("postings file is truncated")
+    magic, version = FILE_HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError("not a binary postings file, rebuild the index")
+    if version != VERSION:
+        raise ValueError(
+            f"postings format v{version} is not supported (expected v{VERSION}), "
+            "rebuild the index"
+        )
+
+
+def encode_varints(values) -> bytearray:
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return out
+
+
+def decode_varints(buf: np.ndarray) -> np.ndarray:
+    """
+    Decode a whole stream of varints at once.
+    Args:
+        buf (np.ndarray): uint8 array holding complete varints
+    Returns:
+        np.ndarray: int64 array of the decoded values
+    """
+    if len(buf) == 0:
+        return EMPTY_DOCS
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # position of every byte within its own varint gives its shift
+    owner = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = (np.arange(len(buf)) - starts[owner]) * 7
+    parts = (buf & 0x7F).astype(np.int64) << shifts
+    return np.add.reduceat(parts, starts)
+
+
+def encode_posting_list(doc_ids: list[int], weights: list[float]) -> bytes:
+    """
+    Args:
+        doc_ids (list(int)): Sorted docIDs
+        weights (list(float)): Weight of the term in each doc
+    Returns:
+        bytes: The encoded posting list
+    """
+    num_docs = len(doc_ids)
+    last_docs = []
+    block_maxes = []
+    block_offsets = [0]
+    stream = bytearray()
+    prev = 0
+    for start in range(0, num_docs, BLOCK_SIZE):
+        block = doc_ids[start : start + BLOCK_SIZE]
+        gaps = [block[0] - prev] + [b - a for a, b in zip(block, block[1:])]
+        stream += encode_varints(gaps)
+        prev = block[-1]
+        last_docs.append(prev)
+        block_maxes.append(max(weights[start : start + BLOCK_SIZE]))
+        block_offsets.append(len(stream))
+
+    return b"".join(
+        [
+            LIST_HEADER.pack(num_docs, len(last_docs)),
+            np.asarray(last_docs, dtype="<u4").tobytes(),
+            np.asarray(block_maxes, dtype="<f4").tobytes(),
+            np.asarray(block_offsets, dtype="<u4").tobytes(),
+            bytes(stream),
+            np.asarray(weights, dtype="<f4").tobytes(),
+        ]
+    )
+
+
+def in_sorted(values: np.ndarray, sorted_values: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: bool mask of the values found in sorted_values
+    """
+    if len(sorted_values) == 0:
+        return np.zeros(len(values), dtype=bool)
+    pos = np.searchsorted(sorted_values, values)
+    pos[pos == len(sorted_values)] = 0
+    return sorted_values[pos] == values
+
+
+def encode_positions(positions: list[list[int]]) -> bytes:
+    """
+    Args:
+        positions (list(list(int))): Sorted positions of the term in each doc
+    Returns:
+        bytes: The encoded positions section
+    """
+    counts = bytearray()
+    gaps = bytearray()
+    count_offsets = [0]
+    gap_offsets = [0]
+    for start in range(0, len(positions), BLOCK_SIZE):
+        block = positions[start : start + BLOCK_SIZE]
+        counts += encode_varints(len(doc_positions) for doc_positions in block)
+        gaps += encode_varints(
+            b - a
+            for doc_positions in block
+            for a, b in zip([0] + doc_positions, doc_positions)
+        )
+        count_offsets.append(len(counts))
+        gap_offsets.append(len(gaps))
+    return (
+        np.asarray(count_offsets, dtype="<u4").tobytes()
+        + np.asarray(gap_offsets, dtype="<u4").tobytes()
+        + bytes(counts)
+        + bytes(gaps)
+    )
+
+
+def decode_positions(
+    buf, entry: PostingEntry, blocks=None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Args:
+        buf (buffer): The postings file
+        entry (PostingEntry): A dictionary entry with positions
+        blocks (iterable(int)): Sorted indices of the blocks to decode, None
+                                for all of them
+    Returns:
+        (np.ndarray, np.ndarray): bounds and positions, the positions of the
+                                  i-th doc of those blocks are
+                                  positions[bounds[i] : bounds[i + 1]]
+    """
+    num_blocks = -(-entry.df // BLOCK_SIZE)
+    pos = entry.pos_offset
+    count_offsets = np.frombuffer(buf, "<u4", num_blocks + 1, pos)
+    pos += 4 * (num_blocks + 1)
+    gap_offsets = np.frombuffer(buf, "<u4", num_blocks + 1, pos)
+    pos += 4 * (num_blocks + 1)
+    counts_pos = pos
+    gaps_pos = counts_pos + int(count_offsets[-1])
+    read_counters["bytes"] += 8 * (num_blocks + 1)
+
+    if blocks is None:
+        blocks = np.arange(num_blocks)
+    counts = decode_varints(read_blocks(buf, counts_pos, count_offsets, blocks))
+    gaps = decode_varints(read_blocks(buf, gaps_pos, gap_offsets, blocks))
+    bounds = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=bounds[1:])
+
+    # cumsum over all docs, then restart each doc's positions from 0
+    positions = np.cumsum(gaps)
+    starts = bounds[:-1]
+    base = np.where(starts > 0, positions[np.maximum(starts - 1, 0)], 0)
+    return bounds, positions - np.repeat(base, counts)
+
+
+def read_blocks(buf, stream_pos: int, offsets: np.ndarray, blocks) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: uint8 bytes of the given sorted blocks of a stream of
+                    varints, back to back
+    """
+    blocks = np.asarray(blocks, dtype=np.int64)
+    if len(blocks) == 0:
+        return np.empty(0, dtype=np.uint8)
+    # consecutive blocks are contiguous in the stream, read each run at once
+    run_starts = np.flatnonzero(np.diff(blocks, prepend=-2) != 1)
+    run_ends = np.append(run_starts[1:], len(blocks)) - 1
+    runs = []
+    for first, last in zip(blocks[run_starts].tolist(), blocks[run_ends].tolist()):
+        start = int(offsets[first])
+        end = int(offsets[last + 1])
+        runs.append(np.frombuffer(buf, np.uint8, end - start, stream_pos + start))
+        read_counters["bytes"] += end - start
+    return runs[0] if len(runs) == 1 else np.concatenate(runs)
+
+
+class PostingList:
+    """
+    A posting list read in place from the postings buffer. Only the header
+    and skip table are parsed up front, blocks are decoded on demand.
+    """
+
+    def __init__(self, buf, offset: int):
+        self.buf = buf
+        self.num_docs, self.num_blocks = LIST_HEADER.unpack_from(buf, offset)
+        pos = offset + LIST_HEADER.size
+        self.last_docs = np.frombuffer(buf, "<u4", self.num_blocks, pos)
+        pos += 4 * self.num_blocks
+        self.block_maxes = np.frombuffer(buf, "<f4", self.num_blocks, pos)
+        pos += 4 * self.num_blocks
+        self.block_offsets = np.frombuffer(buf, "<u4", self.num_blocks + 1, pos)
+        self.stream_pos = pos + 4 * (self.num_blocks + 1)
+        self.weights_pos = self.stream_pos + int(self.block_offsets[-1])
+        read_counters["lists"] += 1
+        read_counters["bytes"] += self.stream_pos - offset
+
+    def decode(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            (np.ndarray, np.ndarray): All docIDs (int64) and weights (float32)
+        """
+        if self.num_docs == 0:
+            return EMPTY_DOCS, EMPTY_WEIGHTS
+
+        stream = np.frombuffer(
+            self.buf, np.uint8, int(self.block_offsets[-1]), self.stream_pos
+        )
+        doc_ids = np.cumsum(decode_varints(stream))
+        weights = np.frombuffer(self.buf, "<f4", self.num_docs, self.weights_pos)
+        read_counters["bytes"] += len(stream) + weights.nbytes
+        return doc_ids, weights.astype(np.float32)
+
+    def decode_blocks(self, blocks) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Args:
+            blocks (iterable(int)): Sorted indices of the blocks to decode
+        Returns:
+            (np.ndarray, np.ndarray): docIDs and weights of those blocks only
+        """
+        blocks = np.asarray(blocks, dtype=np.int64)
+        if len(blocks) == 0:
+            return EMPTY_DOCS, EMPTY_WEIGHTS
+        if len(blocks) == self.num_blocks:
+            return PostingList.decode(self)
+
+        # consecutive blocks are contiguous in the stream, decode each run at once
+        run_starts = np.flatnonzero(np.diff(blocks, prepend=-2) != 1)
+        run_ends = np.append(run_starts[1:], len(blocks)) - 1
+        all_docs = []
+        all_weights = []
+        for first, last in zip(blocks[run_starts].tolist(), blocks[run_ends].tolist()):
+            start = int(self.block_offsets[first])
+            end = int(self.block_offsets[last + 1])
+            stream = np.frombuffer(
+                self.buf, np.uint8, end - start, self.stream_pos + start
+            )
+            gaps = decode_varints(stream)
+            base = int(self.last_docs[first - 1]) if first > 0 else 0
+            all_docs.append(base + np.cumsum(gaps))
+            pos = self.weights_pos + 4 * BLOCK_SIZE * first
+            all_weights.append(np.frombuffer(self.buf, "<f4", len(gaps), pos))
+            read_counters["bytes"] += end - start + 4 * len(gaps)
+
+        return np.concatenate(all_docs), np.concatenate(all_weights).astype(np.float32)
+
+    def decode_docs(self, candidates: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Use the skip pointers to decode only the blocks that could hold the
+        candidates, then keep just the postings of the candidates.
+        Args:
+            candidates (np.ndarray): Sorted docIDs
+        Returns:
+            (np.ndarray, np.ndarray): docIDs and weights of candidates in the list
+        """
+        doc_ids, weights = self.decode_blocks(self.blocks_of(candidates))
+        keep = in_sorted(doc_ids, candidates)
+        return doc_ids[keep], weights[keep]
+
+    def block_bounds(self, doc_ids: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            doc_ids (np.ndarray): Sorted docIDs
+        Returns:
+            np.ndarray: For each doc, the max weight of the block that could
+                        contain it, 0 past the end of the list
+        """
+        blocks = np.searchsorted(self.last_docs, doc_ids)
+        inside = blocks < self.num_blocks
+        bounds = np.zeros(len(doc_ids), dtype=np.float32)
+        bounds[inside] = self.block_maxes[blocks[inside]]
+        return bounds
+
+    def blocks_of(self, doc_ids: np.ndarray) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Sorted indices of the blocks that could contain doc_ids
+        """
+        blocks = np.unique(np.searchsorted(self.last_docs, doc_ids))
+        return blocks[blocks < self.num_blocks]
@@ -1,34 +1,34 @@
-from nltk.corpus import wordnet as wn
 from collections import defaultdict
 from constants import *
-from nltk.corpus import stopwords
+from normalize import (
+    get_stop_words,
+    lemmatize_word,
+    pos_tag,
+    stem_word,
+    word_tokenize,
+)
 
-import nltk
 import regex
 
-nltk.download("wordnet")
-nltk.download("averaged_perceptron_tagger")
-nltk.download("stopwords")
-
-lemmatizer = nltk.stem.WordNetLemmatizer()
-stemmer = nltk.stem.PorterStemmer()
-tag_map = defaultdict(lambda: wn.NOUN)
-tag_map["J"] = wn.ADJ
-tag_map["V"] = wn.VERB
-tag_map["R"] = wn.ADV
+# wordnet.NOUN, ADJ, VERB and ADV, spelt out so importing this module does
+# not load WordNet
+tag_map = defaultdict(lambda: "n")
+tag_map["J"] = "a"
+tag_map["V"] = "v"
+tag_map["R"] = "r"
 
 
 def lemmatize(token_list: list[str], include_stem: bool = False) -> list[str]:
     return [
-        lemmatizer.lemmatize(token.lower(), tag_map[tag[0]])
+        lemmatize_word(token.lower(), tag_map[tag[0]])
         if not include_stem
-        else stemmer.stem(lemmatizer.lemmatize(token.lower(), tag_map[tag[0]]))
-        for token, tag in nltk.pos_tag(token_list)
+        else stem_word(lemmatize_word(token.lower(), tag_map[tag[0]]))
+        for token, tag in pos_tag(tuple(token_list))
     ]
 
 
 def stem(token_list: list[str]) -> list[str]:
-    return [stemmer.stem(token.lower()) for token in token_list]
+    return [stem_word(token) for token in token_list]
 
 
 def tokenize_str(
@@ -37,14 +37,13 @@ def tokenize_str(
     use_lemmatize: bool = True,
     use_stem: bool = True,
 ) -> list[str]:
-    word_list = nltk.tokenize.word_tokenize(raw_string)
+    word_list = word_tokenize(raw_string)
     cleaned_list = [clean_word(string) for string in word_list]
     token_list = " ".join(cleaned_list).split()
 
     if remove_stopwords:
-        token_list = [
-            token for token in token_list if token not in stopwords.words("english")
-        ]
+        stop_words = get_stop_words()
+        token_list = [token for token in token_list if token not in stop_words]
 
     if use_lemmatize:
         token_list = lemmatize(token_list, use_stem)
@@ -0,0 +1,93 @@
+import numpy as np
+
+# Static pruning (index.py --prune-*) drops postings as the index is
+# written, for a smaller index on latency-critical deployments:
+#   biwords      (term, zone) lists of two-word terms in fewer than
+#                min_biword_df docs are dropped whole; rare pairs are
+#                seldom queried but make up most of the dictionary
+#   epsilon      term-centric pruning after Carmel et al.: a posting is kept
+#                only if its weight is at least epsilon times the
+#                TOP_POSTINGS-th highest weight of its list. Within a list
+#                the idf, zone weight and query weight are the same for
+#                every doc, so these are the postings that can matter to
+#                the top results of a query on the term alone
+#   max postings each list keeps at most its max_postings heaviest postings
+# df, idf and the forward index are taken from the postings before pruning,
+# so scores of the postings kept are unchanged. The dictionary is flagged as
+# pruned, and merges carry df and the forward index over from the segments
+# merged rather than recounting the pruned postings.
+TOP_POSTINGS = 10
+
+
+class Pruning:
+    """
+    What to prune from each posting list, and how much was pruned.
+    """
+
+    def __init__(self, min_biword_df=0, epsilon=0.0, max_postings=None):
+        """
+        Args:
+            min_biword_df (int): Drop biword lists of fewer docs
+            epsilon (float): Drop postings below epsilon times the
+                             TOP_POSTINGS-th weight of their list, 0 for none
+            max_postings (int): Max postings per list, None for no cap
+        """
+        if not 0 <= epsilon <= 1:
+            raise ValueError("pruning epsilon must be within (0, 1], or 0 for none")
+        if max_postings is not None and max_postings < 1:
+            raise ValueError("pruning must keep at least 1 posting per list")
+        self.min_biword_df = min_biword_df
+        self.epsilon = epsilon
+        self.max_postings = max_postings
+        self.lists = self.lists_dropped = 0
+        self.postings = self.postings_kept = 0
+
+    def prune(self, term, doc_list, weights, positions):
+        """
+        Args:
+            term (str): The term of the list
+            doc_list (list(int)): Sorted docIDs
+            weights (list(float)): Their weights
+            positions (list(list(int))): Their positions, or None
+        Returns:
+            (list(int), list(float), list(list(int)) or None): The postings
+                kept, in docID order; empty if the list is dropped
+        """
+        self.lists += 1
+        self.postings += len(doc_list)
+        if " " in term and len(doc_list) < self.min_biword_df:
+            self.lists_dropped += 1
+            return [], [], None if positions is None else []
+
+        weights_arr = np.asarray(weights, dtype=np.float64)
+        keep = np.ones(len(weights_arr), dtype=bool)
+        if self.epsilon > 0 and len(weights_arr) > TOP_POSTINGS:
+            top_weight = np.partition(weights_arr, -TOP_POSTINGS)[-TOP_POSTINGS]
+            keep &= weights_arr >= self.epsilon * top_weight
+        if self.max_postings is not None and np.count_nonzero(keep) > self.max_postings:
+            # heaviest first, ties to the lowest docID
+            order = np.lexsort((np.arange(len(weights_arr)), -weights_arr))
+            capped = np.zeros(len(weights_arr), dtype=bool)
+            capped[order[np.flatnonzero(keep[order])[: self.max_postings]]] = True
+            keep = capped
+        # only biword lists are ever dropped whole, a word keeps its top doc
+        if not keep.any():
+            keep[np.argmax(weights_arr)] = True
+
+        self.postings_kept += int(np.count_nonzero(keep))
+        if keep.all():
+            return doc_list, weights, positions
+        rows = np.flatnonzero(keep).tolist()
+        return (
+            [doc_list[i] for i in rows],
+            [weights[i] for i in rows],
+            None if positions is None else [positions[i] for i in rows],
+        )
+
+    def format_stats(self) -> str:
+        share = self.postings_kept / self.postings if self.postings else 1.0
+        return (
+            f"pruning kept {self.postings_kept} of {self.postings} postings"
+            f" ({share:.1%}), {self.lists_dropped} of {self.lists} lists dropped"
+            " as rare biwords"
+        )
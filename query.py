@@ -1,7 +1,18 @@
 import re
 from constants import Keywords
+from metadata import DocFilter, parse_date
 from processing import tokenize_str
 
+# date:YYYY[-MM[-DD]] for one year, month or day, date:FROM..TO for a range,
+# either end of which may be left open. A filter that is not a valid date or
+# range stays in the query as text, like any other word.
+DATE_FILTER = re.compile(
+    r"\bdate:(\d{4}(?:-\d{1,2}){0,2})?(\.\.)?(\d{4}(?:-\d{1,2}){0,2})?(?!\S)",
+    re.IGNORECASE,
+)
+# court:"Full Court Name" or court:OneWord, repeated for any of several courts
+COURT_FILTER = re.compile(r'\bcourt:(?:"([^"]*)"|(\S+))', re.IGNORECASE)
+
 
 def categorise_and_stem_query(query: str) -> list[list[str]]:
     """
@@ -12,6 +23,74 @@ def categorise_and_stem_query(query: str) -> list[list[str]]:
         list(list(clause)): The list of subqueries resulting from splitting the query,
                                        where each subquery is a list of clauses
     """
+    query_clauses = split_query(query)
+    if query_clauses is None:
+        return
+
+    return [
+        [clause for clause, is_phrase in and_clause] for and_clause in query_clauses
+    ]
+
+
+def parse_filters(query: str) -> tuple[str, DocFilter]:
+    """
+    Take the date and court filters out of a query.
+    Args:
+        query(str): The raw query
+    Returns:
+        (str, DocFilter): The query without its filters and the docs they
+                          restrict it to, None if it has none
+    """
+    doc_filter = None
+    courts = []
+
+    def take_date(match):
+        nonlocal doc_filter
+        first, is_range, last = match.groups()
+        if first is None and last is None:
+            return match.group(0)
+        if not is_range:
+            # a single date covers the whole of its year, month or day
+            last = first
+        date_filter = DocFilter(
+            date_from=parse_date(first) if first else None,
+            date_to=parse_date(last, end=True) if last else None,
+        )
+        # 0 is not a date, and an empty range would drop every result
+        if 0 in date_filter or (
+            first and last and date_filter.date_from > date_filter.date_to
+        ):
+            return match.group(0)
+        doc_filter = date_filter.narrow(doc_filter)
+        return " "
+
+    def take_court(match):
+        courts.append((match.group(1) or match.group(2)).strip())
+        return " "
+
+    query = DATE_FILTER.sub(take_date, query)
+    query = COURT_FILTER.sub(take_court, query)
+    if courts:
+        doc_filter = DocFilter(courts=tuple(courts)).narrow(doc_filter)
+    if doc_filter is not None:
+        # drop the ANDs that joined a filter to the rest of the query
+        and_clauses = [
+            clause for clause in re.split(Keywords.AND, query) if clause.strip()
+        ]
+        query = f" {Keywords.AND.value} ".join(and_clauses)
+    return query, doc_filter
+
+
+def split_query(query: str) -> list[list[tuple[str, bool]]]:
+    """
+    Split a query into a list of of list clauses, keeping which were quoted.
+    Args:
+        query(str): The raw query
+    Returns:
+        list(list((clause, bool))): The subqueries of categorise_and_stem_query,
+                                    with each clause paired with whether it
+                                    was a quoted phrase
+    """
     if len(query) < 1:
         return
 
@@ -36,6 +115,8 @@ def categorise_and_stem_query(query: str) -> list[list[str]]:
                 is_last_keyword_quote = False
             else:
                 is_last_keyword_quote = True
+            # text before the first quote is free text, then quoted/free alternate
+            is_phrase = not is_last_keyword_quote
 
             # If there is no more keyword, we splice until the end of the string
             next_idx = (
@@ -45,7 +126,7 @@ def categorise_and_stem_query(query: str) -> list[list[str]]:
 
             if len(clause) > 0:
                 stemmed_clause = " ".join(tokenize_str(clause))
-                processed_and_clause.append(stemmed_clause)
+                processed_and_clause.append((stemmed_clause, is_phrase))
 
             # Update position
             curr_str_idx = (
@@ -73,3 +154,20 @@ def get_words_from_clauses(query_clauses: list[list[str]]) -> list[str]:
         )
         list_of_words.extend(and_clause_words)
     return list_of_words
+
+
+def get_phrases_from_clauses(
+    query_clauses: list[list[tuple[str, bool]]],
+) -> list[list[str]]:
+    """
+    Args:
+        query_clauses (list(list((str, bool)))): The clauses from split_query
+    Returns:
+        list(list(str)): The words of every quoted clause
+    """
+    return [
+        clause.split()
+        for and_clause in query_clauses
+        for clause, is_phrase in and_clause
+        if is_phrase and clause
+    ]
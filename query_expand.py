@@ -1,10 +1,75 @@
-import nltk
-from nltk.corpus import wordnet
-from nltk.corpus import WordNetCorpusReader
+import os
+import pickle
+from functools import lru_cache
 
 from constants import *
+from normalize import get_wordnet, pos_tag, register_cache, word_tokenize
 from processing import stem
 
+# expansions of the index vocabulary, precomputed by index.py -s and stored
+# next to the dictionary as a pickled map{ stemmed word: (expanded words) }
+SYNONYMS_SUFFIX = ".synonyms"
+EXPANSION_CACHE_SIZE = 1 << 14
+
+synonyms_path = ""
+synonym_table = None
+
+
+def set_synonym_file(dictionary_file):
+    """
+    Use the synonym table of the index, loaded on the first expansion.
+    """
+    global synonyms_path, synonym_table
+    synonyms_path = get_synonyms_path(dictionary_file)
+    synonym_table = None
+    expand_word.cache_clear()
+
+
+def get_synonyms_path(dictionary_file):
+    return dictionary_file + SYNONYMS_SUFFIX
+
+
+def get_synonym_table() -> dict[str, tuple[str, ...]]:
+    global synonym_table
+    if synonym_table is None:
+        synonym_table = {}
+        if synonyms_path and os.path.exists(synonyms_path):
+            with open(synonyms_path, "rb") as handle:
+                synonym_table = pickle.load(handle)
+    return synonym_table
+
+
+@lru_cache(maxsize=EXPANSION_CACHE_SIZE)
+def expand_word(word: str) -> tuple[str, ...]:
+    """
+    Args:
+        word (str): A stemmed query word
+    Returns:
+        tuple(str): The words of expand_clause(word), from the synonym table
+                    when it has the word, else from WordNet
+    """
+    table = get_synonym_table()
+    if word in table:
+        return table[word]
+    return tuple(expand_clause(word).split())
+
+
+register_cache("expand", expand_word)
+
+
+def write_synonym_table(terms, synonyms_file):
+    """
+    Precompute the expansion of every term so search never walks WordNet
+    for words in the index.
+    Args:
+        terms (iterable(str)): The stemmed words of the index vocabulary
+        synonyms_file (str): Where to write the table
+    """
+    table = {term: tuple(expand_clause(term).split()) for term in sorted(terms)}
+    with open(synonyms_file + ".tmp", "wb") as handle:
+        pickle.dump(table, handle)
+    os.replace(synonyms_file + ".tmp", synonyms_file)
+
 
 def expand_clause(
     expression: str, use_stemmer: bool = True, num_expand_synonyms: int = 3
@@ -18,7 +83,7 @@ def expand_clause(
         str: The expanded expression
     """
     # Tokenise and get all possible synonyms
-    token_list = nltk.word_tokenize(expression)
+    token_list = word_tokenize(expression)
     synsets_token = get_synsets(token_list)
 
     expanded_tokens = []
@@ -48,6 +113,7 @@ def pos_to_wordnet(tag: str) -> str:
     Returns:
         A wordnet tag corresponding to the provided tag
     """
+    wordnet = get_wordnet()
     if tag.startswith("J"):
         return wordnet.ADJ
     elif tag.startswith("N"):
@@ -66,7 +132,7 @@ def get_synsets(tokens: list[str]) -> list[list]:
     Returns
         list(list): List of list of synsets
     """
-    tagged = nltk.pos_tag(tokens)
+    tagged = pos_tag(tuple(tokens))
     synsets = []
 
     for token in tagged:
@@ -77,7 +143,9 @@ def get_synsets(tokens: list[str]) -> list[list]:
             continue
 
         # Format is to synset format, remove duplicate and add it to the list
-        synsets.append(remove_duplicate_synsets(wordnet.synsets(word, pos=wn_tag)))
+        synsets.append(
+            remove_duplicate_synsets(get_wordnet().synsets(word, pos=wn_tag))
+        )
 
     return synsets
 
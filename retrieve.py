@@ -1,112 +1,193 @@
-import pickle
+import contextlib
+import math
+
+import numpy as np
+
+from cache import LRUCache, get_arrays_size
+from postings import EMPTY_DOCS, EMPTY_WEIGHTS
+from segments import get_index_stamp, open_segments
 
 ZONES = {"title": 0.2, "court": 0.2, "date": 0.1, "content": 0.5}
 
-dictionary = {}
+# every segment of the index, see segments.py
+segments = []
+# sorted docIDs of all live docs, position in it is the doc's ordinal
+doc_ids = EMPTY_DOCS
+# static prior of each live doc, aligned with doc_ids, and the highest one
+doc_priors = np.empty(0, dtype=np.float32)
+max_prior = 0.0
 
+dictionary_path = ""
 postings_path = ""
 
+# decoded posting lists of every segment, bounded by their size in bytes
+POSTING_CACHE_BYTES = 64 * 1024 * 1024
+posting_cache = LRUCache(POSTING_CACHE_BYTES, get_arrays_size)
+# manifest of the index when the segments were opened, see refresh_index
+index_stamp = None
+
 
-# return map{ (term, zone): pointer }
 def set_dictionary(dictionary_file):
-    global dictionary
-    with open(dictionary_file, "rb") as handle:
-        dictionary = pickle.load(handle)
+    global dictionary_path, postings_path
+    dictionary_path = dictionary_file
+    # a new dictionary goes with its own postings, wait for set_posting_file
+    postings_path = ""
 
 
 def set_posting_file(postings_file):
     global postings_path
     postings_path = postings_file
+    load_segments()
 
 
-def term_in_dict(term):
-    for zone in ZONES:
-        if (term, zone) in dictionary:
-            return True
-    return False
+# open the segments once both files are known, each postings file is mapped
+# once and every posting list is decoded straight from it
+def load_segments():
+    global segments, doc_ids, doc_priors, max_prior, index_stamp
+    if dictionary_path and postings_path:
+        posting_cache.clear()
+        index_stamp = get_index_stamp(dictionary_path, postings_path)
+        segments = open_segments(dictionary_path, postings_path, posting_cache)
+        live = [~segment.deleted for segment in segments]
+        if not segments:
+            doc_ids = EMPTY_DOCS
+            doc_priors = np.empty(0, dtype=np.float32)
+            max_prior = 0.0
+            return
+        doc_ids = np.concatenate([s.doc_ids[m] for s, m in zip(segments, live)])
+        doc_priors = np.concatenate([s.get_priors()[m] for s, m in zip(segments, live)])
+        order = np.argsort(doc_ids, kind="stable")
+        doc_ids, doc_priors = doc_ids[order], doc_priors[order]
+        max_prior = float(doc_priors.max()) if len(doc_priors) else 0.0
 
 
-def get_term_doc_count(term):
-    docs = set()
-    for zone in ZONES:
-        if (term, zone) in dictionary:
-            postings = get_posting_list(term, zone)
-            postings = [x[0] for x in postings]
-            docs = docs.union(set(postings))
+# reopen the segments if the index files changed since they were opened,
+# return True if they did
+def refresh_index():
+    if not (dictionary_path and postings_path):
+        return False
+    if get_index_stamp(dictionary_path, postings_path) == index_stamp:
+        return False
+    load_segments()
+    return True
 
-    return len(docs)
 
+def get_posting_cache():
+    return posting_cache
 
-# get total number of documents
-def get_collection_size():
-    return dictionary[("*", "*")]
 
+@contextlib.contextmanager
+def share_postings():
+    """
+    Within the block, the blocks of posting lists decoded by one query are
+    kept and reused by the next ones, so a batch of queries decodes each
+    block of a (term, zone) list once. Whole lists go through the posting
+    cache as always.
+    """
+    opened = segments
+    for segment in opened:
+        segment.batch_blocks = {}
+    try:
+        yield
+    finally:
+        for segment in opened:
+            segment.batch_blocks = None
 
-# return arr[ [docID, tf-norm] ]
-def get_posting_list(term, zone):
-    key = (term, zone)
-    if key not in dictionary:
-        return []
 
-    posting_str = ""
-    with open(postings_path, "r") as f:
-        pointer = dictionary[key]
-        f.seek(pointer + 2)  # skip start '$ ' char
-        while True:
-            cur = f.read(1)
-            if cur == "$":
-                break
-            posting_str += cur
+# return arr[docID] of every live doc, sorted
+def get_doc_ids():
+    return doc_ids
 
-        posting_str.strip()
 
-    posting = []
-    cur = []
-    for count, x in enumerate(posting_str.split(" ")):
-        cur.append(x)
-        if count % 2 == 1:
-            posting.append(cur)
-            cur = []
+def get_segments():
+    return segments
 
-    return posting
 
+# return sorted arr[docID] of the live docs passing a metadata.DocFilter
+def get_filtered_docs(doc_filter):
+    docs = [segment.filter_docs(doc_filter) for segment in segments]
+    return np.sort(np.concatenate(docs)) if docs else EMPTY_DOCS
+
+
+# return arr[static prior] of the given sorted live docIDs
+def get_doc_priors(docs):
+    return doc_priors[np.searchsorted(doc_ids, docs)].astype(np.float64)
 
-# accumulate all term.title, term.content, ...
-# return [doc1, doc2, ...]
-def get_postings_docs(term):
-    docs = set()
-    for zone in ZONES:
-        if (term, zone) in dictionary:
-            postings = get_posting_list(term, zone)
-            postings = [x[0] for x in postings]
-            docs = docs.union(set(postings))
 
-    return docs
+# get highest static prior of any live doc, 0 if none
+def get_max_prior():
+    return max_prior
 
 
-# get term.zone tf val
-def get_doc_term_zone_tf(doc, term, zone):
-    key = (term, zone)
-    if key not in dictionary:
+# get number of docs with term in any zone, from the df in the dictionary
+def get_term_doc_count(term):
+    return sum(segment.get_doc_count(term, ZONES) for segment in segments)
+
+
+# get idf of term, 0 if no live doc has it
+def get_idf(term):
+    return compute_idf(get_collection_size(), get_term_doc_count(term))
+
+
+# the one idf formula, also applied by partitions.py to the summed df of
+# every partition
+def compute_idf(collection_size, doc_count):
+    if doc_count == 0:
         return 0
 
-    posting_str = ""
-    with open(postings_path, "r") as f:
-        pointer = dictionary[key]
-        f.seek(pointer + 2)  # skip start '$ ' char
-        while True:
-            cur = f.read(1)
-            if cur == "$":
-                break
-            posting_str += cur
-
-        posting_str.strip()
-
-    split_posting = posting_str.split(" ")
-    tf = 0
-    for count, x in enumerate(split_posting):
-        if x == doc:
-            tf = split_posting[count + 1]
-            break
-
-    return float(tf)
+    return math.log10(collection_size / doc_count)
+
+
+# get total number of documents, excluding deleted ones
+def get_collection_size():
+    return sum(segment.num_live_docs for segment in segments)
+
+
+# return (arr[docID], arr[tf-norm]) across all segments, restricted to the
+# sorted arr[docID] candidates if given
+def get_posting_list(term, zone, candidates=None):
+    readers = get_posting_readers(term, zone)
+    if candidates is None:
+        lists = [reader.decode() for reader in readers]
+    else:
+        lists = [reader.decode_docs(candidates) for reader in readers]
+    if not lists:
+        return EMPTY_DOCS, EMPTY_WEIGHTS
+    if len(lists) == 1:
+        return lists[0]
+
+    doc_ids = np.concatenate([doc_ids for doc_ids, _ in lists])
+    weights = np.concatenate([weights for _, weights in lists])
+    order = np.argsort(doc_ids, kind="stable")
+    return doc_ids[order], weights[order]
+
+
+# return [PostingList] of each segment holding term.zone, to decode only the
+# blocks needed; deleted docs are left out when decoding
+def get_posting_readers(term, zone):
+    readers = []
+    for segment in segments:
+        reader = segment.get_posting_list((term, zone))
+        if reader is not None:
+            readers.append(reader)
+    return readers
+
+
+# accumulate all term.title, term.content, ...
+# return {doc1, doc2, ...}
+def get_postings_docs(term):
+    docs = [get_posting_list(term, zone)[0] for zone in ZONES]
+    return set(np.unique(np.concatenate(docs)).tolist())
+
+
+# return [(term, zone, weight), ...] of the top words of each zone of a live
+# doc, from the forward index; [] if the doc has none
+def get_doc_words(doc):
+    for segment in segments:
+        if segment.forward is None or not segment.is_live_doc(doc):
+            continue
+        return [
+            (segment.dictionary.get_term(row).decode("utf-8"), zone, weight)
+            for row, zone, weight in segment.forward.get_doc_words(doc)
+        ]
+    return []
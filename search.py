@@ -1,79 +1,480 @@
 #!/usr/bin/python3
 import sys
 import getopt
+import json
 import math
+import os
+import socketserver
+import time
+
+import numpy as np
 
 from query import (
-    categorise_and_stem_query,
+    get_phrases_from_clauses,
     get_words_from_clauses,
+    parse_filters,
+    split_query,
 )
-from query_expand import expand_clause
+from query_expand import expand_word, set_synonym_file
+import impact_scoring
+import maxscore
+import vector_scoring
+from boolean import get_conjunctive_docs
+from feedback import FEEDBACK_DOCS, get_feedback_weights
+from phrase import get_phrase_docs
+import instrument
+from cache import LRUCache
+from constants import CourtTier
+from metadata import DocFilter, parse_date
+from normalize import format_cache_stats, register_cache
+from segments import get_partitions_path
 from retrieve import (
     set_dictionary,
     set_posting_file,
-    term_in_dict,
-    get_term_doc_count,
-    get_collection_size,
-    get_postings_docs,
-    get_doc_term_zone_tf,
+    get_posting_cache,
+    refresh_index,
+    get_idf,
+    get_doc_priors,
+    get_filtered_docs,
     get_posting_list,
     ZONES,
 )
 
 RELEVANCE_THRESHOLD = 0.6
 
+# results of recent queries, cleared whenever the index changes
+RESULT_CACHE_SIZE = 1024
+result_cache = LRUCache(RESULT_CACHE_SIZE)
+register_cache("results", result_cache)
+register_cache("postings", get_posting_cache())
+
+# "maxscore": document-at-a-time with top-k pruning (default)
+# "numpy": vectorized scatter-add into a dense per-doc score array
+# "impact": score-at-a-time over impact-ordered postings (index.py -I)
+# "exhaustive": score every matching document term-at-a-time
+ENGINES = ("maxscore", "numpy", "impact", "exhaustive")
+
 
 def usage():
     print(
         "usage: "
         + sys.argv[0]
         + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results"
+        + "\n       "
+        + sys.argv[0]
+        + " -d dictionary-file -p postings-file -q queries-dir|queries.jsonl -o output-dir|results.jsonl"
+        + "\n       "
+        + sys.argv[0]
+        + " -d dictionary-file -p postings-file --serve socket-path"
+        + "\n       options: -e maxscore|numpy|impact|exhaustive (scoring engine), -k max-results,"
+        + "\n                -f (refine with Rocchio feedback on relevant and top docs),"
+        + "\n                -b (boost by court tier and date),"
+        + "\n                --court name (repeatable), --min-tier important|most_important,"
+        + "\n                --from YYYY[-MM[-DD]], --to YYYY[-MM[-DD]] (filter the results),"
+        + "\n                --trace file|- (per-query JSON timings and counters),"
+        + "\n                --profile file (folded stacks of the slowest queries),"
+        + "\n                --profile-top n (how many of them, default 10)"
     )
 
 
-def run_search(
-    dictionary_file, postings_file, query_file, results_file, expand_query: bool = True
-):
-    set_dictionary(dictionary_file)
-    set_posting_file(postings_file)
+class Searcher:
+    """
+    Keeps the dictionary, the mapped postings file and the nltk resources
+    loaded, so one process can answer many queries with warm state.
+    """
+
+    def __init__(
+        self,
+        dictionary_file,
+        postings_file,
+        expand_query: bool = True,
+        engine: str = "maxscore",
+        k: int = None,
+        warm_up: bool = True,
+        feedback: bool = False,
+        doc_filter: DocFilter = None,
+        prior: bool = False,
+    ):
+        self.open_index(dictionary_file, postings_file)
+        set_synonym_file(dictionary_file)
+        self.expand_query = expand_query
+        self.engine = engine
+        self.k = k
+        self.feedback = feedback
+        self.doc_filter = doc_filter
+        self.prior = prior
+        result_cache.clear()
+        if warm_up:
+            # load the stopwords, tagger, lemmatizer and WordNet up front
+            self.search("warm up")
+
+    def search(self, query: str, relevant_docs: list[int] = None) -> list[int]:
+        """
+        Args:
+            query (str): The raw query
+            relevant_docs (list(int)): docIDs known to be relevant, used for
+                                       feedback
+        Returns:
+            list(int): The relevant docIDs, most relevant first
+        """
+        if not instrument.is_enabled():
+            return self.answer(query, relevant_docs)
+        with instrument.QueryTrace(query) as trace:
+            results = self.answer(query, relevant_docs)
+            trace.results = len(results)
+        return results
+
+    def answer(self, query: str, relevant_docs: list[int] = None) -> list[int]:
+        if not query.strip():
+            return []
+        if self.refresh_index():
+            result_cache.clear()
+
+        # same stemmed clauses, filters and options, same results
+        with instrument.span("parse"):
+            query, query_filter = parse_filters(query)
+            split_clauses = split_query(query.strip())
+        # a query of filters alone has nothing to rank by
+        if not split_clauses:
+            return []
+        doc_filter = self.doc_filter
+        if query_filter is not None:
+            doc_filter = query_filter.narrow(doc_filter)
+        key = (
+            tuple(tuple(and_clause) for and_clause in split_clauses),
+            tuple(relevant_docs or ()),
+            self.expand_query,
+            self.engine,
+            self.k,
+            self.feedback,
+            doc_filter,
+            self.prior,
+        )
+        results = result_cache.get(key)
+        if results is None:
+            results = tuple(self.rank_clauses(split_clauses, relevant_docs, doc_filter))
+            result_cache.put(key, results)
+        return list(results)
+
+    def rank_clauses(
+        self, split_clauses, relevant_docs=None, doc_filter=None
+    ) -> list[int]:
+        """
+        Args:
+            split_clauses (list(list((str, bool)))): The clauses from split_query
+            relevant_docs (list(int)): docIDs known to be relevant
+            doc_filter (DocFilter): Court and date restrictions of the query
+                                    and the searcher, if any
+        Returns:
+            list(int): The relevant docIDs, most relevant first
+        """
+        with instrument.span("candidates"):
+            candidates = get_candidates(split_clauses, doc_filter)
+        if candidates is not None and len(candidates) == 0:
+            return []
+        query_list = self.get_query_terms(split_clauses)
+        with instrument.span("weights"):
+            query_weights = get_query_weights(query_list)
+        with instrument.span("score"):
+            results = rank_docs(
+                query_weights, self.engine, self.k, candidates, self.prior
+            )
+        if not self.feedback:
+            return results
+
+        # second pass with the query moved towards the relevant docs
+        feedback_docs = list(relevant_docs or []) + results[:FEEDBACK_DOCS]
+        if not feedback_docs:
+            return results
+        with instrument.span("feedback"):
+            query_weights = get_feedback_weights(query_weights, feedback_docs)
+        with instrument.span("score"):
+            return rank_docs(query_weights, self.engine, self.k, candidates, self.prior)
+
+    def open_index(self, dictionary_file, postings_file):
+        set_dictionary(dictionary_file)
+        set_posting_file(postings_file)
+
+    def refresh_index(self) -> bool:
+        """
+        Returns:
+            bool: Whether the index changed on disk and was reopened
+        """
+        return refresh_index()
+
+    def get_query_terms(self, split_clauses) -> list[str]:
+        """
+        Returns:
+            list(str): The distinct words of the query and their expansions
+        """
+        clauses = [[clause for clause, _ in and_clause] for and_clause in split_clauses]
+        query_list = get_words_from_clauses(clauses)
+        if self.expand_query:
+            with instrument.span("expand"):
+                expanded_words = []
+                for word in query_list:
+                    expanded_words.extend(expand_word(word))
+            query_list.extend(expanded_words)
+        return list(set(query_list))
+
+    def close(self):
+        pass
+
+    def timed_search(
+        self, query: str, relevant_docs: list[int] = None
+    ) -> tuple[list[int], float]:
+        """
+        Returns:
+            (list(int), float): The relevant docIDs and the latency in ms
+        """
+        start = time.perf_counter()
+        results = self.search(query, relevant_docs)
+        return results, (time.perf_counter() - start) * 1000
+
+
+def open_searcher(dictionary_file, postings_file, *args, **kwargs) -> Searcher:
+    """
+    Returns:
+        Searcher: A searcher of the index, scattering each query over one
+                  process per partition if the index is partitioned
+    """
+    if os.path.exists(get_partitions_path(dictionary_file)):
+        # partitions.py builds on this module, import it only when needed
+        from partitions import PartitionedSearcher
+
+        return PartitionedSearcher(dictionary_file, postings_file, *args, **kwargs)
+    return Searcher(dictionary_file, postings_file, *args, **kwargs)
+
+
+def get_candidates(split_clauses, doc_filter: DocFilter = None):
+    """
+    Args:
+        split_clauses (list(list((str, bool)))): The clauses from split_query
+        doc_filter (DocFilter): Court and date restrictions, if any
+    Returns:
+        np.ndarray: Sorted docIDs passing the filter and holding every word
+                    of a boolean AND query and every quoted phrase, None if
+                    nothing restricts the query
+    """
+    candidates = None
+    # filter first from the metadata columns, so the AND only probes the
+    # blocks of docs that pass it
+    if doc_filter is not None and not doc_filter.is_empty():
+        candidates = get_filtered_docs(doc_filter)
+    if len(split_clauses) > 1 and (candidates is None or len(candidates) > 0):
+        words = get_words_from_clauses(
+            [[clause for clause, _ in and_clause] for and_clause in split_clauses]
+        )
+        and_docs = get_conjunctive_docs(words, candidates)
+        if and_docs is not None:
+            candidates = and_docs
+
+    for phrase in get_phrases_from_clauses(split_clauses):
+        if candidates is not None and len(candidates) == 0:
+            break
+        phrase_docs = get_phrase_docs(phrase)
+        if phrase_docs is None:
+            continue
+        if candidates is None:
+            candidates = phrase_docs
+        else:
+            candidates = np.intersect1d(candidates, phrase_docs)
+    return candidates
+
 
-    results = ""
+# return (query, [relevant docID, ...])
+def read_query_file(query_file):
     with open(query_file, "r") as f:
         query = f.readline()
-        relevant_docs = []
-        rel_doc = f.readline()
-        while rel_doc:
-            relevant_docs.append(int(rel_doc))
-            rel_doc = f.readline()
+        relevant_docs = [int(rel_doc) for rel_doc in f if rel_doc.strip()]
+
+    return query, relevant_docs
 
-        clauses = categorise_and_stem_query(query)
-        query_list = get_words_from_clauses(clauses)
-        if expand_query:
-            expanded_words = []
-            for query in query_list:
-                expanded = expand_clause(query)
-                expanded_words.extend(expanded)
-            query_list.extend(expanded_words)
-        query_list = list(set(query_list))
-        final_result = run_query(query_list)
-        results = " ".join(str(doc_id) for doc_id in final_result)
 
+def write_results(results_file, results):
     with open(results_file, "w") as f:
-        f.write(results)
+        f.write(" ".join(str(doc_id) for doc_id in results))
 
 
-def run_query(terms: list[str]):
-    query_weights = get_query_weights(terms)
-    document_scores = get_document_scores(query_weights)
+def run_search(
+    dictionary_file,
+    postings_file,
+    query_file,
+    results_file,
+    expand_query: bool = True,
+    engine: str = "maxscore",
+    k: int = None,
+    feedback: bool = False,
+    doc_filter: DocFilter = None,
+    prior: bool = False,
+):
+    # a single query loads what it needs as it goes, warming up would not pay off
+    searcher = open_searcher(
+        dictionary_file,
+        postings_file,
+        expand_query,
+        engine,
+        k,
+        warm_up=False,
+        feedback=feedback,
+        doc_filter=doc_filter,
+        prior=prior,
+    )
+    query, relevant_docs = read_query_file(query_file)
+    write_results(results_file, searcher.search(query, relevant_docs))
+    searcher.close()
+
+
+def log_latency(name, results, latency):
+    print(f"{name}: {len(results)} docs in {latency:.1f} ms", file=sys.stderr)
+
+
+def log_cache_stats():
+    print(format_cache_stats(), file=sys.stderr)
+    for name, cache in (("postings", get_posting_cache()), ("results", result_cache)):
+        info = cache.cache_info()
+        print(
+            f"{name} cache: {info.hits} hits, {info.misses} misses, "
+            f"{info.evictions} evictions, size {info.size}",
+            file=sys.stderr,
+        )
+
+
+def run_batch(searcher: Searcher, queries_path, output_path):
+    """
+    Answer many queries with one warm searcher.
+    A directory of query files writes one results file per query into the
+    output directory, a JSONL file of {"id", "query", "relevant"} objects
+    ("relevant" optional) writes one {"id", "results", "latency_ms"} line per
+    query to the output file; a request without an "id" is answered with
+    the id "line N", N its 1-based line number in the file.
+    """
+    if os.path.isdir(queries_path):
+        os.makedirs(output_path, exist_ok=True)
+        for name in sorted(os.listdir(queries_path)):
+            query, relevant_docs = read_query_file(os.path.join(queries_path, name))
+            results, latency = searcher.timed_search(query, relevant_docs)
+            write_results(os.path.join(output_path, name), results)
+            log_latency(name, results, latency)
+        log_cache_stats()
+        return
+
+    with open(queries_path, "r") as f, open(output_path, "w") as out:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            # a string, so it cannot clash with the numeric ids of other lines
+            query_id = request.get("id", f"line {line_number}")
+            results, latency = searcher.timed_search(
+                request["query"], request.get("relevant")
+            )
+            response = {"id": query_id, "results": results, "latency_ms": latency}
+            out.write(json.dumps(response) + "\n")
+            log_latency(query_id, results, latency)
+    log_cache_stats()
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    # one raw query per line in, one JSON object per line out
+    def handle(self):
+        for line in self.rfile:
+            query = line.decode("utf-8")
+            results, latency = self.server.searcher.timed_search(query)
+            response = {"results": results, "latency_ms": latency}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            log_latency(query.strip(), results, latency)
+
+
+def serve(searcher: Searcher, socket_path):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    with socketserver.UnixStreamServer(socket_path, QueryHandler) as server:
+        server.searcher = searcher
+        print(f"serving queries on {socket_path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+
+
+def run_query(
+    terms: list[str],
+    engine: str = "maxscore",
+    k: int = None,
+    candidates=None,
+    prior: bool = False,
+):
+    """
+    Args:
+        terms (list(str)): The stemmed query terms
+        engine (str): One of ENGINES
+        k (int): Max number of docs to return, None for all relevant docs
+        candidates (np.ndarray): Sorted docIDs to restrict the results to
+        prior (bool): Boost matching docs by their static prior
+    Returns:
+        list(int): The relevant docIDs, most relevant first
+    """
+    return rank_docs(get_query_weights(terms), engine, k, candidates, prior)
+
+
+def rank_docs(
+    query_weights: dict[str, float],
+    engine: str = "maxscore",
+    k: int = None,
+    candidates=None,
+    prior: bool = False,
+):
+    """
+    Args:
+        query_weights (dict(str, float)): Normalized weight of each query term
+    Returns:
+        list(int): The relevant docIDs, most relevant first
+    """
+    top_docs = score_docs(query_weights, engine, k, candidates, prior)
+    return [doc for doc, score in top_docs]
+
+
+def score_docs(
+    query_weights: dict[str, float],
+    engine: str = "maxscore",
+    k: int = None,
+    candidates=None,
+    prior: bool = False,
+):
+    """
+    Returns:
+        list((int, float)): The relevant docIDs and their scores, most
+                            relevant first, ties broken by docID
+    """
+    if engine == "maxscore":
+        return maxscore.get_top_docs(
+            query_weights, RELEVANCE_THRESHOLD, k, candidates, prior
+        )
+    if engine == "numpy":
+        return vector_scoring.get_top_docs(
+            query_weights, RELEVANCE_THRESHOLD, k, candidates, prior
+        )
+    if engine == "impact":
+        return impact_scoring.get_top_docs(
+            query_weights, RELEVANCE_THRESHOLD, k, candidates, prior
+        )
+
+    document_scores = get_document_scores(query_weights, candidates)
+    instrument.count("docs_scored", len(document_scores))
+    if prior:
+        document_scores = add_doc_priors(document_scores)
     relevant_docs = get_relevant_docs(document_scores)
-    return relevant_docs
+    return relevant_docs[:k]
 
 
-# get td-idf of query, cosine normalized
+# get td-idf of query, cosine normalized, idf(term) giving each term's idf
 # return map{ word: tf-idf-normalized }
-def get_query_weights(terms: list[str]) -> dict[str, float]:
+def get_query_weights(terms: list[str], idf=get_idf) -> dict[str, float]:
     query_weights = {}
-    collection_size = get_collection_size()
     normalize = 0
 
     term_counts = {}
@@ -87,13 +488,8 @@ def get_query_weights(terms: list[str]) -> dict[str, float]:
     # query_weights = dict{ term: tf-idf }
     for term, count in term_counts.items():
         tf = 1 + math.log10(count)
-        if term_in_dict(term):
-            term_doc_count = get_term_doc_count(term)
-            idf = math.log10(collection_size / term_doc_count)
-        else:
-            idf = 0
-
-        tf_idf = tf * idf
+        # df is stored in the dictionary, no postings I/O
+        tf_idf = tf * idf(term)
         query_weights[term] = tf_idf
         normalize += tf_idf * tf_idf
 
@@ -108,16 +504,13 @@ def get_query_weights(terms: list[str]) -> dict[str, float]:
 
 # get lnc.ltc document scores
 # return map{ doc: score }
-def get_document_scores(query_weights) -> dict[int, float]:
+def get_document_scores(query_weights, candidates=None) -> dict[int, float]:
     document_scores = {}
     term_posts = {}
     for term, weight in query_weights.items():
-        postings = get_postings_docs(term)
-
-        term_posts['title'] = posting_to_dict(get_posting_list(term, 'title'))
-        term_posts['date'] = posting_to_dict(get_posting_list(term, 'date'))
-        term_posts['court'] = posting_to_dict(get_posting_list(term, 'court'))
-        term_posts['content'] = posting_to_dict(get_posting_list(term, 'content'))
+        for zone in ZONES:
+            term_posts[zone] = posting_to_dict(get_posting_list(term, zone, candidates))
+        postings = set().union(*term_posts.values())
         for doc in postings:
             if doc not in document_scores:
                 document_scores[doc] = 0
@@ -126,59 +519,153 @@ def get_document_scores(query_weights) -> dict[int, float]:
     return document_scores
 
 
+# add the static prior of every matching doc to its score
+# return map{ doc: score }
+def add_doc_priors(doc_scores):
+    docs = sorted(doc for doc, score in doc_scores.items() if score > 0)
+    priors = get_doc_priors(np.array(docs, dtype=np.int64)).tolist()
+    for doc, prior in zip(docs, priors):
+        doc_scores[doc] += prior
+    return doc_scores
+
+
 def posting_to_dict(posting):
-    res = {}
-    for p in posting:
-        res[p[0]] = float(p[1])
-    return res
+    doc_ids, weights = posting
+    return dict(zip(doc_ids.tolist(), weights.tolist()))
+
 
 # get zone weighted tf of term in doc, cosine normalized
 def get_doc_term_weight(doc, term_posts):
     score = 0
     for zone, weight in ZONES.items():
         score += term_posts[zone].get(doc, 0) * weight
-        # score += get_doc_term_zone_tf(doc, term, zone) * weight
 
     return score
 
 
-# return relevant docs sorted most to least relevant
+# return [(doc, score), ...] of relevant docs sorted most to least relevant
 def get_relevant_docs(doc_scores):
     relevant = []
     for doc, score in doc_scores.items():
         if score > RELEVANCE_THRESHOLD:
             relevant.append((doc, score))
 
-    relevant.sort(key=lambda x: x[1], reverse=True)
-
-    return [x[0] for x in relevant]
-
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], "d:p:q:o:")
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == "-d":
-        dictionary_file = a
-    elif o == "-p":
-        postings_file = a
-    elif o == "-q":
-        file_of_queries = a
-    elif o == "-o":
-        file_of_output = a
+    relevant.sort(key=lambda x: (-x[1], x[0]))
+
+    return relevant
+
+
+def main():
+    dictionary_file = postings_file = file_of_queries = file_of_output = None
+    socket_path = None
+    engine = "maxscore"
+    k = None
+    feedback = prior = False
+    courts = min_tier = date_from = date_to = None
+    trace_file = profile_file = None
+    profile_top = instrument.PROFILE_TOP
+
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:],
+            "d:p:q:o:e:k:fb",
+            [
+                "serve=",
+                "court=",
+                "min-tier=",
+                "from=",
+                "to=",
+                "trace=",
+                "profile=",
+                "profile-top=",
+            ],
+        )
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == "-d":
+            dictionary_file = a
+        elif o == "-p":
+            postings_file = a
+        elif o == "-q":
+            file_of_queries = a
+        elif o == "-o":
+            file_of_output = a
+        elif o == "--serve":
+            socket_path = a
+        elif o == "-e":
+            engine = a
+        elif o == "-k":
+            k = int(a)
+        elif o == "-f":
+            feedback = True
+        elif o == "-b":
+            prior = True
+        elif o == "--court":
+            courts = (courts or ()) + (a,)
+        elif o == "--min-tier":
+            if a.upper() not in CourtTier.__members__:
+                usage()
+                sys.exit(2)
+            min_tier = CourtTier[a.upper()]
+        elif o == "--from":
+            date_from = parse_date(a)
+        elif o == "--to":
+            date_to = parse_date(a, end=True)
+        elif o == "--trace":
+            trace_file = a
+        elif o == "--profile":
+            profile_file = a
+        elif o == "--profile-top":
+            profile_top = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None or engine not in ENGINES:
+        usage()
+        sys.exit(2)
+    if date_from == 0 or date_to == 0:
+        usage()
+        sys.exit(2)
+    doc_filter = DocFilter(courts, min_tier, date_from, date_to)
+    instrument.configure(trace_file, profile_file, profile_top)
+    options = {"feedback": feedback, "doc_filter": doc_filter, "prior": prior}
+
+    if socket_path != None:
+        searcher = open_searcher(
+            dictionary_file, postings_file, True, engine, k, **options
+        )
+        serve(searcher, socket_path)
+        searcher.close()
+        return
+
+    if file_of_queries == None or file_of_output == None:
+        usage()
+        sys.exit(2)
+
+    if os.path.isdir(file_of_queries) or file_of_queries.endswith(".jsonl"):
+        searcher = open_searcher(
+            dictionary_file, postings_file, True, engine, k, **options
+        )
+        run_batch(searcher, file_of_queries, file_of_output)
+        searcher.close()
     else:
-        assert False, "unhandled option"
-
-if (
-    dictionary_file == None
-    or postings_file == None
-    or file_of_queries == None
-    or file_of_output == None
-):
-    usage()
-    sys.exit(2)
-
-run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+        run_search(
+            dictionary_file,
+            postings_file,
+            file_of_queries,
+            file_of_output,
+            True,
+            engine,
+            k,
+            **options,
+        )
+
+
+if __name__ == "__main__":
+    # partitions.py imports this module by name, let it share this copy and
+    # its result cache rather than load a second one
+    sys.modules.setdefault("search", sys.modules[__name__])
+    main()
@@ -0,0 +1,416 @@
+import mmap
+import os
+import pickle
+
+import numpy as np
+
+from forward import open_forward_index
+from impacts import open_impact_index
+from instrument import span
+from metadata import DocFilter, open_doc_metadata
+from postings import (
+    BLOCK_SIZE,
+    EMPTY_DOCS,
+    EMPTY_WEIGHTS,
+    PostingEntry,
+    PostingList,
+    check_file_header,
+    decode_positions,
+    in_sorted,
+)
+from termdict import TermDictionary
+
+# An index is one or more segments, each a dictionary/postings pair. The
+# base pair is the -d/-p files; appended segments and the per-segment
+# deletion bitmaps are listed in a manifest next to the base dictionary:
+#   {"generation": int,
+#    "segments": [{"dictionary": name, "postings": name, "deleted": bytes}]}
+# Without a manifest the base pair is the only segment.
+MANIFEST_SUFFIX = ".segments"
+# A partitioned index splits the docs by docID range into independent
+# indexes ({dictionary}.partN, {postings}.partN, each with its own segments),
+# listed in order next to the base dictionary:
+#   {"partitions": [{"dictionary": name, "postings": name,
+#                    "doc_range": (first docID, end docID)}]}
+# A range includes its first docID and excludes its end, None is unbounded.
+PARTITIONS_SUFFIX = ".partitions"
+
+# merge policy: compact the smallest segments once there are too many, and
+# any segment where tombstones make up too much of the postings
+MAX_SEGMENTS = 8
+MERGE_FACTOR = 4
+MAX_DELETED_RATIO = 0.3
+
+
+class Segment:
+    """
+    One dictionary/postings pair and the tombstones of its deleted docs.
+    """
+
+    def __init__(
+        self, dictionary_file, postings_file, deleted: bytes = None, cache=None
+    ):
+        self.dictionary_file = dictionary_file
+        self.postings_file = postings_file
+        # shared cache.LRUCache of decoded posting lists, if any
+        self.cache = cache
+        # map{ list offset: map{ block: (docIDs, weights) } } of the blocks
+        # decoded by the queries of a batch, None outside of a batch (see
+        # retrieve.share_postings)
+        self.batch_blocks = None
+        self.dictionary = TermDictionary(dictionary_file)
+        with open(postings_file, "rb") as f:
+            self.postings = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        check_file_header(self.postings)
+
+        # sorted docIDs of the segment, the bitmap is indexed by position
+        self.doc_ids = self.dictionary[("*", "docs")]
+        self.deleted = np.zeros(len(self.doc_ids), dtype=bool)
+        if deleted:
+            bits = np.unpackbits(np.frombuffer(deleted, dtype=np.uint8))
+            self.deleted = bits[: len(self.doc_ids)].astype(bool)
+        self.num_deleted = int(np.count_nonzero(self.deleted))
+        self.has_positions = self.dictionary.get(("*", "positions"), False)
+        self.pruned = self.dictionary.get(("*", "pruned"), False)
+        self.forward = open_forward_index(dictionary_file)
+        self.metadata = open_doc_metadata(dictionary_file)
+        self.impacts = open_impact_index(dictionary_file)
+
+    @property
+    def num_live_docs(self):
+        return len(self.doc_ids) - self.num_deleted
+
+    def live_postings(self, doc_ids, weights):
+        if self.num_deleted == 0:
+            return doc_ids, weights
+        live = self.is_live(doc_ids)
+        return doc_ids[live], weights[live]
+
+    def is_live(self, doc_ids: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            doc_ids (np.ndarray): docIDs that are in this segment
+        Returns:
+            np.ndarray: bool mask, False for tombstoned docs
+        """
+        if self.num_deleted == 0:
+            return np.ones(len(doc_ids), dtype=bool)
+        return ~self.deleted[np.searchsorted(self.doc_ids, doc_ids)]
+
+    def is_live_doc(self, doc_id: int) -> bool:
+        i = int(np.searchsorted(self.doc_ids, doc_id))
+        return (
+            i < len(self.doc_ids) and self.doc_ids[i] == doc_id and not self.deleted[i]
+        )
+
+    def filter_docs(self, doc_filter: DocFilter) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Sorted live docIDs passing doc_filter, none if the
+                        segment has no metadata to check it with
+        """
+        if self.metadata is None:
+            return EMPTY_DOCS
+        return self.doc_ids[self.metadata.get_filter_mask(doc_filter) & ~self.deleted]
+
+    def get_priors(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Static prior of each doc, aligned with doc_ids
+        """
+        if self.metadata is None:
+            return np.zeros(len(self.doc_ids), dtype=np.float32)
+        return self.metadata.priors
+
+    def delete(self, doc_ids) -> int:
+        """
+        Tombstone the given docIDs if they are in this segment.
+        Returns:
+            int: The number of docs newly deleted
+        """
+        doc_ids = np.unique(np.asarray(doc_ids, dtype=np.int64))
+        pos = np.searchsorted(self.doc_ids, doc_ids)
+        inside = pos < len(self.doc_ids)
+        pos = pos[inside][self.doc_ids[pos[inside]] == doc_ids[inside]]
+
+        newly_deleted = int(np.count_nonzero(~self.deleted[pos]))
+        self.deleted[pos] = True
+        self.num_deleted += newly_deleted
+        return newly_deleted
+
+    def packed_deleted(self) -> bytes:
+        return np.packbits(self.deleted).tobytes() if self.num_deleted else None
+
+    def get_posting_list(self, key):
+        if key not in self.dictionary:
+            return None
+        return SegmentPostingList(self, self.dictionary[key])
+
+    def get_keys(self):
+        return self.dictionary.posting_keys()
+
+    def get_doc_count(self, term, zones) -> int:
+        """
+        Returns:
+            int: The number of live docs with term in any of the zones
+        """
+        if self.num_deleted == 0:
+            return self.dictionary.get((term, "*"), 0)
+
+        # tombstoned docs are still in the stored df, count the live postings
+        docs = [
+            self.get_posting_list((term, zone)).decode()[0]
+            for zone in zones
+            if (term, zone) in self.dictionary
+        ]
+        if not docs:
+            return 0
+        return len(np.unique(np.concatenate(docs)))
+
+
+class SegmentPostingList(PostingList):
+    """
+    A posting list of one segment that leaves out the segment's deleted docs.
+    Whole lists decoded once are kept in the segment's cache and answer later
+    decodes of the list or of some of its blocks; within a batch of queries,
+    blocks decoded once answer the later queries of the batch.
+    """
+
+    def __init__(self, segment: Segment, entry: PostingEntry):
+        super().__init__(segment.postings, entry.offset)
+        self.segment = segment
+        self.entry = entry
+        self.has_positions = entry.pos_length > 0
+        self.cache_key = (segment.postings_file, entry.offset)
+
+    def get_cached(self):
+        cache = self.segment.cache
+        return None if cache is None else cache.get(self.cache_key)
+
+    def decode_all(self):
+        # every posting, deleted docs included, so blocks can be sliced out
+        postings = self.get_cached()
+        if postings is None:
+            postings = PostingList.decode(self)
+            if self.segment.cache is not None:
+                for array in postings:
+                    array.flags.writeable = False
+                self.segment.cache.put(self.cache_key, postings)
+        return postings
+
+    def decode(self):
+        with span("postings"):
+            return self.segment.live_postings(*self.decode_all())
+
+    def decode_blocks(self, blocks):
+        with span("postings"):
+            postings = self.get_cached()
+            if postings is None:
+                postings = self.decode_uncached_blocks(blocks)
+            else:
+                postings = slice_blocks(*postings, blocks)
+            return self.segment.live_postings(*postings)
+
+    def decode_docs(self, candidates):
+        with span("postings"):
+            postings = self.get_cached()
+            if postings is None:
+                postings = self.decode_uncached_blocks(self.blocks_of(candidates))
+            doc_ids, weights = self.segment.live_postings(*postings)
+            keep = in_sorted(doc_ids, candidates)
+            return doc_ids[keep], weights[keep]
+
+    def decode_uncached_blocks(self, blocks):
+        batch_blocks = self.segment.batch_blocks
+        if batch_blocks is None:
+            return PostingList.decode_blocks(self, blocks)
+
+        decoded = batch_blocks.setdefault(self.entry.offset, {})
+        blocks = np.asarray(blocks, dtype=np.int64).tolist()
+        missing = [block for block in blocks if block not in decoded]
+        if missing:
+            doc_ids, weights = PostingList.decode_blocks(self, missing)
+            # every block is full but the last
+            sizes = [
+                min(BLOCK_SIZE, self.num_docs - block * BLOCK_SIZE) for block in missing
+            ]
+            bounds = np.cumsum(sizes)[:-1]
+            for block, block_docs, block_weights in zip(
+                missing, np.split(doc_ids, bounds), np.split(weights, bounds)
+            ):
+                decoded[block] = (block_docs, block_weights)
+        if not blocks:
+            return EMPTY_DOCS, EMPTY_WEIGHTS
+        return (
+            np.concatenate([decoded[block][0] for block in blocks]),
+            np.concatenate([decoded[block][1] for block in blocks]),
+        )
+
+    def decode_positions(
+        self, blocks=None
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Args:
+            blocks (iterable(int)): Sorted indices of the blocks to decode,
+                                    None for the whole list
+        Returns:
+            (np.ndarray, np.ndarray, np.ndarray): Every docID of those
+                blocks, deleted ones included, and the bounds and positions
+                from postings.decode_positions aligned with them
+        """
+        with span("positions"):
+            if blocks is None:
+                doc_ids, _ = PostingList.decode(self)
+            else:
+                doc_ids, _ = PostingList.decode_blocks(self, blocks)
+            bounds, positions = decode_positions(
+                self.segment.postings, self.entry, blocks
+            )
+            return doc_ids, bounds, positions
+
+
+def slice_blocks(doc_ids, weights, blocks):
+    if len(blocks) == 0:
+        return EMPTY_DOCS, EMPTY_WEIGHTS
+    rows = np.concatenate(
+        [np.arange(block * BLOCK_SIZE, (block + 1) * BLOCK_SIZE) for block in blocks]
+    )
+    rows = rows[rows < len(doc_ids)]
+    return doc_ids[rows], weights[rows]
+
+
+def get_manifest_path(dictionary_file):
+    return dictionary_file + MANIFEST_SUFFIX
+
+
+# paths are kept relative to the base dictionary so the index can be moved
+def get_segment_entry(dictionary_file, postings_file, deleted: bytes = None):
+    index_dir = os.path.dirname(os.path.abspath(dictionary_file))
+    return {
+        "dictionary": os.path.relpath(os.path.abspath(dictionary_file), index_dir),
+        "postings": os.path.relpath(os.path.abspath(postings_file), index_dir),
+        "deleted": deleted,
+    }
+
+
+def get_segment_files(dictionary_file, entry) -> tuple[str, str]:
+    index_dir = os.path.dirname(os.path.abspath(dictionary_file))
+    return (
+        os.path.join(index_dir, entry["dictionary"]),
+        os.path.join(index_dir, entry["postings"]),
+    )
+
+
+def load_manifest(dictionary_file, postings_file) -> dict:
+    """
+    Returns:
+        dict: The manifest of the index, a single base segment if there is none
+    """
+    manifest_path = get_manifest_path(dictionary_file)
+    if not os.path.exists(manifest_path):
+        base = get_segment_entry(dictionary_file, postings_file)
+        return {"generation": 0, "segments": [base]}
+
+    with open(manifest_path, "rb") as handle:
+        return pickle.load(handle)
+
+
+def save_manifest(dictionary_file, manifest):
+    # replace atomically so a searcher never sees a half written manifest
+    manifest_path = get_manifest_path(dictionary_file)
+    with open(manifest_path + ".tmp", "wb") as handle:
+        pickle.dump(manifest, handle)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def get_partitions_path(dictionary_file):
+    return dictionary_file + PARTITIONS_SUFFIX
+
+
+def load_partitions(dictionary_file) -> list[dict]:
+    """
+    Returns:
+        list(dict): The partition entries of the index, None if it is not
+                    partitioned
+    """
+    partitions_path = get_partitions_path(dictionary_file)
+    if not os.path.exists(partitions_path):
+        return None
+
+    with open(partitions_path, "rb") as handle:
+        return pickle.load(handle)["partitions"]
+
+
+def save_partitions(dictionary_file, partitions: list[dict]):
+    partitions_path = get_partitions_path(dictionary_file)
+    with open(partitions_path + ".tmp", "wb") as handle:
+        pickle.dump({"partitions": partitions}, handle)
+    os.replace(partitions_path + ".tmp", partitions_path)
+
+
+# an index is there once built: its base dictionary, or the manifest or
+# partition list that outlive a merged away base
+def index_exists(dictionary_file) -> bool:
+    return any(
+        os.path.exists(path)
+        for path in (
+            dictionary_file,
+            get_manifest_path(dictionary_file),
+            get_partitions_path(dictionary_file),
+        )
+    )
+
+
+def in_doc_range(doc_id: int, doc_range: tuple) -> bool:
+    first, end = doc_range
+    return (first is None or doc_id >= first) and (end is None or doc_id < end)
+
+
+def open_segments(dictionary_file, postings_file, cache=None) -> list[Segment]:
+    manifest = load_manifest(dictionary_file, postings_file)
+    return [
+        Segment(*get_segment_files(dictionary_file, entry), entry["deleted"], cache)
+        for entry in manifest["segments"]
+    ]
+
+
+def get_index_stamp(dictionary_file, postings_file) -> tuple:
+    """
+    Every rebuild, append, delete and merge ends by replacing the manifest
+    once its segment files are in place, so the manifest alone tells whether
+    the index changed; only an index without one has its files checked.
+    Returns:
+        tuple: Inode, modification time and size of the manifest, or of the
+               base segment files if there is no manifest
+    """
+    try:
+        stat = os.stat(get_manifest_path(dictionary_file))
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        pass
+
+    stamp = []
+    for path in (dictionary_file, postings_file):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stamp.append((path, None))
+            continue
+        stamp.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(stamp)
+
+
+def select_segments_to_merge(segments: list[Segment]) -> list[int]:
+    """
+    Returns:
+        list(int): Indices of the segments the merge policy wants compacted
+    """
+    selected = {
+        i
+        for i, segment in enumerate(segments)
+        if segment.num_deleted > MAX_DELETED_RATIO * len(segment.doc_ids)
+    }
+    if len(segments) > MAX_SEGMENTS:
+        by_size = sorted(range(len(segments)), key=lambda i: len(segments[i].doc_ids))
+        selected.update(by_size[:MERGE_FACTOR])
+    return sorted(selected)
@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+import asyncio
+import getopt
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from client import parse_address
+from retrieve import share_postings
+from search import ENGINES, open_searcher
+
+# Queries arriving within BATCH_WINDOW of the first one waiting, up to
+# MAX_BATCH of them, are answered together by one warm Searcher in a worker
+# process, so parsing and scoring never block the event loop. The queries
+# of a batch run back to back sharing their decoded postings (see
+# retrieve.share_postings), so each block of a (term, zone) list that
+# several of them need is decoded once, and repeated queries are answered
+# from the result cache. Each worker process has its own caches, and on a
+# partitioned index the postings are decoded by the partition processes,
+# which see one query at a time, so there only the result cache is shared.
+# A query that fails gets an error response of its own, the rest of its
+# batch is answered as usual. At most QUEUE_SIZE queries wait for a batch;
+# past that connections stop being read until the workers catch up.
+BATCH_WINDOW = 0.002
+MAX_BATCH = 32
+QUEUE_SIZE = 256
+DEFAULT_WORKERS = 1
+
+# the Searcher of a worker process, see open_worker
+searcher = None
+
+
+def usage():
+    print(
+        "usage: "
+        + sys.argv[0]
+        + " -d dictionary-file -p postings-file -s socket-path|host:port"
+        + " [-e engine] [-k max-results] [-b] [-w workers] [--window ms]"
+        + " [--batch max-queries] [--queue max-waiting]"
+        + "\n       answers one query per line with one JSON object per line,"
+        + "\n       in order, batching concurrent queries; -w 0 answers them"
+        + "\n       in a thread of the server process"
+    )
+
+
+def open_worker(dictionary_file, postings_file, engine, k, prior):
+    global searcher
+    searcher = open_searcher(
+        dictionary_file, postings_file, True, engine, k, prior=prior
+    )
+
+
+def init_worker(*args):
+    # Ctrl-C reaches the whole process group, the server shuts workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    open_worker(*args)
+
+
+def answer_batch(queries: list[str]) -> list[dict]:
+    """
+    Returns:
+        list(dict): The "results" of each query and the time spent
+                    searching it in ms ("search_ms"), or the "error" it
+                    failed with
+    """
+    answers = []
+    with share_postings():
+        for query in queries:
+            try:
+                results, search_ms = searcher.timed_search(query)
+            except Exception as e:
+                answers.append({"error": repr(e)})
+                continue
+            answers.append({"results": results, "search_ms": search_ms})
+    return answers
+
+
+class QueryServer:
+    """
+    Reads queries off every connection into one bounded queue, groups them
+    into batches and writes each connection's responses back in order.
+    """
+
+    def __init__(
+        self,
+        executor,
+        workers: int,
+        window: float = BATCH_WINDOW,
+        max_batch: int = MAX_BATCH,
+        queue_size: int = QUEUE_SIZE,
+    ):
+        self.executor = executor
+        self.workers = max(workers, 1)
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue(queue_size)
+        # one batch in flight per worker
+        self.slots = asyncio.Semaphore(self.workers)
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue()
+        responder = asyncio.create_task(self.write_responses(pending, writer))
+        try:
+            async for line in reader:
+                future = loop.create_future()
+                pending.put_nowait(future)
+                # waits while the queue is full, holding back this connection
+                await self.queue.put(
+                    (line.decode("utf-8"), future, time.perf_counter())
+                )
+        except ConnectionResetError:
+            pass  # the queries read so far are still answered
+        pending.put_nowait(None)
+        await responder
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+
+    async def write_responses(self, pending, writer):
+        while (future := await pending.get()) is not None:
+            try:
+                response = await future
+            except Exception as e:
+                response = {"error": repr(e)}
+            try:
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                await writer.drain()
+            except (ConnectionResetError, BrokenPipeError):
+                # the client is gone, the rest of its answers are dropped
+                return
+
+    async def batch_queries(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.slots.acquire()
+            asyncio.create_task(self.answer(batch))
+
+    async def answer(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            answers = await loop.run_in_executor(
+                self.executor, answer_batch, [query for query, _, _ in batch]
+            )
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        finally:
+            self.slots.release()
+
+        done = time.perf_counter()
+        for (query, future, arrived), response in zip(batch, answers):
+            response["latency_ms"] = (done - arrived) * 1000
+            response["batch"] = len(batch)
+            future.set_result(response)
+
+    async def serve(self, address):
+        # start every worker and load its index and nltk resources up front
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(self.executor, answer_batch, [])
+                for _ in range(self.workers)
+            )
+        )
+        host, port = parse_address(address)
+        if port is None:
+            if os.path.exists(host):
+                os.remove(host)
+            server = await asyncio.start_unix_server(self.handle, host)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        batcher = asyncio.create_task(self.batch_queries())
+        stopped = loop.create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set_result, None)
+        print(f"serving queries on {address}", file=sys.stderr)
+        try:
+            async with server:
+                await stopped
+        finally:
+            batcher.cancel()
+            if port is None:
+                os.remove(host)
+
+
+def main():
+    dictionary_file = postings_file = address = None
+    engine = "maxscore"
+    k = None
+    prior = False
+    workers = DEFAULT_WORKERS
+    window = BATCH_WINDOW
+    max_batch = MAX_BATCH
+    queue_size = QUEUE_SIZE
+
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:], "d:p:s:e:k:bw:", ["window=", "batch=", "queue="]
+        )
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == "-d":
+            dictionary_file = a
+        elif o == "-p":
+            postings_file = a
+        elif o == "-s":
+            address = a
+        elif o == "-e":
+            engine = a
+        elif o == "-k":
+            k = int(a)
+        elif o == "-b":
+            prior = True
+        elif o == "-w":
+            workers = int(a)
+        elif o == "--window":
+            window = float(a) / 1000
+        elif o == "--batch":
+            max_batch = int(a)
+        elif o == "--queue":
+            queue_size = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if (
+        dictionary_file == None
+        or postings_file == None
+        or address == None
+        or engine not in ENGINES
+    ):
+        usage()
+        sys.exit(2)
+
+    worker_args = (dictionary_file, postings_file, engine, k, prior)
+    if workers > 0:
+        # spawned rather than forked, the event loop's threads are not copied
+        executor = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=worker_args,
+        )
+    else:
+        open_worker(*worker_args)
+        executor = ThreadPoolExecutor(1)
+
+    server = QueryServer(executor, workers, window, max_batch, queue_size)
+    try:
+        asyncio.run(server.serve(address))
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    main()
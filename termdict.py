@@ -0,0 +1,258 @@
+import mmap
+import os
+import struct
+from functools import lru_cache
+
+import numpy as np
+
+from constants import Zone
+from postings import PostingEntry
+
+# Dictionary file layout (all integers little-endian), mapped read-only so
+# every search process shares one page cached copy:
+#   header: MAGIC, u16 version, u16 flags (bit 0: postings have positions,
+#           bit 1: postings are statically pruned, see pruning.py),
+#           u32 term count, u32 entry count, u32 doc count, u32 term bytes
+#   u32[terms + 1]   byte offset of each term in the term bytes
+#   term bytes       utf-8 terms back to back, sorted bytewise (= str order)
+#   u32[terms]       df of each term over all zones
+#   u32[terms + 1]   first entry of each term, its entries are consecutive
+#   u8[entries]      zone of each entry, an index into ZONES
+#   ENTRY[entries]   the PostingEntry of each (term, zone) with postings,
+#                    positions (if any) start right after the posting list
+#   i64[docs]        sorted docIDs of the index
+# Sections are padded to 8 bytes so every column can be viewed in place.
+MAGIC = b"HW4D"
+VERSION = 1
+HAS_POSITIONS = 1
+PRUNED = 2
+
+HEADER = struct.Struct("<4sHHIIII")
+ENTRY = np.dtype(
+    [
+        ("offset", "<u8"),
+        ("length", "<u4"),
+        ("max_weight", "<f4"),
+        ("df", "<u4"),
+        ("pos_length", "<u4"),
+    ]
+)
+# in key order, so iterating terms then zones yields sorted (term, zone) keys
+ZONES = sorted(zone.value for zone in Zone)
+ZONE_COLUMNS = {zone: i for i, zone in enumerate(ZONES)}
+
+TERM_CACHE_SIZE = 1 << 12
+
+
+def pad(size: int) -> int:
+    return -size % 8
+
+
+def write_term_dictionary(
+    out_dict, terms, entries, term_dfs, doc_ids, has_positions=False, pruned=False
+):
+    """
+    Args:
+        out_dict (str): Path of the dictionary file
+        terms (list(str)): Sorted terms
+        entries (list(dict(str, PostingEntry))): The entry of each zone of
+                                                 each term
+        term_dfs (list(int)): Docs with each term in any zone
+        doc_ids (iterable(int)): Every doc in the index
+        has_positions (bool): Whether the postings have positions
+        pruned (bool): Whether postings were left out by static pruning
+    """
+    encoded = [term.encode("utf-8") for term in terms]
+    term_offsets = np.zeros(len(terms) + 1, dtype="<u4")
+    np.cumsum([len(term) for term in encoded], out=term_offsets[1:])
+    term_bytes = b"".join(encoded)
+
+    entry_starts = np.zeros(len(terms) + 1, dtype="<u4")
+    np.cumsum([len(zone_entries) for zone_entries in entries], out=entry_starts[1:])
+    zones = bytearray()
+    records = []
+    for zone_entries in entries:
+        for zone in sorted(zone_entries):
+            entry = zone_entries[zone]
+            zones.append(ZONE_COLUMNS[zone])
+            records.append(
+                (
+                    entry.offset,
+                    entry.length,
+                    entry.max_weight,
+                    entry.df,
+                    entry.pos_length,
+                )
+            )
+    doc_ids = np.sort(np.asarray(list(doc_ids), dtype="<i8"))
+
+    sections = [
+        term_offsets.tobytes(),
+        term_bytes,
+        np.asarray(term_dfs, dtype="<u4").tobytes(),
+        entry_starts.tobytes(),
+        bytes(zones),
+        np.array(records, dtype=ENTRY).tobytes(),
+        doc_ids.tobytes(),
+    ]
+    flags = (HAS_POSITIONS if has_positions else 0) | (PRUNED if pruned else 0)
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        flags,
+        len(terms),
+        len(records),
+        len(doc_ids),
+        len(term_bytes),
+    )
+    # replaced whole so a searcher never maps a half written file
+    with open(out_dict + ".tmp", "wb") as f:
+        f.write(header + b"\0" * pad(len(header)))
+        for section in sections:
+            f.write(section + b"\0" * pad(len(section)))
+    os.replace(out_dict + ".tmp", out_dict)
+
+
+class TermDictionary:
+    """
+    A dictionary file mapped in place. Terms are found by binary search over
+    the sorted term bytes; it answers the same (term, zone) keys the old
+    pickled dict did:
+        (term, zone) -> PostingEntry
+        (term, "*")  -> df over all zones
+        ("*", "*")   -> collection size
+        ("*", "docs") -> sorted docIDs
+        ("*", "positions") -> whether the postings have positions
+        ("*", "pruned") -> whether postings were left out by static pruning
+    """
+
+    def __init__(self, dictionary_file):
+        with open(dictionary_file, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.buf) < HEADER.size:
+            raise ValueError("dictionary file is truncated")
+        magic, version, flags, num_terms, num_entries, num_docs, term_bytes = (
+            HEADER.unpack_from(self.buf, 0)
+        )
+        if magic != MAGIC:
+            raise ValueError("not a binary dictionary file, rebuild the index")
+        if version != VERSION:
+            raise ValueError(
+                f"dictionary format v{version} is not supported "
+                f"(expected v{VERSION}), rebuild the index"
+            )
+
+        self.num_terms = num_terms
+        self.has_positions = bool(flags & HAS_POSITIONS)
+        self.pruned = bool(flags & PRUNED)
+        pos = HEADER.size + pad(HEADER.size)
+        self.term_offsets = np.frombuffer(self.buf, "<u4", num_terms + 1, pos)
+        pos += 4 * (num_terms + 1) + pad(4 * (num_terms + 1))
+        self.terms_pos = pos
+        pos += term_bytes + pad(term_bytes)
+        self.term_dfs = np.frombuffer(self.buf, "<u4", num_terms, pos)
+        pos += 4 * num_terms + pad(4 * num_terms)
+        self.entry_starts = np.frombuffer(self.buf, "<u4", num_terms + 1, pos)
+        pos += 4 * (num_terms + 1) + pad(4 * (num_terms + 1))
+        self.zones_pos = pos
+        pos += num_entries + pad(num_entries)
+        self.entries = np.frombuffer(self.buf, ENTRY, num_entries, pos)
+        pos += ENTRY.itemsize * num_entries
+        self.doc_ids = np.frombuffer(self.buf, "<i8", num_docs, pos)
+        self.find_term = lru_cache(maxsize=TERM_CACHE_SIZE)(self.search_term)
+
+    def get_term(self, row: int) -> bytes:
+        start = self.terms_pos + int(self.term_offsets[row])
+        return self.buf[start : self.terms_pos + int(self.term_offsets[row + 1])]
+
+    def bisect(self, term: bytes) -> int:
+        # first row whose term is >= term
+        lo, hi = 0, self.num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_term(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def search_term(self, term: str) -> int:
+        """
+        Returns:
+            int: Row of term, -1 if it is not in the dictionary
+        """
+        encoded = term.encode("utf-8")
+        row = self.bisect(encoded)
+        if row < self.num_terms and self.get_term(row) == encoded:
+            return row
+        return -1
+
+    def get_zones(self, row: int) -> tuple[int, bytes]:
+        """
+        Returns:
+            (int, bytes): The first entry of the term and its zone indices
+        """
+        start = int(self.entry_starts[row])
+        end = int(self.entry_starts[row + 1])
+        return start, self.buf[self.zones_pos + start : self.zones_pos + end]
+
+    def get_entry(self, row: int, zone: str) -> PostingEntry:
+        start, zones = self.get_zones(row)
+        i = zones.find(ZONE_COLUMNS[zone])
+        if i < 0:
+            return None
+        offset, length, max_weight, df, pos_length = self.entries[start + i].tolist()
+        pos_offset = offset + length if pos_length else 0
+        return PostingEntry(offset, length, max_weight, df, pos_offset, pos_length)
+
+    def get(self, key, default=None):
+        term, zone = key
+        if term == "*":
+            if zone == "*":
+                return len(self.doc_ids)
+            if zone == "docs":
+                return self.doc_ids
+            if zone == "positions":
+                return self.has_positions
+            if zone == "pruned":
+                return self.pruned
+            return default
+
+        row = self.find_term(term)
+        if row < 0:
+            return default
+        if zone == "*":
+            return int(self.term_dfs[row])
+        if zone not in ZONE_COLUMNS:
+            return default
+        entry = self.get_entry(row, zone)
+        return default if entry is None else entry
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def posting_keys(self):
+        """
+        Yields:
+            (str, str): Every (term, zone) with a posting list, in sorted order
+        """
+        for row in range(self.num_terms):
+            term = self.get_term(row).decode("utf-8")
+            for zone in self.get_zones(row)[1]:
+                yield term, ZONES[zone]
+
+    def get_terms_with_prefix(self, prefix: str) -> list[str]:
+        """
+        Returns:
+            list(str): The sorted terms starting with prefix
+        """
+        encoded = prefix.encode("utf-8")
+        # 0xff never occurs in utf-8, so it sorts after every continuation
+        start, end = self.bisect(encoded), self.bisect(encoded + b"\xff")
+        return [self.get_term(row).decode("utf-8") for row in range(start, end)]
@@ -0,0 +1,124 @@
+import csv
+import math
+import os
+import sys
+from collections import Counter
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from index import Doc, build_index, process_to_tokens  # noqa: E402
+from segments import open_segments  # noqa: E402
+
+DOCS = [
+    (
+        101,
+        "Tenant v Landlord",
+        (
+            "The tenant sued the landlord. The landlord breached the lease, "
+            "and the tenant claimed damages for the breach of the lease."
+        ),
+        "2005-03-14 00:00:00",
+        "SG Court of Appeal",
+    ),
+    (
+        102,
+        "Public Prosecutor v Tan",
+        (
+            "The accused was charged with theft. Theft of property, theft of "
+            "cash: the court convicted the accused of theft."
+        ),
+        "2011-11-02 00:00:00",
+        "SG High Court",
+    ),
+    (
+        103,
+        "Estate of Lim",
+        (
+            "Probate of the will was granted. The will named the executor of "
+            "the estate, and the executor applied for probate."
+        ),
+        "1998-07-30 00:00:00",
+        "SG High Court",
+    ),
+    (
+        104,
+        "Re an application",
+        "Application dismissed.",
+        "2020-01-01 00:00:00",
+        "Singapore International Commercial Court",
+    ),
+]
+
+
+@pytest.fixture(scope="module")
+def segment(tmp_path_factory):
+    work_dir = tmp_path_factory.mktemp("index")
+    dataset = work_dir / "dataset.csv"
+    with open(dataset, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["document_id", "title", "content", "date_posted", "court"])
+        writer.writerows(DOCS)
+    out_dict = str(work_dir / "dictionary")
+    out_postings = str(work_dir / "postings")
+    build_index(str(dataset), out_dict, out_postings, workers=1)
+    (segment,) = open_segments(out_dict, out_postings)
+    return segment
+
+
+def get_zones(doc):
+    return ((doc.title, "title"), (doc.content, "content"), (doc.court, "court"))
+
+
+# return map{ (term, zone): tf } of the words and biwords of one zone
+def get_term_frequencies(text, zone):
+    tokens, biwords, _ = process_to_tokens(text, zone)
+    return Counter({**tokens, **biwords})
+
+
+def get_reference_length(text, zone):
+    tfs = get_term_frequencies(text, zone).values()
+    return math.sqrt(sum((1 + math.log10(tf)) ** 2 for tf in tfs))
+
+
+# return map{ (term, zone): lnc weight } of a doc, each zone normalized by
+# its length as stored in the metadata
+def get_reference_weights(doc, lengths):
+    weights = {}
+    for text, zone in get_zones(doc):
+        for key, tf in get_term_frequencies(text, zone).items():
+            weights[key] = (1 + math.log10(tf)) / lengths[zone]
+    weights[doc.date.split()[0], "date"] = 1.0 / lengths["date"]
+    return weights
+
+
+def test_zone_lengths_match_reference(segment):
+    for row in DOCS:
+        doc = Doc(*row)
+        lengths = segment.metadata.get_zone_lengths(doc.docID)
+        for text, zone in get_zones(doc):
+            expected = get_reference_length(text, zone)
+            assert lengths[zone] == pytest.approx(expected, rel=1e-6)
+        assert lengths["date"] == 1.0
+
+
+def test_weights_match_reference(segment):
+    expected = {}
+    for row in DOCS:
+        doc = Doc(*row)
+        lengths = segment.metadata.get_zone_lengths(doc.docID)
+        for key, weight in get_reference_weights(doc, lengths).items():
+            expected[key + (doc.docID,)] = weight
+
+    actual = {}
+    for key in segment.get_keys():
+        doc_ids, weights = segment.get_posting_list(key).decode()
+        for doc_id, weight in zip(doc_ids.tolist(), weights.tolist()):
+            actual[key + (doc_id,)] = weight
+
+    assert actual.keys() == expected.keys()
+    for key, weight in expected.items():
+        # weights and lengths are stored as float32
+        assert actual[key] == pytest.approx(weight, rel=1e-6), key
@@ -0,0 +1,66 @@
+import numpy as np
+
+from instrument import count, tracing
+from retrieve import ZONES, get_doc_ids, get_doc_priors, get_posting_list
+
+
+def get_top_docs(
+    query_weights: dict[str, float],
+    threshold: float,
+    k: int = None,
+    candidates: np.ndarray = None,
+    with_prior: bool = False,
+) -> list[tuple[int, float]]:
+    """
+    Score with vectorized scatter-adds into a dense array with one slot per
+    doc in the collection, instead of per-doc dict lookups.
+
+    Each term's zone postings are decoded as aligned docID/weight arrays and
+    mapped to doc ordinals. Zone weighted term scores and then document scores
+    are summed in the same order as the term-at-a-time scorer in search.py,
+    so the floats and ranking match it exactly.
+
+    Args:
+        query_weights (dict(str, float)): Normalized tf-idf of each query term
+        threshold (float): Docs must score strictly above this to be kept
+        k (int): Max number of docs to return, None for all relevant docs
+        candidates (np.ndarray): Sorted docIDs to restrict the results to
+        with_prior (bool): Add the static prior of each matching doc
+    Returns:
+        list((int, float)): (docID, score) from most to least relevant
+    """
+    doc_ids = get_doc_ids()
+    scores = np.zeros(len(doc_ids))
+    term_scores = np.zeros(len(doc_ids))
+
+    for term, weight in query_weights.items():
+        touched = []
+        for zone, zone_weight in ZONES.items():
+            zone_docs, zone_weights = get_posting_list(term, zone, candidates)
+            if len(zone_docs) == 0:
+                continue
+            # each doc appears once per list, so fancy-index adds are safe
+            ordinals = np.searchsorted(doc_ids, zone_docs)
+            term_scores[ordinals] += zone_weights.astype(np.float64) * zone_weight
+            touched.append(ordinals)
+
+        if touched:
+            ordinals = np.unique(np.concatenate(touched))
+            scores[ordinals] += term_scores[ordinals] * weight
+            term_scores[ordinals] = 0
+
+    if tracing():
+        count("docs_scored", int(np.count_nonzero(scores)))
+    if with_prior:
+        matched = np.flatnonzero(scores > 0)
+        scores[matched] += get_doc_priors(doc_ids[matched])
+
+    relevant = np.flatnonzero(scores > threshold)
+    if k is not None and len(relevant) > k:
+        # keep every doc tied with the k-th score so docID breaks the tie
+        kth_score = -np.partition(-scores[relevant], k - 1)[k - 1]
+        relevant = relevant[scores[relevant] >= kth_score]
+
+    order = np.lexsort((doc_ids[relevant], -scores[relevant]))[:k]
+    relevant = relevant[order]
+    return list(zip(doc_ids[relevant].tolist(), scores[relevant].tolist()))